@@ -0,0 +1,238 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks for the RTMPy hot paths.
+
+These are not part of the test suite. Each module provides a C{run} function
+that returns a list of L{Result} objects and can be run directly from the
+root of the source tree, e.g.::
+
+    python -m benchmarks.bench_demuxer
+
+L{benchmarks.run} runs them all, saves the results as a JSON baseline and
+compares later runs against it.
+"""
+
+import gc
+import math
+import sys
+import timeit
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+__all__ = [
+    'Result',
+    'measure',
+    'report',
+    'dump',
+    'load',
+    'compare'
+]
+
+
+
+class Result(object):
+    """
+    The outcome of a single benchmark.
+
+    @ivar name: A unique name for the benchmark.
+    @ivar seconds: The best time taken to run the benchmark once. C{None}
+        if the result is not a timing, in which case C{count} is the measured
+        value (e.g. a number of bytes).
+    @ivar count: The number of operations performed in C{seconds}.
+    @ivar unit: A description of an operation (e.g. C{'msg'}).
+    """
+
+    __slots__ = ('name', 'seconds', 'count', 'unit')
+
+    def __init__(self, name, seconds, count=1, unit='op'):
+        self.name = name
+        self.seconds = seconds
+        self.count = count
+        self.unit = unit
+
+
+    @property
+    def rate(self):
+        """
+        Operations per second, or the measured value if this is not a timing.
+        """
+        if self.seconds is None:
+            return self.count
+
+        if not self.seconds:
+            return 0.0
+
+        return self.count / self.seconds
+
+
+    def __repr__(self):
+        if self.seconds is None:
+            return '<%s.%s %s %r %s at 0x%x>' % (
+                self.__class__.__module__,
+                self.__class__.__name__,
+                self.name,
+                self.count,
+                self.unit,
+                id(self))
+
+        return '<%s.%s %s %.6fs %.1f %s/s at 0x%x>' % (
+            self.__class__.__module__,
+            self.__class__.__name__,
+            self.name,
+            self.seconds,
+            self.rate,
+            self.unit,
+            id(self))
+
+
+
+def measure(func, repeat=3, setup=None, minTime=0.05):
+    """
+    Returns the fastest time in seconds taken by one call to C{func}.
+
+    C{func} is called once to warm up, then timed C{repeat} times. Each timing
+    runs C{func} as many times as needed to take at least C{minTime} seconds,
+    so that short benchmarks are well above the resolution and noise of the
+    timer. As with C{timeit}, the garbage collector is disabled while timing.
+
+    @param setup: Called before each call to C{func}, outside of the timed
+        section. The return value is supplied to C{func}.
+    """
+    timer = timeit.default_timer
+
+    def time_calls(number):
+        total = 0.0
+
+        for i in xrange(number):
+            if setup is None:
+                start = timer()
+                func()
+            else:
+                arg = setup()
+                start = timer()
+                func(arg)
+
+            total += timer() - start
+
+        return total
+
+    gcold = gc.isenabled()
+    gc.disable()
+
+    try:
+        # warm up, and find how many calls make up a timing
+        t = time_calls(1)
+        number = 1
+
+        if t < minTime:
+            number = int(math.ceil(minTime / max(t, 1e-6)))
+
+        best = None
+
+        for i in xrange(repeat):
+            t = time_calls(number) / number
+
+            if best is None or t < best:
+                best = t
+    finally:
+        if gcold:
+            gc.enable()
+
+    return best
+
+
+
+def report(results, out=None):
+    """
+    Writes a human readable table of C{results} to C{out}.
+    """
+    out = out or sys.stdout
+
+    for r in results:
+        if r.seconds is None:
+            out.write('%-45s %13s %14.1f %s\n' % (
+                r.name, '-', r.count, r.unit))
+
+            continue
+
+        out.write('%-45s %12.6fs %14.1f %s/s\n' % (
+            r.name, r.seconds, r.rate, r.unit))
+
+
+
+def dump(results, out, **info):
+    """
+    Writes C{results} to the file C{out} as JSON. Any C{info} (e.g. the
+    version) is stored alongside.
+    """
+    data = dict(info)
+
+    data['results'] = dict([(r.name, {
+        'seconds': r.seconds,
+        'count': r.count,
+        'unit': r.unit,
+    }) for r in results])
+
+    json.dump(data, out, indent=2, sort_keys=True)
+    out.write('\n')
+
+
+
+def load(f):
+    """
+    Reads the results written by L{dump} from the file C{f}.
+
+    @return: A C{dict} of name to L{Result}.
+    """
+    data = json.load(f)
+    ret = {}
+
+    for name, r in data['results'].iteritems():
+        ret[name] = Result(str(name), r['seconds'], r['count'], str(r['unit']))
+
+    return ret
+
+
+
+def compare(results, baseline):
+    """
+    Compares the time per operation of each of C{results} with the
+    C{baseline} result of the same name. Results that are not timings or are
+    not in the baseline are ignored.
+
+    @param baseline: A C{dict} of name to L{Result}, see L{load}.
+    @return: A list of C{(name, baseline, result, change)} tuples, where
+        C{change} is the fractional change in the time per operation (e.g.
+        C{0.2} is 20% slower).
+    """
+    ret = []
+
+    for r in results:
+        b = baseline.get(r.name, None)
+
+        if b is None or r.seconds is None or not b.seconds:
+            continue
+
+        change = (r.seconds / r.count) / (b.seconds / b.count) - 1
+
+        ret.append((r.name, b, r, change))
+
+    return ret
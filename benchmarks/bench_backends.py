@@ -0,0 +1,129 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures RTMP chunks per second encoded and decoded (on one core) by the pure
+Python and compiled (L{rtmpy._speedups}) backends.
+
+The backend is chosen at import time, so each one is measured in a child
+process. The compiled backend is skipped if the extensions have not been
+built.
+"""
+
+import os
+import subprocess
+import sys
+
+from benchmarks import Result, report
+
+
+#: The frame size to encode at.
+FRAME_SIZE = 128
+#: The size of each message, about 10 chunks.
+BODY_LENGTH = 1200
+#: The number of messages per run.
+MESSAGES = 2000
+
+
+
+def chunks():
+    return MESSAGES * ((BODY_LENGTH + FRAME_SIZE - 1) // FRAME_SIZE)
+
+
+
+def encode():
+    from pyamf.util import BufferedByteStream
+    from rtmpy.protocol.rtmp import codec
+    from rtmpy import message
+
+    output = BufferedByteStream()
+    encoder = codec.Encoder(output)
+    encoder.setFrameSize(FRAME_SIZE)
+
+    body = 'x' * BODY_LENGTH
+
+    for i in xrange(MESSAGES):
+        encoder.send(body, message.VIDEO_DATA, 1, i * 40)
+
+        while encoder.active:
+            encoder.next()
+
+    return output.getvalue()
+
+
+
+def measure_backend():
+    """
+    Runs in the child process. Prints the encode and decode times.
+    """
+    from benchmarks import measure
+    from benchmarks.bench_demuxer import decode_stream
+    from rtmpy import _speedups
+
+    data = encode()
+
+    e = measure(encode)
+    d = measure(lambda: decode_stream(data, FRAME_SIZE))
+
+    print ','.join(_speedups.installed) or '-', e, d
+
+
+
+def run_backend(pure):
+    env = dict(os.environ)
+    env.pop('RTMPY_PURE', None)
+
+    if pure:
+        env['RTMPY_PURE'] = '1'
+
+    p = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_backends',
+        '--child'], env=env, stdout=subprocess.PIPE)
+
+    installed, e, d = p.communicate()[0].split()
+
+    if installed == '-':
+        installed = None
+
+    return installed, float(e), float(d)
+
+
+
+def run():
+    results = []
+
+    for pure in (True, False):
+        installed, e, d = run_backend(pure)
+
+        if not pure and not installed:
+            print 'compiled backend not built, skipping'
+
+            continue
+
+        name = 'pure' if pure else 'compiled'
+
+        results.append(Result('backend.%s.encode' % (name,), e, chunks(),
+            'chunk'))
+        results.append(Result('backend.%s.decode' % (name,), d, chunks(),
+            'chunk'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    if '--child' in sys.argv:
+        measure_backend()
+    else:
+        report(run())
@@ -0,0 +1,117 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Decodes large video messages to measure L{codec.ChannelDemuxer} reassembly.
+"""
+
+from pyamf.util import BufferedByteStream
+
+from rtmpy.protocol.rtmp import codec
+from rtmpy import message
+
+from benchmarks import Result, measure, report
+
+
+#: The frame sizes to decode at.
+FRAME_SIZES = (128, 4096, 65536)
+#: The size of each video message (a large key frame).
+BODY_LENGTH = 200 * 1024
+#: The number of messages to decode per run.
+MESSAGES = 20
+
+
+
+class NullDispatcher(object):
+    """
+    Counts dispatched messages.
+    """
+
+    def __init__(self):
+        self.messages = 0
+
+
+    def dispatchMessage(self, stream, datatype, timestamp, data):
+        self.messages += 1
+
+
+    def bytesInterval(self, bytes):
+        pass
+
+
+    def getStream(self, streamId):
+        return None
+
+
+
+def encode_stream(frameSize, bodyLength=BODY_LENGTH, count=MESSAGES):
+    """
+    Returns an RTMP stream containing C{count} video messages.
+    """
+    output = BufferedByteStream()
+    encoder = codec.Encoder(output)
+    encoder.setFrameSize(frameSize)
+
+    body = 'x' * bodyLength
+
+    for i in xrange(count):
+        encoder.send(body, message.VIDEO_DATA, 1, i * 40)
+
+        while encoder.active:
+            encoder.next()
+
+    return output.getvalue()
+
+
+
+def decode_stream(data, frameSize):
+    """
+    Decodes all the messages in C{data}.
+    """
+    dispatcher = NullDispatcher()
+    decoder = codec.Decoder(dispatcher, dispatcher)
+    decoder.setFrameSize(frameSize)
+
+    decoder.send(data)
+
+    try:
+        while True:
+            decoder.next()
+    except StopIteration:
+        pass
+
+    return dispatcher.messages
+
+
+
+def run():
+    results = []
+
+    for frameSize in FRAME_SIZES:
+        data = encode_stream(frameSize)
+
+        assert decode_stream(data, frameSize) == MESSAGES
+
+        t = measure(lambda: decode_stream(data, frameSize))
+
+        results.append(Result('demuxer.video_200k.frame_%d' % (frameSize,),
+            t, MESSAGES, 'msg'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
@@ -0,0 +1,81 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Decodes a recorded stream of small video messages with L{codec.Decoder.next}
+(as the protocol does) and with the batch L{codec.Decoder.feed} API.
+"""
+
+from rtmpy.protocol.rtmp import codec
+
+from benchmarks import Result, measure, report
+from benchmarks.bench_demuxer import NullDispatcher, encode_stream
+
+
+#: The size of each message (a small inter frame).
+BODY_LENGTH = 200
+#: The number of messages to decode per run.
+MESSAGES = 10000
+#: The number of bytes handed to the decoder at a time.
+READ_SIZE = 64 * 1024
+
+
+
+def decode_next(data):
+    dispatcher = NullDispatcher()
+    decoder = codec.Decoder(dispatcher, dispatcher)
+
+    for i in xrange(0, len(data), READ_SIZE):
+        decoder.send(data[i:i + READ_SIZE])
+
+        try:
+            while True:
+                decoder.next()
+        except StopIteration:
+            pass
+
+    return dispatcher.messages
+
+
+
+def decode_feed(data):
+    decoder = codec.Decoder(None, None)
+    count = 0
+
+    for i in xrange(0, len(data), READ_SIZE):
+        count += len(decoder.feed(data[i:i + READ_SIZE]))
+
+    return count
+
+
+
+def run():
+    data = encode_stream(codec.FRAME_SIZE, BODY_LENGTH, MESSAGES)
+    results = []
+
+    for name, func in (('next', decode_next), ('feed', decode_feed)):
+        assert func(data) == MESSAGES
+
+        t = measure(lambda: func(data))
+
+        results.append(Result('decoder.%s.video_200' % (name,), t, MESSAGES,
+            'msg'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
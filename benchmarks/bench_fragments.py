@@ -0,0 +1,144 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Relays large key frames from a decoder to a subscriber's
+L{codec.StreamingChannel}, either once each message is complete or a fragment
+at a time (see L{codec.Decoder.streamingTypes}).
+
+Besides the time taken, reports how many bytes of the first message had to be
+received before anything was written to the subscriber.
+"""
+
+from rtmpy.protocol.rtmp import codec
+from rtmpy import message
+
+from benchmarks import Result, measure, report
+from benchmarks.bench_demuxer import encode_stream
+
+
+#: The frame size of the publisher and subscriber.
+FRAME_SIZE = 4096
+#: The size of each video message (a large key frame).
+BODY_LENGTH = 512 * 1024
+#: The number of messages to relay per run.
+MESSAGES = 10
+#: The number of bytes handed to the decoder at a time (one socket read).
+READ_SIZE = 16 * 1024
+
+
+
+class CountingTransport(object):
+    """
+    Counts the bytes written to it.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+
+
+    def write(self, data):
+        self.bytes += len(data)
+
+
+    def writeSequence(self, seq):
+        for data in seq:
+            self.bytes += len(data)
+
+
+
+class RelayDispatcher(object):
+    """
+    Passes every video message or fragment on to a subscriber.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+
+
+    def dispatchMessage(self, stream, datatype, timestamp, data):
+        self.channel.sendData(data, timestamp)
+
+
+    def dispatchFragment(self, stream, datatype, timestamp, data, marker,
+                         bodyLength):
+        self.channel.sendFragment(data, timestamp, marker, bodyLength)
+
+
+    def bytesInterval(self, bytes):
+        pass
+
+
+    def getStream(self, streamId):
+        return None
+
+
+
+def relay(data, fragments):
+    """
+    Feeds C{data} to a decoder a read at a time.
+
+    @return: The number of bytes fed before the subscriber was first written
+        to.
+    """
+    transport = CountingTransport()
+
+    s = codec.StreamingChannel(codec.Encoder(None).acquireChannel(), 1,
+        transport)
+    s.setType(message.VIDEO_DATA)
+    s.channel.setFrameSize(FRAME_SIZE)
+
+    dispatcher = RelayDispatcher(s)
+    decoder = codec.Decoder(dispatcher, dispatcher)
+    decoder.setFrameSize(FRAME_SIZE)
+
+    if fragments:
+        decoder.streamingTypes = (message.VIDEO_DATA,)
+
+    firstByte = None
+
+    for i in xrange(0, len(data), READ_SIZE):
+        decoder.send(data[i:i + READ_SIZE])
+        decoder.drain()
+
+        if firstByte is None and transport.bytes:
+            firstByte = min(i + READ_SIZE, len(data))
+
+    assert transport.bytes >= MESSAGES * BODY_LENGTH
+
+    return firstByte
+
+
+
+def run():
+    results = []
+    data = encode_stream(FRAME_SIZE, BODY_LENGTH, MESSAGES)
+
+    for fragments in (False, True):
+        name = 'relay.keyframe_512k.%s' % (
+            'fragments' if fragments else 'whole',)
+
+        t = measure(lambda: relay(data, fragments))
+
+        results.append(Result(name, t, MESSAGES, 'msg'))
+        results.append(Result(name + '.first_byte', None,
+            relay(data, fragments), 'bytes'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
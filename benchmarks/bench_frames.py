@@ -0,0 +1,103 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Measures the frame layer on its own: L{codec.FrameReader.readFrame} splitting
+an RTMP stream into frames (no reassembly or dispatch) and
+L{codec.Encoder.next} producing one.
+"""
+
+from rtmpy.protocol.rtmp import codec
+from rtmpy import message
+
+from benchmarks import Result, measure, report
+from benchmarks.bench_demuxer import encode_stream
+
+
+#: The number of messages per run.
+MESSAGES = 5000
+
+#: Name -> (body length, frame size)
+STREAMS = [
+    ('video_200', 200, codec.FRAME_SIZE),
+    ('video_4k.frame_128', 4096, 128),
+    ('video_4k.frame_4096', 4096, 4096),
+]
+
+
+
+class NullOutput(object):
+    """
+    Discards the encoded stream.
+    """
+
+    def write(self, data):
+        pass
+
+
+
+def read_frames(data, frameSize):
+    reader = codec.FrameReader()
+    reader.setFrameSize(frameSize)
+    reader.send(data)
+
+    readFrame = reader.readFrame
+    frames = 0
+
+    while readFrame() is not None:
+        frames += 1
+
+    return frames
+
+
+
+def encode(bodyLength, frameSize):
+    encoder = codec.Encoder(NullOutput())
+    encoder.setFrameSize(frameSize)
+
+    body = 'x' * bodyLength
+
+    for i in xrange(MESSAGES):
+        encoder.send(body, message.VIDEO_DATA, 1, i * 40)
+
+        while encoder.active:
+            encoder.next()
+
+
+
+def run():
+    results = []
+
+    for name, bodyLength, frameSize in STREAMS:
+        data = encode_stream(frameSize, bodyLength, MESSAGES)
+        frames = read_frames(data, frameSize)
+
+        assert frames == MESSAGES * (-(-bodyLength // frameSize))
+
+        t = measure(lambda: read_frames(data, frameSize))
+        results.append(Result('frames.readFrame.%s' % (name,), t, frames,
+            'frame'))
+
+        t = measure(lambda: encode(bodyLength, frameSize))
+        results.append(Result('frames.encoder_next.%s' % (name,), t, frames,
+            'frame'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
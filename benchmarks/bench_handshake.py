@@ -0,0 +1,126 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Negotiates the server side of RTMP handshakes in memory to measure handshakes
+per second with each L{util.generateBytes} strategy.
+"""
+
+import random
+
+from rtmpy.protocol.rtmp import handshake
+from rtmpy import util
+
+from benchmarks import Result, measure, report
+
+
+#: The number of handshakes per run.
+HANDSHAKES = 500
+
+
+
+def legacy_generateBytes(length, readable=False):
+    """
+    The original implementation of L{util.generateBytes}.
+    """
+    bytes = ''
+
+    i, j = 0, 0xff
+
+    if readable:
+        i, j = 0x41, 0x7a
+
+    for x in xrange(0, length):
+        bytes += chr(random.randint(i, j))
+
+    return bytes
+
+
+
+class Peer(object):
+    """
+    Observer and transport for the server side of the handshake.
+    """
+
+    def __init__(self):
+        self.succeeded = False
+
+
+    def write(self, data):
+        pass
+
+
+    def handshakeSuccess(self, data):
+        self.succeeded = True
+
+
+
+#: The client syn packet.
+CLIENT_SYN = '\x00' * 8 + 'c' * (handshake.handshake.HANDSHAKE_LENGTH - 8)
+
+
+
+def negotiate():
+    """
+    Runs the server side of a handshake, as performed per connection. The
+    client ack echoes the server syn, as a real client would.
+    """
+    peer = Peer()
+
+    s = handshake.ServerNegotiator(peer, peer)
+    s.start(0, 0)
+
+    s.dataReceived(CLIENT_SYN)
+    s.dataReceived('\x00' * 8 + s.my_syn.payload)
+
+    assert peer.succeeded
+
+
+
+def handshakes():
+    for i in xrange(HANDSHAKES):
+        negotiate()
+
+
+
+def run():
+    results = []
+    generateBytes = util.generateBytes
+
+    strategies = [
+        ('legacy', legacy_generateBytes, None),
+        ('urandom', generateBytes, None),
+        ('pool', generateBytes, util.RandomPool()),
+    ]
+
+    try:
+        for name, func, pool in strategies:
+            util.generateBytes = func
+            util.randomPool = pool
+
+            t = measure(handshakes)
+
+            results.append(Result('handshake.%s' % (name,), t, HANDSHAKES,
+                'handshake'))
+    finally:
+        util.generateBytes = generateBytes
+        util.randomPool = None
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
@@ -0,0 +1,186 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares L{header.encode}/L{header.decode} against the original field by field
+implementation.
+"""
+
+from pyamf.util import BufferedByteStream
+from pyamf.util.pure import BufferedByteStream as PureBufferedByteStream
+
+from rtmpy.protocol.rtmp import header
+
+from benchmarks import Result, measure, report
+
+
+#: Number of headers encoded/decoded per run.
+ITERATIONS = 20000
+
+#: Name -> (header, previous)
+HEADERS = [
+    ('full', header.Header(3, 10, 9, 500, 1), None),
+    ('relative', header.Header(3, 10, 9, 500, 1), header.Header(3, 0, 8, 5, 1)),
+    ('timestamp', header.Header(3, 10, 9, 500, 1), header.Header(3, 0, 9, 500, 1)),
+    ('continuation', header.Header(3, 10, 9, 500, 1),
+        header.Header(3, 10, 9, 500, 1)),
+    ('extended', header.Header(3, 0x1000000, 9, 500, 1), None),
+]
+
+
+
+def legacy_encode(stream, h, previous=None):
+    """
+    The original stream based encoder.
+    """
+    if previous is None:
+        mask = 0
+    else:
+        if h.continuation:
+            mask = 0xc0
+        else:
+            mask = header.get_size_mask(h, previous)
+
+    channelId = h.channelId + 2
+
+    if channelId < 64:
+        stream.write_uchar(mask | channelId)
+    elif channelId < 320:
+        stream.write_uchar(mask)
+        stream.write_uchar(channelId - 64)
+    else:
+        channelId -= 64
+
+        stream.write_uchar(mask + 1)
+        stream.write_uchar(channelId & 0xff)
+        stream.write_uchar(channelId >> 0x08)
+
+    if mask == 0xc0:
+        return
+
+    if mask <= 0x80:
+        if h.timestamp >= 0xffffff:
+            stream.write_24bit_uint(0xffffff)
+        else:
+            stream.write_24bit_uint(h.timestamp)
+
+    if mask <= 0x40:
+        stream.write_24bit_uint(h.bodyLength)
+        stream.write_uchar(h.datatype)
+
+    if mask == 0:
+        stream.endian = '<'
+        stream.write_ulong(h.streamId)
+        stream.endian = '!'
+
+    if mask <= 0x80:
+        if h.timestamp >= 0xffffff:
+            stream.write_ulong(h.timestamp)
+
+
+
+def legacy_decode(stream):
+    """
+    The original stream based decoder.
+    """
+    channelId = stream.read_uchar()
+    bits = channelId >> 6
+    channelId &= 0x3f
+
+    if channelId == 0:
+        channelId = stream.read_uchar() + 64
+
+    if channelId == 1:
+        channelId = stream.read_uchar() + 64 + (stream.read_uchar() << 8)
+
+    h = header.Header(channelId - 2)
+
+    if bits == 3:
+        h.continuation = True
+
+        return h
+
+    h.timestamp = stream.read_24bit_uint()
+
+    if bits < 2:
+        h.bodyLength = stream.read_24bit_uint()
+        h.datatype = stream.read_uchar()
+
+    if bits < 1:
+        stream.endian = '<'
+        h.streamId = stream.read_ulong()
+        stream.endian = '!'
+
+        h.full = True
+
+    if h.timestamp == 0xffffff:
+        h.timestamp = stream.read_ulong()
+
+    return h
+
+
+
+def encode_all(encode, h, previous, stream_class=BufferedByteStream):
+    stream = stream_class()
+
+    for i in xrange(ITERATIONS):
+        encode(stream, h, previous)
+
+    return stream
+
+
+
+def decode_all(decode, bytes, stream_class=BufferedByteStream):
+    stream = stream_class(bytes * ITERATIONS)
+
+    for i in xrange(ITERATIONS):
+        decode(stream)
+
+
+
+def run():
+    results = []
+    streams = [('', BufferedByteStream)]
+
+    if PureBufferedByteStream is not BufferedByteStream:
+        streams.append(('.pure', PureBufferedByteStream))
+
+    for name, h, previous in HEADERS:
+        bytes = header.pack(h, previous)
+
+        for suffix, cls in streams:
+            for impl, encode, decode in [
+                    ('legacy', legacy_encode, legacy_decode),
+                    ('struct', header.encode, header.decode)]:
+                t = measure(lambda: encode_all(encode, h, previous, cls),
+                    repeat=5)
+                results.append(Result('header.encode.%s.%s%s' % (
+                    name, impl, suffix), t, ITERATIONS, 'hdr'))
+
+                t = measure(lambda: decode_all(decode, bytes, cls), repeat=5)
+                results.append(Result('header.decode.%s.%s%s' % (
+                    name, impl, suffix), t, ITERATIONS, 'hdr'))
+
+        t = measure(lambda: [header.unpack_from(bytes)
+            for i in xrange(ITERATIONS)], repeat=5)
+        results.append(Result('header.unpack_from.%s' % (name,), t,
+            ITERATIONS, 'hdr'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
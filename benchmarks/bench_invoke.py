@@ -0,0 +1,146 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Encodes the messages that the server sends each connection that plays a
+stream (the C{connect} result and the C{onStatus} notifications), with and
+without L{message.EncodeCache}.
+
+The client ids cycle through a small range, as the stream ids do on a busy
+server, so most of the notifications are repeated.
+
+The same messages are also encoded and decoded without the cache in AMF0
+(L{message.Invoke}) and AMF3 (L{message.FlexMessage}).
+"""
+
+from pyamf.util import BufferedByteStream
+
+from rtmpy import message, status
+
+from benchmarks import Result, measure, report
+
+
+#: The number of connections per run.
+CONNECTIONS = 1000
+#: The number of distinct client ids.
+CLIENT_IDS = 50
+
+
+
+def connection_messages(clientId):
+    name = 'livestream'
+
+    return [
+        message.Invoke('_result', 1, {'fmsVer': 'FMS/3,5,1,516',
+            'capabilities': 31, 'mode': 1}, status.status(
+                'NetConnection.Connect.Success', 'Connection succeeded.',
+                objectEncoding=0)),
+        message.Invoke('_result', 2, None, 1),
+        message.Invoke('onStatus', 0, None, status.status(
+            'NetStream.Play.Reset', 'Playing and resetting %s' % (name,),
+            clientid=clientId)),
+        message.Invoke('onStatus', 0, None, status.status(
+            'NetStream.Play.Start', 'Started playing %s' % (name,),
+            clientid=clientId)),
+        message.Notify('onStatus', {'code': 'NetStream.Data.Start'}),
+    ]
+
+
+
+def encode(msgs, cache):
+    message.Invoke.encodeCache = message.Notify.encodeCache = cache
+
+    for msg in msgs:
+        msg.encode(BufferedByteStream())
+
+
+
+def encode_bodies(cls, msgs):
+    """
+    Returns the encoded bodies of C{msgs} as instances of C{cls}.
+    """
+    bodies = []
+
+    for msg in msgs:
+        buf = BufferedByteStream()
+        m = cls(msg.name, msg.id, *msg.argv)
+        m.encodeCache = None
+        m.encode(buf)
+
+        bodies.append(buf.getvalue())
+
+    return bodies
+
+
+
+def decode(cls, bodies):
+    for body in bodies:
+        cls().decode(BufferedByteStream(body))
+
+
+
+def run_encodings(msgs):
+    msgs = [m for m in msgs if isinstance(m, message.Invoke)]
+    results = []
+
+    for name, cls in (('amf0', message.Invoke), ('amf3', message.FlexMessage)):
+        t = measure(lambda: encode_bodies(cls, msgs))
+        results.append(Result('invoke.%s.encode' % (name,), t, len(msgs),
+            'msg'))
+
+        bodies = encode_bodies(cls, msgs)
+
+        t = measure(lambda: decode(cls, bodies))
+        results.append(Result('invoke.%s.decode' % (name,), t, len(msgs),
+            'msg'))
+
+    return results
+
+
+
+def run():
+    msgs = []
+
+    for i in xrange(CONNECTIONS):
+        msgs.extend(connection_messages(i % CLIENT_IDS))
+
+    default = message.Invoke.encodeCache
+    results = []
+
+    try:
+        t = measure(lambda: encode(msgs, None))
+        results.append(Result('invoke.encode.uncached', t, len(msgs), 'msg'))
+
+        # each run starts with an empty cache
+        t = measure(lambda cache: encode(msgs, cache),
+            setup=message.EncodeCache)
+        results.append(Result('invoke.encode.cached', t, len(msgs), 'msg'))
+
+        cache = message.EncodeCache()
+        encode(msgs, cache)
+
+        results.append(Result('invoke.encode.cached.hit_rate', None,
+            round(cache.getStats()['hitRate'] * 100, 1), '%'))
+    finally:
+        message.Invoke.encodeCache = message.Notify.encodeCache = default
+
+    results.extend(run_encodings(msgs))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
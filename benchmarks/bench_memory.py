@@ -0,0 +1,211 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures the memory held by the RTMP codecs of a connection: when idle, per
+channel referenced by the peer and per channel used to send messages.
+
+These results are sizes in bytes, not timings. They are taken from the growth
+of the resident set size of a child process per scenario (Linux only), which,
+unlike C{sys.getsizeof}, includes the buffers of the C extension types.
+"""
+
+import resource
+import subprocess
+import sys
+
+from pyamf.util import BufferedByteStream
+
+from rtmpy.protocol.rtmp import codec, header
+from rtmpy import message
+
+from benchmarks import Result, report
+
+
+#: The number of connections used for the idle connection result.
+CONNECTIONS = 1000
+#: The number of channels used for the per channel results.
+CHANNELS = 10000
+
+
+
+class NullOutput(object):
+    """
+    Discards everything written to it.
+    """
+
+    def write(self, data):
+        pass
+
+
+
+class NullDispatcher(object):
+    """
+    Discards decoded messages.
+    """
+
+    def dispatchMessage(self, stream, datatype, timestamp, data):
+        pass
+
+
+    def getStream(self, streamId):
+        pass
+
+
+
+def build_connection():
+    """
+    Returns the decoder and encoder of an idle connection that has exchanged
+    a control message with its peer.
+    """
+    d = NullDispatcher()
+    decoder = codec.Decoder(d, d)
+    encoder = codec.Encoder(NullOutput())
+
+    encoder.send('\x00\x00\x10\x00', message.FRAME_SIZE, 0, 0)
+
+    decoder.send(encode_message(2, '\x00\x00\x10\x00', message.FRAME_SIZE))
+    list(decoder)
+
+    return decoder, encoder
+
+
+
+def encode_message(channelId, data, datatype=message.INVOKE):
+    stream = BufferedByteStream()
+    h = header.Header(channelId, 0, datatype, len(data), 0)
+
+    header.encode(stream, h)
+    stream.write(data)
+
+    return stream.getvalue()
+
+
+
+def peer_channels(decoder):
+    """
+    The peer sends a message on each of C{CHANNELS} channel ids.
+    """
+    for i in xrange(CHANNELS):
+        decoder.send(encode_message(i + 3, 'x'))
+
+    list(decoder)
+
+
+
+def sent_channels(encoder, flush):
+    """
+    Sends a message on C{CHANNELS} channels at once.
+    """
+    for i in xrange(CHANNELS):
+        encoder.send('x' * 100, message.VIDEO_DATA, 1, 0)
+
+    if flush:
+        list(encoder)
+
+
+
+def rss():
+    """
+    Returns the resident set size of this process in bytes.
+    """
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+
+    return pages * resource.getpagesize()
+
+
+
+def peer():
+    decoder, encoder = build_connection()
+    peer_channels(decoder)
+
+    return decoder, encoder
+
+
+
+def active():
+    decoder, encoder = build_connection()
+    sent_channels(encoder, False)
+
+    return decoder, encoder
+
+
+
+def released():
+    decoder, encoder = build_connection()
+    sent_channels(encoder, True)
+
+    return decoder, encoder
+
+
+
+def idle():
+    return [build_connection() for i in xrange(CONNECTIONS)]
+
+
+
+#: name -> (scenario, the number of items it measures)
+SCENARIOS = [
+    ('idle_connection', idle, CONNECTIONS),
+    ('peer_channel', peer, CHANNELS),
+    ('active_channel', active, CHANNELS),
+    ('released_channel', released, CHANNELS),
+]
+
+
+
+def measure_scenario(name):
+    """
+    Runs in the child process. Prints the bytes per item of scenario
+    C{name}.
+    """
+    for n, func, count in SCENARIOS:
+        if n == name:
+            break
+    else:
+        raise KeyError(name)
+
+    # warm up any lazily imported/allocated state
+    build_connection()
+
+    before = rss()
+    keep = func()
+    after = rss()
+
+    print (after - before) // count
+
+
+
+def run():
+    results = []
+
+    for name, func, count in SCENARIOS:
+        p = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_memory',
+            '--child', name], stdout=subprocess.PIPE)
+
+        size = int(p.communicate()[0])
+
+        results.append(Result('memory.%s' % (name,), None, size, 'byte'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    if '--child' in sys.argv:
+        measure_scenario(sys.argv[-1])
+    else:
+        report(run())
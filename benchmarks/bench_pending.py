@@ -0,0 +1,90 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Stresses the pending queue and channel allocator of L{codec.ChannelMuxer}:
+messages are queued while every channel is in use and then drained as
+channels are released a few at a time.
+"""
+
+from rtmpy.protocol.rtmp import codec
+from rtmpy import message
+
+from benchmarks import Result, measure, report
+
+
+#: The number of messages queued while the channel pool is saturated.
+MESSAGES = 10000
+#: The number of channels released before each call to C{next}.
+RELEASED = 100
+
+
+
+class NullOutput(object):
+    """
+    Discards everything written to it.
+    """
+
+    def write(self, data):
+        pass
+
+
+
+def saturate():
+    """
+    Returns an encoder with every channel acquired.
+    """
+    encoder = codec.Encoder(NullOutput())
+    channels = []
+
+    while True:
+        c = encoder.acquireChannel()
+
+        if c is None:
+            break
+
+        channels.append(c)
+
+    return encoder, channels
+
+
+
+def stress(args):
+    encoder, channels = args
+    body = 'x' * 10
+
+    for i in xrange(MESSAGES):
+        encoder.send(body, message.AUDIO_DATA, 1, i)
+
+    while encoder.pending:
+        for i in xrange(RELEASED):
+            encoder.releaseChannel(channels.pop().channelId)
+
+        encoder.next()
+
+    assert not encoder.pending
+
+
+
+def run():
+    t = measure(stress, setup=saturate)
+
+    return [Result('muxer.pending.saturated_%d' % (MESSAGES,), t, MESSAGES,
+        'msg')]
+
+
+
+if __name__ == '__main__':
+    report(run())
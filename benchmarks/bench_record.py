@@ -0,0 +1,107 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Records a stream of audio/video tags to an FLV file.
+
+C{record.sync} writes each tag as it arrives, as a recorder running on the
+reactor thread would. C{record.batched} writes the same tags in batches, as
+L{server.StreamRecorder} does from its thread pool. C{record.event_loop} is
+the time the reactor spends handing the tags to the recorder.
+"""
+
+import os
+import tempfile
+
+from twisted.internet import defer
+
+from rtmpy import flv, server
+
+from benchmarks import Result, measure, report
+
+
+#: The number of tags recorded per run.
+TAGS = 5000
+#: The size of each tag.
+TAG_LENGTH = 2 * 1024
+#: The number of tags written at a time by C{record.batched}.
+BATCH = 50
+
+
+
+class QueuedRecorder(server.StreamRecorder):
+    """
+    Never runs the writes, so that only the work done on the reactor thread
+    is measured.
+    """
+
+    def deferToThread(self, func, *args):
+        return defer.Deferred()
+
+
+def make_tags():
+    video = '\x27\x01' + '\x00' * (TAG_LENGTH - 2)
+
+    return [(flv.TAG_VIDEO, i * 40, video) for i in xrange(TAGS)]
+
+
+
+def write(path, tags, batch):
+    writer = flv.FLVWriter(path)
+
+    for i in xrange(0, len(tags), batch):
+        writer.write(tags[i:i + batch])
+
+    writer.close()
+
+
+
+def event_loop(path, tags):
+    r = QueuedRecorder(path, threadpool=object())
+    r.maxBufferBytes = TAGS * TAG_LENGTH
+
+    for tagType, timestamp, data in tags:
+        r.videoDataReceived(data, timestamp)
+
+    assert len(r.pending) == TAGS - 1
+
+
+
+def run():
+    fd, path = tempfile.mkstemp(suffix='.flv')
+    os.close(fd)
+
+    tags = make_tags()
+    results = []
+
+    try:
+        for name, batch in (('sync', 1), ('batched', BATCH)):
+            t = measure(lambda: write(path, tags, batch))
+
+            results.append(Result('record.%s' % (name,), t, TAGS, 'tag'))
+
+        t = measure(lambda: event_loop(path, tags))
+        results.append(Result('record.event_loop', t, TAGS, 'tag'))
+    finally:
+        for p in (path, path + flv.INDEX_SUFFIX):
+            if os.path.exists(p):
+                os.remove(p)
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
@@ -0,0 +1,99 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Relays video messages to many subscribers through L{codec.StreamingChannel},
+with and without the shared C{frames} cache.
+"""
+
+from rtmpy.protocol.rtmp import codec
+from rtmpy import message
+
+from benchmarks import Result, measure, report
+
+
+#: The number of subscribers each message is relayed to.
+SUBSCRIBERS = (10, 100)
+#: The size of each video message.
+BODY_LENGTH = 64 * 1024
+#: The number of messages to relay per run.
+MESSAGES = 20
+
+
+
+class NullTransport(object):
+    """
+    Discards everything written to it.
+    """
+
+    def write(self, data):
+        pass
+
+
+    def writeSequence(self, seq):
+        pass
+
+
+
+def build_channels(count):
+    channels = []
+
+    for i in xrange(count):
+        encoder = codec.Encoder(None)
+        s = codec.StreamingChannel(encoder.acquireChannel(), 1,
+            NullTransport())
+        s.setType(message.VIDEO_DATA)
+
+        channels.append(s)
+
+    return channels
+
+
+
+def relay(channels, body, shared):
+    for i in xrange(MESSAGES):
+        timestamp = i * 40
+
+        if shared:
+            frames = {}
+
+            for s in channels:
+                s.sendData(body, timestamp, frames)
+        else:
+            for s in channels:
+                s.sendData(body, timestamp)
+
+
+
+def run():
+    results = []
+    body = 'x' * BODY_LENGTH
+
+    for count in SUBSCRIBERS:
+        for shared in (False, True):
+            channels = build_channels(count)
+
+            t = measure(lambda: relay(channels, body, shared))
+
+            results.append(Result('relay.video_64k.subscribers_%d.%s' % (
+                count, 'shared' if shared else 'plain'),
+                t, MESSAGES * count, 'msg'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
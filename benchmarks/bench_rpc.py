@@ -0,0 +1,115 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Measures the dispatch of RPC calls to exposed methods, both directly through
+L{rpc.callExposedMethod} and through L{rpc.AbstractCallHandler.callReceived}
+as an invoke from the peer is handled (including the C{_result} reply).
+"""
+
+from rtmpy import rpc
+
+from benchmarks import Result, measure, report
+
+
+#: The number of calls per run.
+CALLS = 50000
+
+
+
+class Base(object):
+    """
+    Exposes a method on a base class so that the lookup descends the mro.
+    """
+
+    @rpc.expose
+    def inherited(self, *args):
+        return args
+
+
+
+class Handler(rpc.AbstractCallHandler, Base):
+    """
+    Exposes methods and discards the replies.
+    """
+
+    def __init__(self):
+        rpc.AbstractCallHandler.__init__(self)
+
+        self.sent = 0
+
+
+    def sendMessage(self, msg, whenDone=None):
+        self.sent += 1
+
+
+    @rpc.expose
+    def play(self, name, start=-2):
+        return name
+
+
+    @rpc.expose('@setDataFrame')
+    def setDataFrame(self, name, data):
+        return data
+
+
+
+def direct(obj, name, args):
+    call = rpc.callExposedMethod
+
+    for i in xrange(CALLS):
+        call(obj, name, *args)
+
+
+
+def received(handler, name, args):
+    callReceived = handler.callReceived
+
+    for i in xrange(CALLS):
+        callReceived(name, i + 1, *args)
+
+
+
+def run():
+    results = []
+    handler = Handler()
+
+    for name, args in [
+            ('play', ('livestream',)),
+            ('@setDataFrame', ('onMetaData', {'width': 320})),
+            ('inherited', (1, 2))]:
+        label = name.lstrip('@')
+
+        handler.sent = 0
+        received(handler, name, args)
+
+        # each call is answered
+        assert handler.sent == CALLS
+
+        t = measure(lambda: direct(handler, name, args))
+        results.append(Result('rpc.callExposedMethod.%s' % (label,), t, CALLS,
+            'call'))
+
+        t = measure(lambda: received(handler, name, args))
+        results.append(Result('rpc.callReceived.%s' % (label,), t, CALLS,
+            'call'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
@@ -0,0 +1,127 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures the latency of audio messages while a large C{Invoke} result is
+being encoded alongside a/v, for each of the muxer schedulers.
+
+The delay of an audio message is the number of bytes the encoder writes
+between the message being sent and its last frame, converted to time on a
+link of C{LINK_RATE}. Unlike the other benchmarks, the C{seconds} of these
+results are simulated delays (mean, max and jitter, i.e. standard deviation)
+rather than wall clock times.
+"""
+
+import math
+
+from rtmpy.protocol.rtmp import codec, scheduler
+from rtmpy import message
+
+from benchmarks import Result, report
+
+
+#: The schedulers that are compared.
+SCHEDULERS = (
+    ('round_robin', scheduler.RoundRobinScheduler),
+    ('weighted', scheduler.WeightedScheduler),
+)
+#: Bytes per second of the simulated link (2Mbit/s).
+LINK_RATE = 2 * 1000 * 1000 / 8
+#: The size of the Invoke result.
+INVOKE_LENGTH = 512 * 1024
+#: The size of an audio/video message.
+AUDIO_LENGTH = 200
+VIDEO_LENGTH = 4000
+#: The number of encoder rounds to run. An audio message is sent every round
+#  and a video message every other round.
+ROUNDS = 400
+
+
+
+class CountingOutput(object):
+    """
+    Counts the bytes written to it.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+
+
+    def write(self, data):
+        self.bytes += len(data)
+
+
+
+def run_scheduler(scheduler_class):
+    """
+    @return: A list of delays, in seconds, of the audio messages.
+    """
+    output = CountingOutput()
+    encoder = codec.Encoder(output)
+    encoder.scheduler = scheduler_class()
+
+    delays = []
+
+    def track():
+        sent = output.bytes
+
+        def done():
+            # the last frame has been written to the stream but not flushed
+            written = output.bytes + len(encoder.stream) - sent
+            delays.append(float(written) / LINK_RATE)
+
+        return done
+
+    audio = 'a' * AUDIO_LENGTH
+    video = 'v' * VIDEO_LENGTH
+
+    encoder.send('i' * INVOKE_LENGTH, message.INVOKE, 0, 0)
+
+    for i in xrange(ROUNDS):
+        encoder.send(audio, message.AUDIO_DATA, 1, i * 23, track())
+
+        if i % 2 == 0:
+            encoder.send(video, message.VIDEO_DATA, 1, i * 23)
+
+        encoder.next()
+
+    return delays
+
+
+
+def run():
+    results = []
+
+    for name, scheduler_class in SCHEDULERS:
+        delays = run_scheduler(scheduler_class)
+        count = len(delays)
+
+        mean = sum(delays) / count
+        jitter = math.sqrt(sum([(d - mean) ** 2 for d in delays]) / count)
+        # float noise would otherwise show as an absurd rate
+        jitter = round(jitter, 9)
+
+        prefix = 'scheduler.audio_delay.%s.' % (name,)
+
+        results.append(Result(prefix + 'mean', mean, 1, 'msg'))
+        results.append(Result(prefix + 'max', max(delays), 1, 'msg'))
+        results.append(Result(prefix + 'jitter', jitter, 1, 'msg'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
@@ -0,0 +1,67 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hands an RTMP stream to L{codec.Decoder} in small pieces, as a slow or lossy
+network would, and drains it after each one the way the protocol does.
+Most calls find a partial header or frame in the buffer.
+"""
+
+from rtmpy.protocol.rtmp import codec
+
+from benchmarks import Result, measure, report
+from benchmarks.bench_demuxer import NullDispatcher, encode_stream
+
+
+#: The sizes of the pieces the stream is split into: single bytes, small
+#: segments and a typical TCP payload over ethernet.
+SEGMENT_SIZES = (1, 64, 1460)
+#: The size of each message.
+BODY_LENGTH = 1024
+#: The number of messages to decode per run.
+MESSAGES = 100
+
+
+
+def decode(data, segmentSize):
+    dispatcher = NullDispatcher()
+    decoder = codec.Decoder(dispatcher, dispatcher)
+
+    for i in xrange(0, len(data), segmentSize):
+        decoder.send(data[i:i + segmentSize])
+        decoder.drain()
+
+    return dispatcher.messages
+
+
+
+def run():
+    data = encode_stream(codec.FRAME_SIZE, BODY_LENGTH, MESSAGES)
+    results = []
+
+    for size in SEGMENT_SIZES:
+        assert decode(data, size) == MESSAGES
+
+        t = measure(lambda: decode(data, size))
+
+        results.append(Result('decoder.segments_%d' % (size,), t, len(data),
+            'byte'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
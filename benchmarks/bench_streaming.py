@@ -0,0 +1,138 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures messages per second through L{codec.StreamingChannel.sendData}
+with the header templates against the original per message L{header.Header}
+and L{header.pack}.
+"""
+
+from rtmpy.protocol.rtmp import codec, header
+from rtmpy import message
+
+from benchmarks import Result, measure, report
+
+
+#: The number of messages sent per run.
+MESSAGES = 20000
+
+#: Name -> (body lengths, timestamp delta). Audio messages repeat the same
+#  length and delta (type 3 headers), video messages vary in length (type 1).
+STREAMS = [
+    ('audio', (200,), 23),
+    ('audio_varying_delta', (200,), None),
+    ('video', (1500, 900, 4000, 300), 40),
+    ('video_extended', (1500, 900, 4000, 300), 0x1000000),
+]
+
+
+
+class NullTransport(object):
+    """
+    Discards everything written to it.
+    """
+
+    def write(self, data):
+        pass
+
+
+    def writeSequence(self, seq):
+        pass
+
+
+
+class LegacyStreamingChannel(codec.StreamingChannel):
+    """
+    Builds and packs a new header for every message.
+    """
+
+    _lastHeader = None
+
+
+    def _encodeHeader(self, timestamp, bodyLength):
+        c = self.channel
+
+        if timestamp < c.timestamp:
+            relTimestamp = timestamp
+        else:
+            relTimestamp = timestamp - c.timestamp
+
+        h = header.Header(c.channelId, relTimestamp, self.type, bodyLength,
+            self.streamId)
+
+        if self._lastHeader is None:
+            h.full = True
+
+        c.setHeader(h)
+
+        prefix = header.pack(h, self._lastHeader)
+        self._lastHeader = h
+
+        return prefix
+
+
+
+def build_messages(lengths, delta):
+    messages = []
+    timestamp = 0
+
+    for i in xrange(MESSAGES):
+        if delta is None:
+            # alternate between two deltas, as 44.1kHz audio does
+            timestamp += 23 if i % 2 else 24
+        else:
+            timestamp += delta
+
+        messages.append(('x' * lengths[i % len(lengths)], timestamp))
+
+    return messages
+
+
+
+def send(cls, messages, shared):
+    s = cls(codec.Encoder(None).acquireChannel(), 1, NullTransport())
+    s.setType(message.VIDEO_DATA)
+
+    if shared:
+        for data, timestamp in messages:
+            s.sendData(data, timestamp, {})
+    else:
+        for data, timestamp in messages:
+            s.sendData(data, timestamp)
+
+
+
+def run():
+    results = []
+
+    for name, lengths, delta in STREAMS:
+        messages = build_messages(lengths, delta)
+
+        for shared in (False, True):
+            for impl, cls in [
+                    ('legacy', LegacyStreamingChannel),
+                    ('template', codec.StreamingChannel)]:
+                t = measure(lambda: send(cls, messages, shared), repeat=5)
+
+                results.append(Result('streaming.%s.%s.%s' % (name,
+                    'shared' if shared else 'plain', impl), t, MESSAGES,
+                    'msg'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
@@ -0,0 +1,124 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Indexes a recorded FLV file with L{flv.FLVFile} and reads every tag from the
+memory map, as L{server.FilePlayer} does when a client plays it.
+"""
+
+import os
+import tempfile
+
+from rtmpy import flv
+
+from benchmarks import Result, measure, report
+
+
+#: The number of seconds of media in the file.
+DURATION = 600
+#: Video frames per second. One in every C{GOP} is a key frame.
+FPS = 25
+GOP = 50
+#: The size of a key frame and an inter frame.
+KEYFRAME_LENGTH = 32 * 1024
+FRAME_LENGTH = 2 * 1024
+#: Audio tags per second and their size.
+AUDIO_RATE = 43
+AUDIO_LENGTH = 200
+
+
+
+def write_file(path):
+    tags = []
+
+    for i in xrange(DURATION * FPS):
+        if i % GOP == 0:
+            data = '\x17\x01' + '\x00' * (KEYFRAME_LENGTH - 2)
+        else:
+            data = '\x27\x01' + '\x00' * (FRAME_LENGTH - 2)
+
+        tags.append((i * 1000 / FPS, flv.TAG_VIDEO, data))
+
+    audio = '\xaf\x01' + '\x00' * (AUDIO_LENGTH - 2)
+
+    for i in xrange(DURATION * AUDIO_RATE):
+        tags.append((i * 1000 / AUDIO_RATE, flv.TAG_AUDIO, audio))
+
+    tags.sort()
+
+    f = open(path, 'wb')
+
+    f.write(flv.encode_header())
+
+    for timestamp, tagType, data in tags:
+        f.write(flv.encode_tag(tagType, timestamp, data))
+
+    f.close()
+
+    return len(tags)
+
+
+
+def index(path):
+    f = flv.FLVFile(path)
+    count = len(f)
+
+    f.close()
+
+    return count
+
+
+
+def read(f):
+    size = 0
+
+    for i in xrange(len(f)):
+        size += len(f.getTag(i)[2])
+
+    return size
+
+
+
+def run():
+    fd, path = tempfile.mkstemp(suffix='.flv')
+    os.close(fd)
+
+    try:
+        tags = write_file(path)
+
+        assert index(path) == tags
+
+        results = [Result('vod.index', measure(lambda: index(path)), tags,
+            'tag')]
+
+        f = flv.FLVFile(path)
+
+        try:
+            t = measure(lambda: read(f))
+            results.append(Result('vod.read', t, read(f), 'byte'))
+            results.append(Result('vod.seek', measure(
+                lambda: [f.seek(ts) for ts in xrange(0, DURATION * 1000, 100)]),
+                DURATION * 10, 'seek'))
+        finally:
+            f.close()
+    finally:
+        os.remove(path)
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
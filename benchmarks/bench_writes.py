@@ -0,0 +1,123 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Counts the writes that reach the transport when a low bitrate a/v stream is
+sent through L{rtmp.WriteAggregator} with different delays.
+
+Time is simulated with L{task.Clock}, so the interesting number is the
+C{count} of each result: the number of transport writes (i.e. C{send} calls)
+made for one second of media.
+"""
+
+from twisted.internet import task
+
+from rtmpy.protocol import rtmp
+
+from benchmarks import Result, measure, report
+
+
+#: The delays (in seconds) that are compared, C{None} being no aggregation.
+DELAYS = (None, 0, 0.01, 0.05)
+#: Seconds between video/audio messages (25fps video, 43Hz AAC audio).
+VIDEO_INTERVAL = 0.040
+AUDIO_INTERVAL = 0.023
+#: Sizes of the encoded messages.
+VIDEO_LENGTH = 1500
+AUDIO_LENGTH = 200
+#: The simulated duration in seconds.
+DURATION = 1.0
+#: The simulated clock resolution.
+TICK = 0.001
+
+
+
+class CountingTransport(object):
+    """
+    Counts the writes made to it.
+    """
+
+    def __init__(self):
+        self.writes = 0
+
+
+    def write(self, data):
+        self.writes += 1
+
+
+    def writeSequence(self, seq):
+        self.writes += 1
+
+
+
+def stream(delay):
+    """
+    Sends C{DURATION} seconds of a/v to a transport.
+
+    @return: The number of transport writes.
+    """
+    clock = task.Clock()
+    transport = CountingTransport()
+
+    if delay is None:
+        writer = transport
+    else:
+        writer = rtmp.WriteAggregator(transport, delay, clock=clock)
+
+    video = 'v' * VIDEO_LENGTH
+    audio = 'a' * AUDIO_LENGTH
+    nextVideo = nextAudio = 0.0
+
+    while clock.seconds() < DURATION:
+        now = clock.seconds()
+
+        if now >= nextVideo:
+            writer.write(video)
+            nextVideo += VIDEO_INTERVAL
+
+        if now >= nextAudio:
+            writer.write(audio)
+            nextAudio += AUDIO_INTERVAL
+
+        clock.advance(TICK)
+
+    if delay is not None:
+        writer.flush()
+
+    return transport.writes
+
+
+
+def run():
+    results = []
+
+    for delay in DELAYS:
+        counts = []
+
+        t = measure(lambda: counts.append(stream(delay)))
+
+        if delay is None:
+            name = 'writes.plain'
+        else:
+            name = 'writes.coalesce_%dms' % (delay * 1000,)
+
+        results.append(Result(name, t, counts[-1], 'write'))
+
+    return results
+
+
+
+if __name__ == '__main__':
+    report(run())
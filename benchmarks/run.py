@@ -0,0 +1,268 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Runs the benchmarks and saves the results as a JSON baseline or compares them
+with one, e.g.::
+
+    python -m benchmarks.run --save baseline.json
+    python -m benchmarks.run --compare baseline.json --threshold 20
+
+When comparing, the exit status is 1 if any benchmark takes more than
+C{threshold} percent longer per operation than in the baseline. Baselines are
+only comparable on the same machine and Python build.
+
+On a shared machine a benchmark is often up to twice as slow for seconds or
+minutes at a time, so a single run is not reproducible. Each module is run in
+a fresh process once per round (see C{--rounds}), which spreads the samples
+of a benchmark over the whole run, and the best time of each benchmark is
+kept. When comparing, the modules with a regression are run again at the end
+(see C{--retries}) before the comparison fails. Even so, repeated runs of an
+unchanged tree have been seen to differ by up to 30%, which is why the default
+threshold is 40%. Use a lower one on a quiet machine.
+"""
+
+import optparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+import benchmarks
+from benchmarks import compare, dump, load, report
+
+
+
+def get_modules():
+    """
+    Returns the names of all the benchmark modules.
+    """
+    path = os.path.dirname(os.path.abspath(benchmarks.__file__))
+
+    return sorted([f[:-3] for f in os.listdir(path)
+        if f.startswith('bench_') and f.endswith('.py')])
+
+
+
+def run_module(name):
+    """
+    Runs the benchmark module C{name} from a known random state.
+    """
+    random.seed(0)
+
+    module = __import__('benchmarks.' + name, {}, {}, ['run'])
+
+    return module.run()
+
+
+
+def run_child(name):
+    """
+    Runs the benchmark module C{name} in a child process.
+
+    @return: A C{dict} of name to L{benchmarks.Result}.
+    """
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+
+    try:
+        ret = subprocess.call([sys.executable, '-m', 'benchmarks.run',
+            '--child', name, '--save', path])
+
+        if ret != 0:
+            raise RuntimeError('%s failed (exit status %d)' % (name, ret))
+
+        f = open(path)
+
+        try:
+            return load(f)
+        finally:
+            f.close()
+    finally:
+        os.remove(path)
+
+
+
+class Runner(object):
+    """
+    Runs benchmark modules in child processes and keeps the best result of
+    each benchmark over the runs.
+
+    @ivar samples: A C{dict} of name to the L{benchmarks.Result} of each run.
+    @ivar modules: A C{dict} of benchmark name to the module that runs it.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.modules = {}
+
+
+    def run(self, module):
+        for name, r in run_child(module).iteritems():
+            self.modules[name] = module
+            self.samples.setdefault(name, []).append(r)
+
+
+    def getResult(self, name):
+        samples = self.samples[name]
+
+        if samples[0].seconds is None:
+            return samples[0]
+
+        return min(samples, key=lambda r: r.seconds / r.count)
+
+
+    def getResults(self):
+        return [self.getResult(name) for name in sorted(self.samples)]
+
+
+    def getRegressions(self, baseline, threshold):
+        """
+        @return: The names of the modules with a benchmark that is more than
+            C{threshold} slower than the C{baseline}.
+        """
+        modules = set()
+
+        for name, old, new, change in compare(self.getResults(), baseline):
+            if change > threshold:
+                modules.add(self.modules[name])
+
+        return sorted(modules)
+
+
+
+def build_parser():
+    parser = optparse.OptionParser(usage='%prog [options] [bench_x ...]')
+
+    parser.add_option('--save', metavar='FILE',
+        help='Save the results as a JSON baseline.')
+    parser.add_option('--compare', metavar='FILE',
+        help='Compare the results with a JSON baseline.')
+    parser.add_option('--threshold', type='float', default=40,
+        help='The percentage by which a benchmark may be slower than the '
+        'baseline [default: %default]')
+    parser.add_option('--rounds', type='int', default=5,
+        help='The number of times each module is run [default: %default]')
+    parser.add_option('--retries', type='int', default=2,
+        help='The number of times the modules with a regression are run '
+        'again [default: %default]')
+    parser.add_option('-l', '--list', action='store_true', default=False,
+        help='List the benchmark modules.')
+    parser.add_option('--child', metavar='MODULE', help=optparse.SUPPRESS_HELP)
+
+    return parser
+
+
+
+def main(args=None):
+    from rtmpy import __version__
+
+    parser = build_parser()
+    options, modules = parser.parse_args(args)
+
+    if options.list:
+        for name in get_modules():
+            print name
+
+        return 0
+
+    if options.child:
+        # the results are passed back to the parent with --save
+        results = run_module(options.child)
+
+        f = open(options.save, 'w')
+
+        try:
+            dump(results, f)
+        finally:
+            f.close()
+
+        return 0
+
+    baseline = None
+
+    if options.compare:
+        f = open(options.compare)
+
+        try:
+            baseline = load(f)
+        finally:
+            f.close()
+
+    modules = [name if name.startswith('bench_') else 'bench_' + name
+        for name in modules or get_modules()]
+    runner = Runner()
+
+    for i in xrange(options.rounds):
+        for name in modules:
+            sys.stderr.write('round %d: %s\n' % (i + 1, name))
+            runner.run(name)
+
+    threshold = options.threshold / 100.0
+
+    for i in xrange(options.retries if baseline else 0):
+        regressed = runner.getRegressions(baseline, threshold)
+
+        if not regressed:
+            break
+
+        for name in regressed:
+            sys.stderr.write('retry %d: %s\n' % (i + 1, name))
+            runner.run(name)
+
+    results = runner.getResults()
+
+    report(results)
+
+    if options.save:
+        f = open(options.save, 'w')
+
+        try:
+            dump(results, f, rtmpy=str(__version__),
+                python=sys.version.split()[0], platform=sys.platform)
+        finally:
+            f.close()
+
+    if baseline is None:
+        return 0
+
+    regressions = 0
+
+    print
+    print 'Compared with %s (threshold %.1f%%):' % (options.compare,
+        options.threshold)
+
+    for name, old, new, change in compare(results, baseline):
+        flag = ''
+
+        if change > threshold:
+            flag = ' REGRESSION'
+            regressions += 1
+
+        print '%-45s %+8.1f%%%s' % (name, change * 100, flag)
+
+    if regressions:
+        print '%d benchmark(s) slower than the baseline' % (regressions,)
+
+        return 1
+
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
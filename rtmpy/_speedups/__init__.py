@@ -0,0 +1,85 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Optional compiled versions of the RTMPy hot path modules.
+
+The extensions in this package are built by C{setup.py} with Cython from the
+pure Python sources (see L{MODULES}), augmented with the C{.pxd} files found
+here. When a pure Python module is imported, it replaces its own
+implementation (or just its hot methods) with the compiled one if it has been
+built. The public API is identical either way.
+
+Set the C{RTMPY_PURE} environment variable to ignore the compiled modules,
+e.g. to run the test suite against the pure Python backend.
+"""
+
+import os
+
+
+__all__ = [
+    'MODULES',
+    'install',
+]
+
+
+#: Maps the name of each compiled module to its pure Python source module.
+MODULES = {
+    'header': 'rtmpy.protocol.rtmp.header',
+    'codec': 'rtmpy.protocol.rtmp.codec',
+}
+
+#: Whether the compiled modules may be used.
+enabled = not os.environ.get('RTMPY_PURE')
+
+#: The names of the compiled modules that are in use.
+installed = []
+
+
+def install(namespace, name, names=None):
+    """
+    Replaces the implementation in C{namespace} (the globals of the pure Python
+    module) with the compiled module C{name}, if it is available.
+
+    @param names: The names to replace. A dotted name (C{'Class.method'})
+        replaces a single method of a pure Python class with the compiled
+        version. If C{None}, everything but the module level dunder attributes
+        is replaced.
+    @return: Whether the compiled module is in use.
+    @rtype: C{bool}
+    """
+    if not enabled or namespace['__name__'].startswith(__name__ + '.'):
+        # the compiled module is being initialised from the same source
+        return False
+
+    try:
+        mod = __import__('rtmpy._speedups.' + name, {}, {}, [name])
+    except ImportError:
+        return False
+
+    if names is None:
+        names = [k for k in vars(mod) if not k.startswith('__')]
+
+    for k in names:
+        if '.' in k:
+            klass, attr = k.split('.')
+
+            setattr(namespace[klass], attr, vars(getattr(mod, klass))[attr])
+        else:
+            namespace[k] = getattr(mod, k)
+
+    installed.append(name)
+
+    return True
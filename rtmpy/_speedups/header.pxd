@@ -13,27 +13,42 @@
 # You should have received a copy of the GNU Lesser General Public License along
 # with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
 
-import cython
+# Augments rtmpy/protocol/rtmp/header.py. Streams are typed as object as any
+# BufferedByteStream implementation may be passed.
 
-from cpyamf.util cimport cBufferedByteStream
-from cpython cimport exc
+import cython
 
 
 cdef class Header:
     cdef public int channelId
-    cdef public int timestamp
+    cdef public long long timestamp
     cdef public int datatype
-    cdef public int bodyLength
-    cdef public int streamId
+    cdef public long long bodyLength
+    cdef public long long streamId
     cdef public bint full
     cdef public bint continuation
 
+    cpdef Header copy(self)
+    cpdef merge(self, Header new)
+
+
+cpdef object encode(object stream, Header header, Header previous=?)
 
-@cython.locals(mask=cython.int, channelId=cython.int)
-cpdef object encode(cBufferedByteStream stream, Header header, Header previous=?)
+@cython.locals(mask=cython.int, channelId=cython.int, ts=cython.ulong,
+    timestamp=cython.ulong, bodyLength=cython.ulong)
+cpdef bytes pack(Header header, Header previous=?)
+
+cpdef Header decode(object stream)
 
 @cython.locals(channelId=cython.int, bits=cython.int, header=Header)
-cpdef Header decode(cBufferedByteStream stream)
+cdef Header _decode(object stream)
+
+@cython.locals(end=cython.Py_ssize_t, start=cython.Py_ssize_t,
+    channelId=cython.int, bits=cython.int, header=Header)
+cpdef tuple unpack_from(bytes buf, Py_ssize_t offset=?)
+
+@cython.locals(channelId=cython.int, length=cython.int)
+cpdef int get_header_length(int byte)
 
 @cython.locals(merged=Header)
 cpdef Header merge(Header old, Header new)
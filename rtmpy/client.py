@@ -16,55 +16,614 @@
 """
 RTMP client implementation.
 
+A L{ClientFactory} connects to an RTMP server, negotiates the handshake and
+then calls C{connect} on the application named in the url. Its C{deferred}
+fires with the connected L{NetConnection}, which creates the L{NetStream}s
+that publish streams to and play streams from the server::
+
+    d = client.connect('rtmp://localhost/live')
+    d.addCallback(lambda nc: nc.createStream())
+    d.addCallback(lambda stream: stream.play('foo'))
+
+A L{ConnectionPool} makes many connections to the same application, e.g. to
+generate load.
+
 @since: 0.1.0
 """
 
-from twisted.internet import protocol as twisted_protocol
+import urlparse
+
+from twisted.internet import protocol, defer, error
+from twisted.python import failure, log
+
+from rtmpy import core, exc, message, rpc, versions
+from rtmpy.protocol import rtmp
+from rtmpy.protocol.rtmp import handshake
+from rtmpy.status import codes
+
+
+__all__ = [
+    'ClientProtocol',
+    'ClientFactory',
+    'NetConnection',
+    'NetStream',
+    'ConnectionPool',
+    'connect',
+    'parse_url'
+]
+
+
+#: The port that RTMP servers listen on by default.
+DEFAULT_PORT = 1935
+
+
+
+def parse_url(url):
+    """
+    Splits an C{rtmp://host[:port]/app} url.
+
+    @return: C{(host, port, app)}
+    """
+    scheme, netloc, path = urlparse.urlparse(url)[:3]
+
+    if scheme != 'rtmp':
+        raise ValueError('Unsupported url %r' % (url,))
+
+    host, _, port = netloc.partition(':')
+
+    return host, int(port or DEFAULT_PORT), path.strip('/')
+
+
+
+def _getStatusError(info):
+    """
+    Returns the exception for an error status sent by the server.
+    """
+    code = getattr(info, 'code', None)
+    cls = exc.classByCode(code) or exc.BaseError
+
+    return cls(getattr(info, 'description', None) or code)
+
+
+
+class NetStream(core.NetStream):
+    """
+    A client side NetStream.
+
+    @ivar listener: Receives the stream that is played through the same
+        events as a L{server.IPublishingStream} (C{videoDataReceived},
+        C{audioDataReceived}, C{onMetaData} and C{unpublish}), e.g. a
+        L{server.StreamPublisher}.
+    @ivar name: The name of the stream being played or published.
+    @ivar state: C{None}, C{'playing'} or C{'publishing'}.
+    @ivar status: The last status sent by the server for this stream.
+    """
+
+    def __init__(self, nc, streamId):
+        core.NetStream.__init__(self, nc, streamId)
+
+        self.listener = None
+        self.name = None
+        self.state = None
+        self.status = None
+
+        self._pending = None
+        self._audioChannel = None
+        self._videoChannel = None
+
+    def play(self, name, *args):
+        """
+        Plays the stream C{name}. The a/v data is passed on to L{listener}.
+
+        @param args: The optional C{start} argument of C{NetStream.play}.
+        @return: A L{defer.Deferred} that fires with this stream when the
+            server starts playing, or fails if the server refuses.
+        """
+        self.name = name
+        self._pending = defer.Deferred()
+
+        self.call('play', name, *args)
+
+        return self._pending
+
+    def publish(self, name, type_='live'):
+        """
+        Publishes a stream under C{name}. Send the a/v data with L{sendVideo}
+        and L{sendAudio} once publishing has started.
+
+        @param type_: C{live}, C{record} or C{append}.
+        @return: A L{defer.Deferred} that fires with this stream when the
+            server accepts the stream, or fails if the server refuses.
+        """
+        self.name = name
+        self._pending = defer.Deferred()
+
+        self.call('publish', name, type_)
+
+        return self._pending
+
+    def _getChannel(self, datatype):
+        channel = self.nc.getStreamingChannel(self)
+        channel.setType(datatype)
+
+        return channel
+
+    def sendVideo(self, data, timestamp):
+        """
+        Sends a video message of the published stream.
+
+        @param timestamp: The time of the message in milliseconds since
+            publishing started.
+        """
+        if self._videoChannel is None:
+            self._videoChannel = self._getChannel(message.VIDEO_DATA)
+
+        self._videoChannel.sendData(data, timestamp)
+
+    def sendAudio(self, data, timestamp):
+        """
+        Sends an audio message of the published stream.
+
+        @param timestamp: The time of the message in milliseconds since
+            publishing started.
+        """
+        if self._audioChannel is None:
+            self._audioChannel = self._getChannel(message.AUDIO_DATA)
+
+        self._audioChannel.sendData(data, timestamp)
+
+    def setMetaData(self, meta):
+        """
+        Sets the meta data of the published stream.
+        """
+        self.call('@setDataFrame', 'onMetaData', meta)
+
+    def close(self):
+        """
+        Stops playing or publishing and deletes this stream on the server.
+
+        The stream is kept by L{nc} as the server may still send messages
+        for it.
+        """
+        self.call('closeStream')
+        self.nc.call('deleteStream', self.streamId)
+
+        self.closeStream()
+        self.listener = None
+
+    def _finishPending(self, result):
+        d, self._pending = self._pending, None
+
+        if d is not None:
+            d.callback(result)
+
+    def _stop(self):
+        """
+        The stream being played has ended.
+        """
+        self.state = None
+
+        if self.listener is not None:
+            try:
+                self.listener.unpublish()
+            except:
+                log.err()
+
+    @rpc.expose
+    def onStatus(self, info):
+        """
+        Called by the server when the state of this stream changes.
+        """
+        self.status = info
+        code = getattr(info, 'code', None)
+
+        if getattr(info, 'level', None) == 'error':
+            self._finishPending(failure.Failure(_getStatusError(info)))
+        elif code == codes.NS_PLAY_START:
+            self.state = 'playing'
+            self._finishPending(self)
+        elif code == codes.NS_PUBLISH_START:
+            self.state = 'publishing'
+            self._finishPending(self)
+        elif code in (codes.NS_PLAY_UNPUBLISHNOTIFY, codes.NS_PLAY_STOP):
+            self._stop()
 
-from rtmpy import protocol, versions
-from rtmpy.protocol import handshake
+    @rpc.expose
+    def onPlayStatus(self, info):
+        """
+        """
+
+    @rpc.expose
+    def onMetaData(self, data):
+        """
+        """
+        if self.listener is not None:
+            self.listener.onMetaData(data)
+
+    def onVideoData(self, data, timestamp):
+        """
+        Called when a video packet has been received from the server.
+        """
+        if self.listener is not None:
+            self.listener.videoDataReceived(data, timestamp)
+
+    def onAudioData(self, data, timestamp):
+        """
+        Called when an audio packet has been received from the server.
+        """
+        if self.listener is not None:
+            self.listener.audioDataReceived(data, timestamp)
+
+    def onControlMessage(self, msg, timestamp):
+        """
+        """
+
+    def closeStream(self):
+        """
+        Called when this stream is deleted or the connection is closed.
+        """
+        self._finishPending(failure.Failure(error.ConnectionDone()))
 
+        if self.state == 'playing':
+            self._stop()
 
-class ClientProtocol(protocol.BaseProtocol):
+        self.state = None
+
+
+
+class NetConnection(core.NetConnection):
     """
-    Client RTMP Protocol.
+    A client side NetConnection.
+
+    @ivar connected: Whether the server has accepted the C{connect} call.
+    @ivar closed: Whether the connection has been closed.
+    @ivar status: The last status sent by the server for this connection.
     """
 
-    version = versions.FLASH_MIN_H264
-    protocolVersion = protocol.RTMP_PROTOCOL_VERSION
+    def __init__(self, protocol):
+        core.NetConnection.__init__(self, protocol)
+
+        self.connected = False
+        self.closed = False
+        self.status = None
+
+        self._closing = []
+
+
+    def buildStream(self, streamId):
+        return NetStream(self, streamId)
+
+
+    def connect(self, params, *args):
+        """
+        Connects to the application named C{params['app']}.
+
+        @param params: The connection parameters (C{app}, C{tcUrl},
+            C{flashVer} etc.)
+        @param args: Passed on to the application.
+        @return: A L{defer.Deferred} that fires with this connection once
+            it has been accepted, or fails if it is rejected.
+        """
+        d = self.call('connect', params, *args, notify=True)
+
+        def cb(result):
+            self.status = result[-1]
+
+            if getattr(self.status, 'level', None) == 'error':
+                raise _getStatusError(self.status)
+
+            self.connected = True
+
+            return self
+
+        d.addCallback(cb)
+
+        return d
+
+
+    def createStream(self):
+        """
+        Asks the server for a new stream.
+
+        @return: A L{defer.Deferred} that fires with the L{NetStream}.
+        """
+        d = self.call('createStream', notify=True)
+
+        def cb(result):
+            streamId = int(result[0])
+            stream = self.streams[streamId] = self.buildStream(streamId)
+
+            return stream
+
+        d.addCallback(cb)
+
+        return d
+
+
+    def close(self):
+        """
+        Closes the connection to the server.
+
+        @return: A L{defer.Deferred} that fires once the connection has been
+            closed.
+        """
+        if self.closed:
+            return defer.succeed(None)
+
+        d = defer.Deferred()
+
+        self._closing.append(d)
+        self.protocol.transport.loseConnection()
+
+        return d
+
+
+    @rpc.expose
+    def onStatus(self, info):
+        """
+        """
+        self.status = info
+
+
+    @rpc.expose
+    def onBWDone(self, *args):
+        """
+        """
+
+
+    def closeStream(self):
+        """
+        Called when the connection has been closed. Any calls waiting for a
+        result fail.
+        """
+        self.connected = False
+        self.closed = True
+
+        for callId in self._activeCalls.keys():
+            context = self.finishCall(callId)
+
+            context[0].errback(error.ConnectionDone())
+
+        closing, self._closing = self._closing, []
+
+        for d in closing:
+            d.callback(None)
+
+
+    def sendMessage(self, msg, stream=None, whenDone=None):
+        """
+        """
+        self.protocol.sendMessage(msg, stream or self, whenDone=whenDone)
+
+
+    def getStreamingChannel(self, stream):
+        return self.protocol.getStreamingChannel(stream)
+
+
+
+class ClientProtocol(rtmp.RTMPProtocol):
+    """
+    Client side RTMP protocol implementation.
+    """
+
+    netconnection = NetConnection
+
 
     def connectionMade(self):
+        rtmp.RTMPProtocol.connectionMade(self)
+
+        self.transport.write(chr(self.protocolVersion))
+
+
+    def buildStreamManager(self):
+        return self.nc
+
+
+    def startStreaming(self):
+        """
+        """
+        self.nc = self.netconnection(self)
+
+        rtmp.RTMPProtocol.startStreaming(self)
+
+        self.factory.streamingStarted(self)
+
+
+    def onUpstreamBandwidth(self, bandwidth, extra, timestamp):
         """
-        Called when a connection has been made to this protocol instance. Used
-        to do general setup and protocol initialisation.
+        The server has set the bandwidth of this connection. Acknowledging it
+        completes the C{connect} call.
         """
-        rtmp.BaseProtocol.connectionMade(self)
+        self.nc.sendMessage(message.DownstreamBandwidth(bandwidth))
 
-        self.negotiator = self.factory.getHandshakeNegotiator(self, self.protocolVersion)
 
-        self.negotiator.start(0, self.version)
+    def closeStream(self):
+        """
+        Called when the stream is asked to close itself.
+        """
+        self.nc.closeStream()
+
+
+    def onInvoke(self, name, callId, args, timestamp):
+        """
+        """
+        self.nc.onInvoke(name, callId, args, timestamp)
 
-    def connectionLost(self, *args):
-        print args
 
+    def onNotify(self, name, args, timestamp):
+        """
+        """
+        self.nc.onNotify(name, args, timestamp)
 
-class ClientFactory(twisted_protocol.ClientFactory):
+
+    def onControlMessage(self, msg, timestamp):
+        """
+        Answers pings from the server.
+        """
+        if msg.type == message.ControlMessage.PING:
+            self.nc.sendMessage(message.ControlMessage(
+                message.ControlMessage.PONG, msg.value1))
+
+
+    def onBytesRead(self, *args):
+        """
+        """
+
+
+
+class ClientFactory(protocol.ClientFactory):
     """
-    RTMP client protocol factory.
+    RTMP client protocol factory. Each factory makes one connection.
+
+    @ivar url: The C{rtmp://} url of the application to connect to.
+    @ivar params: The connection parameters sent with the C{connect} call.
+    @ivar args: Passed on to the application with the C{connect} call.
+    @ivar deferred: Fires with the L{NetConnection} once connected, or fails
+        if the connection is refused or lost beforehand.
     """
 
     protocol = ClientProtocol
+    handshake = handshake.ClientNegotiator
+
+    flashVer = 'LNX ' + str(versions.FLASH_MIN_H264)
+
+
+    def __init__(self, url, params=None, *args):
+        self.url = url
+        self.args = args
+
+        self.params = {
+            'app': parse_url(url)[2],
+            'tcUrl': url,
+            'flashVer': self.flashVer,
+            'fpad': False,
+            'capabilities': 15,
+            'audioCodecs': 3191,
+            'videoCodecs': 252,
+            'videoFunction': 1,
+            'objectEncoding': 0,
+        }
+
+        if params:
+            self.params.update(params)
+
+        self.deferred = defer.Deferred()
+
+
+    def buildHandshakeNegotiator(self, observer, output):
+        """
+        Returns a negotiator capable of handling client side handshakes.
+        """
+        return self.handshake(observer, output)
+
+
+    def streamingStarted(self, protocol):
+        """
+        Called when the handshake with the server has completed.
+        """
+        d = protocol.nc.connect(self.params, *self.args)
+
+        d.addBoth(self._connected)
+
+
+    def _connected(self, result):
+        d, self.deferred = self.deferred, None
+
+        if d is not None:
+            d.callback(result)
+
+
+    def clientConnectionFailed(self, connector, reason):
+        self._connected(reason)
+
+
+    def clientConnectionLost(self, connector, reason):
+        self._connected(reason)
+
+
+
+def connect(url, params=None, reactor=None):
+    """
+    Connects to the application at C{url}.
+
+    @return: A L{defer.Deferred} that fires with the connected
+        L{NetConnection}.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+
+    host, port, app = parse_url(url)
+    f = ClientFactory(url, params)
+
+    reactor.connectTCP(host, port, f)
+
+    return f.deferred
+
+
+
+class ConnectionPool(object):
+    """
+    Makes C{size} concurrent connections to the application at C{url}, all
+    sharing one reactor.
+
+    @ivar maxConnecting: The maximum number of connections that are opened
+        at the same time.
+    @ivar connections: The connected L{NetConnection}s.
+    @ivar failures: The L{failure.Failure}s of the connections that could not
+        be made.
+    """
+
+    maxConnecting = 50
+
+
+    def __init__(self, url, size, params=None, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.url = url
+        self.size = size
+        self.params = params
+        self.reactor = reactor
+
+        self.connections = []
+        self.failures = []
+
+
+    def start(self):
+        """
+        Opens the connections.
+
+        @return: A L{defer.Deferred} that fires with this pool once every
+            connection has been made or has failed.
+        """
+        sem = defer.DeferredSemaphore(self.maxConnecting)
+        dl = []
+
+        for i in xrange(self.size):
+            d = sem.run(connect, self.url, self.params, self.reactor)
+
+            d.addCallbacks(self.connections.append, self.failures.append)
+            dl.append(d)
+
+        return defer.DeferredList(dl).addCallback(lambda _: self)
+
+
+    def map(self, func, *args, **kwargs):
+        """
+        Calls C{func(nc, *args, **kwargs)} for each connection.
+
+        @return: A L{defer.DeferredList} of the results.
+        """
+        return defer.DeferredList([defer.maybeDeferred(func, nc, *args,
+            **kwargs) for nc in self.connections], consumeErrors=True)
+
 
-    def getHandshakeNegotiator(self, protocol, version):
+    def close(self):
         """
-        Returns an implementation of L{handshake.IHandshakeNegotiator} based on
-        the version supplied.
+        Closes all the connections.
 
-        @param protocol: The client protocol instance.
-        @type protocol: L{ClientProtocol}
-        @param version: The RTMP version request.
-        @type version: C{int}
+        @return: A L{defer.Deferred} that fires once they have been closed.
         """
-        imp = handshake.get_implementation(version)
+        connections, self.connections = self.connections, []
 
-        return imp.ClientNegotiator(imp.HandshakeObserver(protocol))
+        return defer.DeferredList([nc.close() for nc in connections])
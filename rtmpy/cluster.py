@@ -0,0 +1,938 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Multi-process server mode.
+
+A L{Supervisor} starts a number of worker processes that accept RTMP
+connections on the same port, each running its own reactor and
+L{server.ServerFactory}. The port is either bound once by the supervisor and
+passed to every worker, or bound by each worker with C{SO_REUSEPORT} so that
+the kernel balances connections between them.
+
+The supervisor also runs a L{StreamRegistry} on a unix socket that records
+which worker publishes each stream. When a stream is played in a worker that
+does not publish it, the worker connects to the publishing worker's relay
+socket and receives the a/v messages as they are published (see
+L{RelayServerProtocol}). The relayed stream is republished locally so that
+all the subscribers in the worker share one relay connection.
+
+@since: 0.2
+"""
+
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+
+from zope.interface import implements
+from twisted.internet import defer, protocol
+from twisted.internet.interfaces import IPushProducer
+from twisted.protocols import amp, basic
+from twisted.python import log, reflect
+import pyamf
+
+from rtmpy import exc, flv, message, server
+
+
+__all__ = [
+    'Supervisor',
+    'StreamRegistry',
+    'ClusterRegistry',
+    'RelayedPublisher',
+    'bind_socket',
+    'run_worker'
+]
+
+
+#: The number of pending connections the listening socket queues.
+BACKLOG = 50
+
+#: Linux value of C{SO_REUSEPORT}, which older Pythons do not define.
+_LINUX_SO_REUSEPORT = 15
+
+#: Marks the end of a relayed stream. The other kinds of relay message are
+#  the RTMP datatypes of the a/v data (and C{message.NOTIFY} for meta data).
+RELAY_UNPUBLISH = 0
+
+# kind, timestamp
+_RELAY_HEADER = struct.Struct('!BL')
+
+
+
+class Register(amp.Command):
+    """
+    Claims a stream for the worker whose relay socket is C{address}.
+    """
+
+    arguments = [
+        ('app', amp.String()),
+        ('name', amp.String()),
+        ('address', amp.String()),
+    ]
+    response = []
+    errors = {exc.BadNameError: 'BAD_NAME'}
+
+
+
+class Unregister(amp.Command):
+    """
+    Releases a stream claimed with L{Register}.
+    """
+
+    arguments = [
+        ('app', amp.String()),
+        ('name', amp.String()),
+        ('address', amp.String()),
+    ]
+    response = []
+    requiresAnswer = False
+
+
+
+class Watch(amp.Command):
+    """
+    Asks where a stream is published. If it is not yet published, the worker
+    is sent L{Published} once it is.
+    """
+
+    arguments = [
+        ('app', amp.String()),
+        ('name', amp.String()),
+        ('address', amp.String()),
+    ]
+    response = [
+        ('address', amp.String(optional=True)),
+    ]
+
+
+
+class Published(amp.Command):
+    """
+    Sent to the workers watching a stream once it has been published.
+    """
+
+    arguments = [
+        ('app', amp.String()),
+        ('name', amp.String()),
+        ('address', amp.String()),
+    ]
+    response = []
+    requiresAnswer = False
+
+
+
+class StreamRegistry(object):
+    """
+    Records which worker publishes each stream.
+
+    Workers are represented by an owner object, which must provide a
+    C{published(app, name, address)} method that is called for the streams
+    it watches.
+
+    @ivar streams: C{(app, name)} -> C{(address, owner)}
+    @ivar watchers: C{(app, name)} -> C{{owner: address}}
+    """
+
+
+    def __init__(self):
+        self.streams = {}
+        self.watchers = {}
+
+
+    def register(self, owner, app, name, address):
+        """
+        @raise exc.BadNameError: The stream is published by another worker.
+        """
+        key = (app, name)
+        current = self.streams.get(key, None)
+
+        if current is not None and current[0] != address:
+            raise exc.BadNameError('%r is already published' % (name,))
+
+        self.streams[key] = (address, owner)
+
+        for watcher, watcherAddress in self.watchers.pop(key, {}).items():
+            if watcherAddress == address:
+                continue
+
+            try:
+                watcher.published(app, name, address)
+            except:
+                log.err()
+
+
+    def unregister(self, owner, app, name, address):
+        key = (app, name)
+        current = self.streams.get(key, None)
+
+        if current is not None and current[0] == address:
+            del self.streams[key]
+
+
+    def watch(self, owner, app, name, address):
+        """
+        @return: The address of the worker publishing the stream or C{None},
+            in which case C{owner} is told once it is published.
+        """
+        key = (app, name)
+        current = self.streams.get(key, None)
+
+        if current is not None and current[0] != address:
+            return current[0]
+
+        self.watchers.setdefault(key, {})[owner] = address
+
+        return None
+
+
+    def removeOwner(self, owner):
+        """
+        Forgets the streams published and watched by C{owner}, e.g. because
+        the worker has gone away.
+        """
+        for key, (address, o) in self.streams.items():
+            if o is owner:
+                del self.streams[key]
+
+        for key, watchers in self.watchers.items():
+            watchers.pop(owner, None)
+
+            if not watchers:
+                del self.watchers[key]
+
+
+
+class RegistryServerProtocol(amp.AMP):
+    """
+    The supervisor's end of a worker's connection to the L{StreamRegistry}.
+    """
+
+
+    def connectionLost(self, reason):
+        amp.AMP.connectionLost(self, reason)
+
+        self.factory.registry.removeOwner(self)
+
+
+    def published(self, app, name, address):
+        self.callRemote(Published, app=app, name=name, address=address)
+
+
+    @Register.responder
+    def register(self, app, name, address):
+        self.factory.registry.register(self, app, name, address)
+
+        return {}
+
+
+    @Unregister.responder
+    def unregister(self, app, name, address):
+        self.factory.registry.unregister(self, app, name, address)
+
+        return {}
+
+
+    @Watch.responder
+    def watch(self, app, name, address):
+        address = self.factory.registry.watch(self, app, name, address)
+
+        if address is None:
+            return {}
+
+        return {'address': address}
+
+
+
+class RegistryServerFactory(protocol.ServerFactory):
+    """
+    Accepts connections from the workers to the L{StreamRegistry}.
+    """
+
+    protocol = RegistryServerProtocol
+
+
+    def __init__(self, registry):
+        self.registry = registry
+
+
+
+class RegistryClientProtocol(amp.AMP):
+    """
+    A worker's connection to the L{StreamRegistry}.
+    """
+
+
+    def __init__(self, registry):
+        amp.AMP.__init__(self)
+
+        self.registry = registry
+
+
+    @Published.responder
+    def published(self, app, name, address):
+        self.registry.published(app, name, address)
+
+        return {}
+
+
+
+class ClusterRegistry(object):
+    """
+    The L{server.IStreamRegistry} of a worker, backed by the supervisor's
+    L{StreamRegistry}.
+
+    Until the worker is connected to the registry (see L{connect}), streams
+    are only published locally.
+
+    @ivar address: The path of this worker's relay socket.
+    @ivar protocol: The L{RegistryClientProtocol} or C{None}.
+    @ivar watching: C{(app name, stream name)} -> C{[(app, cb)]} for the
+        streams waited on.
+    """
+
+    implements(server.IStreamRegistry)
+
+
+    def __init__(self, address, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.address = address
+        self.reactor = reactor
+        self.protocol = None
+        self.watching = {}
+
+
+    def connect(self, path):
+        """
+        Connects to the L{StreamRegistry} listening on the unix socket
+        C{path}.
+
+        @rtype: L{defer.Deferred}
+        """
+        c = protocol.ClientCreator(self.reactor, RegistryClientProtocol, self)
+        d = c.connectUNIX(path)
+
+        def cb(proto):
+            self.protocol = proto
+
+            for app, name in self.watching.keys():
+                self._watch(app, name)
+
+            return proto
+
+        d.addCallback(cb)
+
+        return d
+
+
+    def register(self, app, name):
+        if self.protocol is None:
+            return defer.succeed(None)
+
+        return self.protocol.callRemote(Register, app=app.name, name=name,
+            address=self.address)
+
+
+    def unregister(self, app, name):
+        if self.protocol is None:
+            return
+
+        self.protocol.callRemote(Unregister, app=app.name, name=name,
+            address=self.address)
+
+
+    def whenPublished(self, app, name, cb):
+        key = (app.name, name)
+        cbs = self.watching.setdefault(key, [])
+
+        cbs.append((app, cb))
+
+        if len(cbs) == 1 and self.protocol is not None:
+            self._watch(*key)
+
+
+    def _watch(self, app, name):
+        d = self.protocol.callRemote(Watch, app=app, name=name,
+            address=self.address)
+
+        def cb(res):
+            address = res.get('address', None)
+
+            if address is not None:
+                self.published(app, name, address)
+
+        d.addCallback(cb)
+        d.addErrback(log.err)
+
+
+    def published(self, app, name, address):
+        """
+        Called when a stream that is waited on has been published by the
+        worker with the relay socket C{address}.
+        """
+        if address == self.address:
+            return
+
+        for application, cb in self.watching.pop((app, name), []):
+            try:
+                cb(self.relay(application, name, address))
+            except:
+                log.err()
+
+
+    def relay(self, app, name, address):
+        """
+        Connects to the relay socket C{address} and returns a
+        L{RelayedPublisher} for the stream.
+        """
+        publisher = RelayedPublisher(address)
+        f = RelayClientFactory(app, name, publisher)
+
+        self.reactor.connectUNIX(address, f)
+
+        return publisher
+
+
+
+class RelayServerProtocol(basic.Int32StringReceiver):
+    """
+    Relays a published stream to another worker.
+
+    The first string received is the name of the application and stream,
+    separated by a null byte. From then on the protocol subscribes to the
+    L{server.StreamPublisher} and sends each message as a string starting
+    with C{_RELAY_HEADER}.
+
+    Flow control is honoured by dropping the data while the transport is
+    paused, and then waiting for the next video keyframe.
+    """
+
+    implements(IPushProducer)
+
+    MAX_LENGTH = 16 * 1024 * 1024
+
+    publisher = None
+    paused = False
+    needKeyframe = False
+
+
+    def stringReceived(self, data):
+        if self.publisher is not None:
+            return
+
+        app, _, name = data.partition('\x00')
+        application = self.factory.serverFactory.applications.get(app, None)
+        publisher = None
+
+        if application is not None:
+            publisher = application.streams.get(name, None)
+
+        if publisher is None:
+            self.unpublish()
+
+            return
+
+        self.publisher = publisher
+        self.transport.registerProducer(self, True)
+
+        publisher.addSubscriber(self)
+
+
+    def connectionLost(self, reason):
+        if self.publisher is not None:
+            try:
+                self.publisher.removeSubscriber(self)
+            except KeyError:
+                pass
+
+            self.publisher = None
+
+
+    def _send(self, kind, data, timestamp):
+        if self.paused:
+            self.needKeyframe = True
+
+            return
+
+        if self.needKeyframe and kind == message.VIDEO_DATA:
+            if not flv.is_keyframe(data):
+                return
+
+            self.needKeyframe = False
+
+        self.sendString(_RELAY_HEADER.pack(kind, max(timestamp, 0)) + data)
+
+
+    def pauseProducing(self):
+        self.paused = True
+
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+    def stopProducing(self):
+        self.transport.loseConnection()
+
+    # subscriber events
+
+    def videoDataReceived(self, data, timestamp):
+        self._send(message.VIDEO_DATA, data, timestamp)
+
+
+    def audioDataReceived(self, data, timestamp):
+        self._send(message.AUDIO_DATA, data, timestamp)
+
+
+    def onMetaData(self, data):
+        meta = pyamf.encode(data, encoding=pyamf.AMF0).getvalue()
+
+        self.sendString(_RELAY_HEADER.pack(message.NOTIFY, 0) + meta)
+
+
+    def unpublish(self):
+        self.publisher = None
+
+        self.sendString(_RELAY_HEADER.pack(RELAY_UNPUBLISH, 0))
+        self.transport.loseConnection()
+
+
+
+class RelayServerFactory(protocol.ServerFactory):
+    """
+    Listens for relay connections from other workers.
+
+    @ivar serverFactory: The L{server.ServerFactory} whose applications
+        publish the relayed streams.
+    """
+
+    protocol = RelayServerProtocol
+
+
+    def __init__(self, serverFactory):
+        self.serverFactory = serverFactory
+
+
+
+class RelayedPublisher(server.StreamPublisher):
+    """
+    Republishes a stream received from another worker.
+
+    @ivar address: The relay socket of the publishing worker.
+    @ivar relay: The L{RelayClientProtocol} once connected.
+    @ivar stopped: Whether L{stop} has been called. The relay is dropped as
+        soon as it connects if it is stopped beforehand.
+    """
+
+
+    def __init__(self, address):
+        client = server.Client(None)
+        client.id = 'relay:' + address
+
+        server.StreamPublisher.__init__(self, None, client)
+
+        self.address = address
+        self.relay = None
+        self.stopped = False
+
+
+    def removeSubscriber(self, subscriber):
+        """
+        Removes the subscriber, closing the relay once there are none left.
+        """
+        server.StreamPublisher.removeSubscriber(self, subscriber)
+
+        if not self.subscribers:
+            self.stop()
+
+
+    def stop(self):
+        self.stopped = True
+
+        if self.relay is not None:
+            self.relay.transport.loseConnection()
+
+
+
+class RelayClientProtocol(basic.Int32StringReceiver):
+    """
+    Receives a stream relayed by L{RelayServerProtocol} and passes it on to
+    a L{RelayedPublisher}.
+    """
+
+    MAX_LENGTH = RelayServerProtocol.MAX_LENGTH
+
+
+    def connectionMade(self):
+        f = self.factory
+
+        if f.publisher.stopped:
+            # the publisher was discarded while the connection was pending
+            self.transport.loseConnection()
+
+            return
+
+        f.publisher.relay = self
+
+        self.sendString('%s\x00%s' % (f.app.name, f.name))
+
+
+    def connectionLost(self, reason):
+        self.factory.publisher.relay = None
+        self.factory.unpublish()
+
+
+    def stringReceived(self, data):
+        kind, timestamp = _RELAY_HEADER.unpack_from(data)
+        data = data[_RELAY_HEADER.size:]
+        publisher = self.factory.publisher
+
+        if kind == message.VIDEO_DATA:
+            publisher.videoDataReceived(data, timestamp)
+        elif kind == message.AUDIO_DATA:
+            publisher.audioDataReceived(data, timestamp)
+        elif kind == message.NOTIFY:
+            publisher.onMetaData(pyamf.decode(data,
+                encoding=pyamf.AMF0).next())
+        elif kind == RELAY_UNPUBLISH:
+            self.factory.unpublish()
+            self.transport.loseConnection()
+
+
+
+class RelayClientFactory(protocol.ClientFactory):
+    """
+    Connects a L{RelayedPublisher} to the worker publishing the stream.
+
+    @ivar app: The local L{server.Application} the stream is republished in.
+    @ivar name: The name of the stream.
+    """
+
+    protocol = RelayClientProtocol
+
+
+    def __init__(self, app, name, publisher):
+        self.app = app
+        self.name = name
+        self.publisher = publisher
+        self.done = False
+
+
+    def unpublish(self):
+        """
+        The relayed stream has ended. The publisher is removed from the
+        application and its subscribers are told.
+        """
+        if self.done:
+            return
+
+        self.done = True
+
+        if self.app.streams.get(self.name, None) is self.publisher:
+            del self.app.streams[self.name]
+
+        try:
+            self.publisher.unpublish()
+        except:
+            log.err()
+
+
+    def clientConnectionFailed(self, connector, reason):
+        log.err(reason, 'Unable to relay %r from %s' % (self.name,
+            self.publisher.address))
+
+        self.unpublish()
+
+
+
+def bind_socket(interface, port, reusePort=False, backlog=BACKLOG):
+    """
+    Returns a non blocking TCP socket listening on C{interface}:C{port}.
+
+    @param reusePort: Whether to set C{SO_REUSEPORT} so that several
+        processes can bind the same port.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    if reusePort:
+        option = getattr(socket, 'SO_REUSEPORT', None)
+
+        if option is None:
+            if not sys.platform.startswith('linux'):
+                raise ValueError('SO_REUSEPORT is not supported')
+
+            option = _LINUX_SO_REUSEPORT
+
+        s.setsockopt(socket.SOL_SOCKET, option, 1)
+
+    s.bind((interface, port))
+    s.listen(backlog)
+    s.setblocking(False)
+
+    return s
+
+
+
+def run_worker(factory, registry, relay, fd=None, port=None, interface='',
+               reusePort=False, reactor=None):
+    """
+    Runs a worker process until the reactor is stopped.
+
+    @param factory: The fully qualified name of a callable returning the
+        L{server.ServerFactory} of the worker.
+    @param registry: The path of the supervisor's registry socket.
+    @param relay: The path of this worker's relay socket.
+    @param fd: The file descriptor of the listening socket bound by the
+        supervisor. If C{None}, C{port} is bound with C{SO_REUSEPORT}.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+
+    serverFactory = reflect.namedAny(factory)()
+    serverFactory.registry = ClusterRegistry(relay, reactor)
+
+    reactor.listenUNIX(relay, RelayServerFactory(serverFactory))
+
+    if fd is None:
+        s = bind_socket(interface, port, reusePort=True)
+        fd = s.fileno()
+    else:
+        s = None
+
+    reactor.adoptStreamPort(fd, socket.AF_INET, serverFactory)
+
+    if s is None:
+        os.close(fd)
+    else:
+        s.close()
+
+    d = serverFactory.registry.connect(registry)
+    d.addErrback(log.err, 'Unable to connect to the stream registry')
+
+    reactor.run()
+
+
+
+class WorkerProcess(protocol.ProcessProtocol):
+    """
+    Watches a worker process started by a L{Supervisor}.
+    """
+
+
+    def __init__(self, supervisor, index):
+        self.supervisor = supervisor
+        self.index = index
+
+
+    def processEnded(self, reason):
+        self.supervisor.workerEnded(self, reason)
+
+
+
+class Supervisor(object):
+    """
+    Starts and restarts the worker processes and runs the L{StreamRegistry}.
+
+    @ivar factory: The fully qualified name of a callable that returns the
+        L{server.ServerFactory} of each worker, e.g. C{'myapp.buildFactory'}.
+        Each worker imports and calls it.
+    @ivar port: The TCP port to accept RTMP connections on.
+    @ivar workers: The number of worker processes. Defaults to the number of
+        CPUs.
+    @ivar reusePort: Whether each worker binds the port with C{SO_REUSEPORT}
+        rather than sharing the socket bound by the supervisor.
+    @ivar socketDir: The directory that the registry and relay sockets are
+        created in. A temporary directory is used if not supplied.
+    @ivar processes: The running L{WorkerProcess}es, keyed by index.
+    @ivar restartDelay: The number of seconds to wait before restarting a
+        worker that has exited.
+    """
+
+    restartDelay = 1
+
+
+    def __init__(self, factory, port, workers=None, interface='',
+                 reusePort=False, socketDir=None, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        if workers is None:
+            workers = cpu_count()
+
+        if reusePort and not port:
+            raise ValueError('A port must be supplied to use SO_REUSEPORT')
+
+        self.factory = factory
+        self.port = port
+        self.workers = workers
+        self.interface = interface
+        self.reusePort = reusePort
+        self.socketDir = socketDir
+        self.reactor = reactor
+
+        self.registry = StreamRegistry()
+        self.processes = {}
+        self.socket = None
+        self.stopping = False
+
+        self._registryPort = None
+        self._tempDir = False
+        self._restarts = {}
+
+
+    @property
+    def registryPath(self):
+        return os.path.join(self.socketDir, 'registry.sock')
+
+
+    def start(self):
+        """
+        Binds the port (unless L{reusePort} is set), starts the registry and
+        spawns the workers.
+        """
+        if self.socketDir is None:
+            self.socketDir = tempfile.mkdtemp(prefix='rtmpy-')
+            self._tempDir = True
+
+        self._registryPort = self.reactor.listenUNIX(self.registryPath,
+            RegistryServerFactory(self.registry))
+
+        if not self.reusePort:
+            self.socket = bind_socket(self.interface, self.port)
+
+            # port 0 binds a random port, which the workers then share
+            self.port = self.socket.getsockname()[1]
+
+        for index in xrange(self.workers):
+            self.spawn(index)
+
+
+    def getWorkerArgs(self, index):
+        """
+        Returns the command line of worker C{index}.
+        """
+        args = [sys.executable, '-m', 'rtmpy.scripts.cluster', '--worker',
+            '--factory', self.factory,
+            '--registry', self.registryPath,
+            '--relay', os.path.join(self.socketDir, 'relay-%d.sock' % (
+                index,)),
+        ]
+
+        if self.reusePort:
+            args.extend(['--port', str(self.port),
+                '--interface', self.interface])
+        else:
+            args.extend(['--fd', '3'])
+
+        return args
+
+
+    def spawn(self, index):
+        """
+        Starts worker C{index}.
+        """
+        childFDs = {0: 0, 1: 1, 2: 2}
+
+        if self.socket is not None:
+            childFDs[3] = self.socket.fileno()
+
+        relay = os.path.join(self.socketDir, 'relay-%d.sock' % (index,))
+
+        if os.path.exists(relay):
+            # left behind by a worker that died
+            os.unlink(relay)
+
+        p = self.processes[index] = WorkerProcess(self, index)
+
+        self.reactor.spawnProcess(p, sys.executable,
+            self.getWorkerArgs(index), env=os.environ, childFDs=childFDs)
+
+        return p
+
+
+    def workerEnded(self, process, reason):
+        """
+        Called when a worker has exited. It is restarted unless the
+        supervisor is stopping.
+        """
+        if self.processes.get(process.index, None) is not process:
+            return
+
+        del self.processes[process.index]
+
+        if self.stopping:
+            return
+
+        log.msg('Worker %d exited (%s), restarting' % (process.index,
+            reason.getErrorMessage()))
+
+        self._restarts[process.index] = self.reactor.callLater(
+            self.restartDelay, self._restart, process.index)
+
+
+    def _restart(self, index):
+        del self._restarts[index]
+
+        self.spawn(index)
+
+
+    def stop(self):
+        """
+        Stops the workers and the registry.
+        """
+        self.stopping = True
+
+        for call in self._restarts.values():
+            call.cancel()
+
+        self._restarts = {}
+
+        for p in self.processes.values():
+            try:
+                p.transport.signalProcess('TERM')
+            except:
+                pass
+
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+        if self._registryPort is not None:
+            self._registryPort.stopListening()
+            self._registryPort = None
+
+        if self._tempDir:
+            shutil.rmtree(self.socketDir, True)
+
+
+
+def cpu_count():
+    """
+    Returns the number of CPUs, or C{1} if it cannot be determined.
+    """
+    try:
+        import multiprocessing
+    except ImportError:
+        return 1
+
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
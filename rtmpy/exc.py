@@ -120,6 +120,15 @@ class BadNameError(PublishError):
 
 
 
+class RecordNoAccess(PublishError):
+    """
+    Raised when a peer asks to record a stream that cannot be recorded.
+    """
+
+    register(codes.NS_RECORD_NOACCESS)
+
+
+
 class PlayError(BaseError):
     """
     Base error for all NetStream playing errors.
@@ -136,6 +145,16 @@ class StreamNotFound(PlayError):
 
 
 
+class FileStructureInvalid(PlayError):
+    """
+    Raised when a recorded stream cannot be played because the file is not
+    valid.
+    """
+
+    register(codes.NS_PLAY_FILESTRUCTUREINVALID)
+
+
+
 def codeByClass(cls):
     """
     """
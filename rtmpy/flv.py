@@ -0,0 +1,511 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Helpers for inspecting the audio/video payloads carried by RTMP messages. The
+payloads are the bodies of FLV tags.
+
+Also reads and writes FLV files, see L{FLVFile} and L{FLVWriter}.
+
+@see: U{FLV<http://osflash.org/flv>}
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+import pyamf
+
+from rtmpy import exc
+
+
+__all__ = [
+    'is_keyframe',
+    'is_avc_sequence_header',
+    'is_aac_sequence_header',
+    'FLVFile',
+    'FLVWriter',
+    'encode_header',
+    'encode_tag',
+]
+
+
+#: Video frame types (upper nibble of the first byte of a video tag).
+KEYFRAME = 1
+INTER_FRAME = 2
+DISPOSABLE_INTER_FRAME = 3
+GENERATED_KEYFRAME = 4
+INFO_FRAME = 5
+
+#: Video codec id (lower nibble of the first byte of a video tag) for H.264.
+CODEC_AVC = 7
+#: Sound format (upper nibble of the first byte of an audio tag) for AAC.
+SOUND_AAC = 10
+
+#: AVC/AAC packet type of a sequence header (decoder configuration).
+SEQUENCE_HEADER = 0
+
+#: FLV tag types. They are the same as the RTMP message types.
+TAG_AUDIO = 8
+TAG_VIDEO = 9
+TAG_SCRIPT = 18
+
+#: The flags in the FLV file header for the presence of audio/video tags.
+FLAG_AUDIO = 0x04
+FLAG_VIDEO = 0x01
+
+# signature, version, flags, header length
+_FILE_HEADER = struct.Struct('!3sBBL')
+# type, body length (24 bit), timestamp (24 bit), extended timestamp, stream id
+# (24 bit). 24 bit ints are packed as a high byte and a low short.
+_TAG_HEADER = struct.Struct('!BBHBHBBH')
+_TAG_SIZE = struct.Struct('!L')
+
+#: The number of bytes in a tag header.
+TAG_HEADER_LENGTH = _TAG_HEADER.size
+
+#: Appended to the name of an FLV file to get the name of its index.
+INDEX_SUFFIX = '.idx'
+
+# signature, byte order, item size, file size, tags, keyframes, meta offset,
+# meta size. The arrays follow in native byte order.
+_INDEX_HEADER = struct.Struct('!4sBBQLLQL')
+_INDEX_SIGNATURE = 'FLVX'
+_BYTE_ORDER = {'big': 0, 'little': 1}[sys.byteorder]
+
+
+def get_frame_type(data):
+    """
+    Returns the frame type of a video tag body or C{None} if C{data} is empty.
+    """
+    if not data:
+        return None
+
+    return ord(data[0]) >> 4
+
+
+def is_keyframe(data):
+    """
+    Whether the video tag body C{data} can be decoded without any previous
+    frames.
+    """
+    return get_frame_type(data) in (KEYFRAME, GENERATED_KEYFRAME)
+
+
+def is_avc_sequence_header(data):
+    """
+    Whether the video tag body C{data} is an AVC decoder configuration record.
+    """
+    return (len(data) > 1 and ord(data[0]) & 0x0f == CODEC_AVC and
+        ord(data[1]) == SEQUENCE_HEADER)
+
+
+def is_aac_sequence_header(data):
+    """
+    Whether the audio tag body C{data} is an AAC audio specific config.
+    """
+    return (len(data) > 1 and ord(data[0]) >> 4 == SOUND_AAC and
+        ord(data[1]) == SEQUENCE_HEADER)
+
+
+def encode_header(audio=True, video=True):
+    """
+    Returns the bytes that an FLV file starts with, including the first
+    (empty) previous tag size.
+    """
+    flags = 0
+
+    if audio:
+        flags |= FLAG_AUDIO
+
+    if video:
+        flags |= FLAG_VIDEO
+
+    return _FILE_HEADER.pack('FLV', 1, flags, _FILE_HEADER.size) + \
+        _TAG_SIZE.pack(0)
+
+
+def encode_tag(tagType, timestamp, data):
+    """
+    Returns an FLV tag containing C{data}, followed by its size.
+
+    @param tagType: One of the C{TAG_*} constants.
+    @param timestamp: In milliseconds.
+    """
+    length = len(data)
+
+    return _TAG_HEADER.pack(tagType, length >> 16, length & 0xffff,
+        (timestamp >> 16) & 0xff, timestamp & 0xffff, timestamp >> 24,
+        0, 0) + data + _TAG_SIZE.pack(TAG_HEADER_LENGTH + length)
+
+
+class TagIndex(object):
+    """
+    The positions of the audio/video tags in an FLV file.
+
+    An index can be saved alongside the file (see L{INDEX_SUFFIX}) so that
+    opening the file again does not involve reading every tag header.
+
+    @ivar types: The tag type of each tag.
+    @ivar offsets: The offset in the file of the body of each tag.
+    @ivar sizes: The length of the body of each tag.
+    @ivar timestamps: The timestamp of each tag, in milliseconds.
+    @ivar keyframes: The indexes of the video keyframes, in order.
+    @ivar keyframeTimes: The timestamps of the tags in C{keyframes}.
+    @ivar metaOffset: The offset of the body of the C{onMetaData} script tag
+        or C{0} if there is none.
+    @ivar metaSize: The length of the body of the C{onMetaData} script tag.
+    @ivar length: The number of bytes in the file up to the end of the last
+        complete tag.
+    """
+
+    def __init__(self):
+        self.types = array('B')
+        self.offsets = array('L')
+        self.sizes = array('L')
+        self.timestamps = array('L')
+        self.keyframes = array('L')
+        self.keyframeTimes = array('L')
+        self.metaOffset = self.metaSize = 0
+        self.length = 0
+
+    def add(self, tagType, offset, size, timestamp, keyframe):
+        """
+        Adds an audio/video tag to the end of the index.
+        """
+        if keyframe:
+            self.keyframes.append(len(self.types))
+            self.keyframeTimes.append(timestamp)
+
+        self.types.append(tagType)
+        self.offsets.append(offset)
+        self.sizes.append(size)
+        self.timestamps.append(timestamp)
+
+    @property
+    def duration(self):
+        if not self.timestamps:
+            return 0
+
+        return self.timestamps[-1]
+
+    def __len__(self):
+        return len(self.types)
+
+    def seek(self, timestamp):
+        """
+        Returns the index of the tag to start playing from for C{timestamp}:
+        the last keyframe at or before it. Files without video are seeked to
+        the first tag at or after C{timestamp}.
+        """
+        if self.keyframes:
+            i = bisect.bisect_right(self.keyframeTimes, timestamp)
+
+            return self.keyframes[max(i - 1, 0)]
+
+        return bisect.bisect_left(self.timestamps, timestamp)
+
+    def saveIndex(self, path):
+        """
+        Writes the index to C{path}.
+        """
+        f = open(path, 'wb')
+
+        try:
+            f.write(_INDEX_HEADER.pack(_INDEX_SIGNATURE, _BYTE_ORDER,
+                self.offsets.itemsize, self.length, len(self.types),
+                len(self.keyframes), self.metaOffset, self.metaSize))
+
+            for a in (self.types, self.offsets, self.sizes, self.timestamps,
+                    self.keyframes, self.keyframeTimes):
+                a.tofile(f)
+        finally:
+            f.close()
+
+    def loadIndex(self, path, length):
+        """
+        Reads an index written by L{saveIndex}. The index is only used if it
+        was written on a machine like this one for a file of C{length} bytes.
+
+        @return: Whether the index was loaded.
+        """
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return False
+
+        try:
+            data = f.read()
+        finally:
+            f.close()
+
+        try:
+            (signature, byteOrder, itemSize, size, count, keyframes,
+                metaOffset, metaSize) = _INDEX_HEADER.unpack_from(data)
+        except struct.error:
+            return False
+
+        if signature != _INDEX_SIGNATURE or byteOrder != _BYTE_ORDER or \
+                itemSize != self.offsets.itemsize or size != length:
+            return False
+
+        expected = _INDEX_HEADER.size + count * (1 + 3 * itemSize) + \
+            keyframes * 2 * itemSize
+
+        if len(data) != expected:
+            return False
+
+        offset = _INDEX_HEADER.size
+
+        for a, n in ((self.types, count), (self.offsets, count),
+                (self.sizes, count), (self.timestamps, count),
+                (self.keyframes, keyframes), (self.keyframeTimes, keyframes)):
+            end = offset + n * a.itemsize
+            a.fromstring(data[offset:end])
+            offset = end
+
+        self.metaOffset = metaOffset
+        self.metaSize = metaSize
+        self.length = size
+
+        return True
+
+
+class FLVFile(TagIndex):
+    """
+    A memory mapped FLV file.
+
+    The audio/video tags are indexed when the file is opened (or the index
+    saved by L{FLVWriter} is loaded), nothing else is read until L{getTag}
+    is called. Playing the file does not involve any reads from the file
+    descriptor, the pages are faulted in by the OS.
+
+    A tag that runs past the end of the file (e.g. an interrupted recording)
+    ends the index.
+
+    @ivar path: The name of the file.
+    @ivar meta: The contents of the C{onMetaData} script tag, if any.
+    """
+
+    def __init__(self, path):
+        TagIndex.__init__(self)
+
+        self.path = path
+        self.map = None
+        self.meta = {}
+
+        f = open(path, 'rb')
+
+        try:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file
+                raise exc.FileStructureInvalid('%s is not an FLV file' % (
+                    path,))
+        finally:
+            # the mapping keeps its own reference to the file
+            f.close()
+
+        try:
+            if self.loadIndex(path + INDEX_SUFFIX, len(self.map)):
+                if self.metaSize:
+                    self._readMeta(self.map[
+                        self.metaOffset:self.metaOffset + self.metaSize])
+            else:
+                self._index()
+        except:
+            self.close()
+
+            raise
+
+    def _index(self):
+        m = self.map
+        end = len(m)
+
+        if end < _FILE_HEADER.size + 4:
+            raise exc.FileStructureInvalid('%s is not an FLV file' % (
+                self.path,))
+
+        signature, version, flags, offset = _FILE_HEADER.unpack_from(m)
+
+        if signature != 'FLV':
+            raise exc.FileStructureInvalid('%s is not an FLV file' % (
+                self.path,))
+
+        # skip the first previous tag size
+        offset += 4
+        self.length = offset
+
+        unpack = _TAG_HEADER.unpack_from
+        add = self.add
+
+        while offset + TAG_HEADER_LENGTH <= end:
+            tagType, l1, l2, t1, t2, t3, s1, s2 = unpack(m, offset)
+            length = (l1 << 16) | l2
+            timestamp = (t3 << 24) | (t1 << 16) | t2
+            start = offset + TAG_HEADER_LENGTH
+
+            if start + length + 4 > end:
+                break
+
+            offset = self.length = start + length + 4
+
+            if tagType == TAG_SCRIPT:
+                if not self.meta and self._readMeta(m[start:start + length]):
+                    self.metaOffset = start
+                    self.metaSize = length
+
+                continue
+
+            if tagType not in (TAG_AUDIO, TAG_VIDEO):
+                continue
+
+            add(tagType, start, length, timestamp, tagType == TAG_VIDEO and
+                length and (ord(m[start]) >> 4) in (KEYFRAME, GENERATED_KEYFRAME))
+
+    def _readMeta(self, data):
+        try:
+            values = list(pyamf.decode(data, encoding=pyamf.AMF0))
+        except Exception:
+            # a broken script tag does not stop the file from being played
+            return False
+
+        if len(values) > 1 and values[0] == 'onMetaData' and \
+                isinstance(values[1], dict):
+            self.meta = dict(values[1])
+
+            return True
+
+        return False
+
+    def getTag(self, index):
+        """
+        Returns a C{(tagType, timestamp, data)} tuple for the tag at C{index}.
+        """
+        offset = self.offsets[index]
+
+        return (self.types[index], self.timestamps[index],
+            self.map[offset:offset + self.sizes[index]])
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class FLVWriter(TagIndex):
+    """
+    Writes tags to an FLV file, indexing them as it goes. The index is saved
+    when the writer is closed so that L{FLVFile} can open the file without
+    scanning it.
+
+    All methods do blocking I/O.
+
+    @ivar path: The name of the file.
+    @ivar timestampOffset: Added to the timestamp of each tag written. When
+        appending, this is the duration of the existing file.
+    """
+
+    def __init__(self, path, append=False):
+        TagIndex.__init__(self)
+
+        self.path = path
+        self.timestampOffset = 0
+        self.file = None
+
+        # the index will be out of date
+        try:
+            os.remove(path + INDEX_SUFFIX)
+        except OSError:
+            pass
+
+        if append and os.path.isfile(path) and os.path.getsize(path):
+            self._openAppend()
+
+            return
+
+        if os.path.exists(path):
+            # anyone playing the old file keeps their mapping of it
+            os.remove(path)
+
+        self.file = open(path, 'wb')
+        header = encode_header()
+
+        self.file.write(header)
+        self.length = len(header)
+
+    def _openAppend(self):
+        existing = FLVFile(self.path)
+
+        try:
+            for name in ('types', 'offsets', 'sizes', 'timestamps',
+                    'keyframes', 'keyframeTimes'):
+                getattr(self, name).extend(getattr(existing, name))
+
+            self.metaOffset = existing.metaOffset
+            self.metaSize = existing.metaSize
+            self.length = existing.length
+            self.timestampOffset = existing.duration
+        finally:
+            existing.close()
+
+        self.file = open(self.path, 'r+b')
+
+        # drop any partial tag at the end
+        self.file.truncate(self.length)
+        self.file.seek(self.length)
+
+    def write(self, tags):
+        """
+        Writes a list of C{(tagType, timestamp, data)} tuples to the end of
+        the file.
+        """
+        chunks = []
+        offset = self.length
+        timestampOffset = self.timestampOffset
+
+        for tagType, timestamp, data in tags:
+            timestamp += timestampOffset
+            start = offset + TAG_HEADER_LENGTH
+
+            if tagType == TAG_SCRIPT:
+                if not self.metaSize:
+                    self.metaOffset = start
+                    self.metaSize = len(data)
+            else:
+                self.add(tagType, start, len(data), timestamp,
+                    tagType == TAG_VIDEO and is_keyframe(data))
+
+            chunks.append(encode_tag(tagType, timestamp, data))
+            offset = start + len(data) + 4
+
+        self.file.write(''.join(chunks))
+        self.length = offset
+
+    def close(self):
+        """
+        Closes the file and saves the index.
+        """
+        if self.file is None:
+            return
+
+        self.file.close()
+        self.file = None
+
+        self.saveIndex(self.path + INDEX_SUFFIX)
@@ -17,10 +17,14 @@
 RTMP message implementations.
 """
 
+import collections
+
 from zope.interface import Interface, implements
 import pyamf
+from pyamf.util import BufferedByteStream
 
 from rtmpy.util import add_to_class
+from rtmpy.status import Status
 
 
 #: Changes the frame size for the RTMP stream
@@ -572,6 +576,166 @@ class UpstreamBandwidth(Message):
 
 
 
+class Uncacheable(BaseError):
+    """
+    Raised by L{EncodeCache.getKey} for values that cannot be part of a key.
+    """
+
+
+
+class EncodeCache(object):
+    """
+    A size limited cache of the AMF encoded bodies of L{Notify}/L{Invoke}
+    messages, keyed by their contents. Many of the messages sent to each
+    connection (C{onStatus} notifications, C{connect} results) are the same
+    from one connection to the next. Once C{maxEntries} is reached the least
+    recently used body is evicted.
+
+    Only messages made up of C{None}, C{bool}s, numbers, strings and C{dict}s,
+    C{list}s and L{Status} objects of those are cached. Anything else (e.g. a
+    typed object) is encoded every time.
+
+    @ivar maxEntries: The maximum number of bodies held.
+    @ivar maxBodySize: Bodies larger than this are not cached.
+    @ivar hits: The number of messages that were found in the cache.
+    @ivar misses: The number of cacheable messages that were encoded.
+    @ivar skipped: The number of messages that could not be cached.
+    """
+
+    def __init__(self, maxEntries=1024, maxBodySize=4096):
+        self.maxEntries = maxEntries
+        self.maxBodySize = maxBodySize
+
+        self.entries = collections.OrderedDict()
+
+        self.hits = self.misses = self.skipped = 0
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def getKey(self, encoding, values):
+        """
+        Returns a key for the body made up of C{values}.
+
+        @raise Uncacheable: One of the values cannot be part of a key.
+        """
+        return (encoding, _make_key(values))
+
+
+    def encode(self, encoding, values, buf):
+        """
+        Writes each of C{values} to C{buf} in C{encoding}, from the cache if
+        possible.
+        """
+        try:
+            key = self.getKey(encoding, values)
+        except Uncacheable:
+            self.skipped += 1
+
+            _encode(encoding, values, buf)
+
+            return
+
+        entries = self.entries
+
+        try:
+            data = entries.pop(key)
+        except KeyError:
+            self.misses += 1
+
+            body = BufferedByteStream()
+            _encode(encoding, values, body)
+            data = body.getvalue()
+
+            if len(data) <= self.maxBodySize:
+                if len(entries) >= self.maxEntries:
+                    entries.popitem(False)
+            else:
+                key = None
+        else:
+            self.hits += 1
+
+        if key is not None:
+            # most recently used goes to the end
+            entries[key] = data
+
+        buf.write(data)
+
+
+    def clear(self):
+        """
+        Empties the cache. The statistics are kept.
+        """
+        self.entries.clear()
+
+
+    def getStats(self):
+        """
+        Returns the number of cached bodies and how well the cache is doing.
+
+        @rtype: C{dict} with keys C{entries}, C{hits}, C{misses}, C{skipped}
+            and C{hitRate} (hits as a fraction of cacheable messages).
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'skipped': self.skipped,
+            'hitRate': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+
+
+_SCALAR_TYPES = (type(None), bool, int, long, str, unicode)
+
+
+
+def _make_key(value):
+    """
+    Returns a hashable key that is equal for values that encode to the same
+    bytes.
+    """
+    t = type(value)
+
+    if t in _SCALAR_TYPES:
+        return (t, value)
+
+    if t is float:
+        # -0.0 == 0.0
+        return (t, repr(value))
+
+    if t is list or t is tuple:
+        return (t, tuple([_make_key(x) for x in value]))
+
+    if t is dict or t is pyamf.ASObject:
+        items = value.iteritems()
+    elif t is Status:
+        items = value.__dict__.iteritems()
+    else:
+        raise Uncacheable(t)
+
+    return (t, tuple(sorted([(_make_key(k), _make_key(v))
+        for k, v in items])))
+
+
+
+def _encode(encoding, values, buf):
+    encoder = pyamf.get_encoder(encoding, buf)
+
+    for a in values:
+        encoder.writeElement(a)
+
+
+
+#: The cache shared by L{Notify} and L{Invoke} messages.
+encode_cache = EncodeCache()
+
+
+
 class Notify(Message):
     """
     A notification message.
@@ -583,6 +747,10 @@ class Notify(Message):
 
     set_type(NOTIFY)
 
+    #: The L{EncodeCache} used to encode the body or C{None} to always encode
+    #  it.
+    encodeCache = encode_cache
+
 
     def __init__(self, name=None, *args):
         self.name = name
@@ -605,10 +773,10 @@ class Notify(Message):
         """
         args = [self.name] + self.argv
 
-        encoder = pyamf.get_encoder(pyamf.AMF0, buf)
-
-        for a in args:
-            encoder.writeElement(a)
+        if self.encodeCache is None:
+            _encode(pyamf.AMF0, args, buf)
+        else:
+            self.encodeCache.encode(pyamf.AMF0, args, buf)
 
 
     def dispatch(self, listener, timestamp):
@@ -628,6 +796,10 @@ class Invoke(Message):
 
     encoding = pyamf.AMF0
 
+    #: The L{EncodeCache} used to encode the body or C{None} to always encode
+    #  it.
+    encodeCache = encode_cache
+
 
     def __init__(self, name=None, id=None, *args):
         self.name = name
@@ -652,10 +824,10 @@ class Invoke(Message):
         """
         args = [self.name, self.id] + self.argv
 
-        encoder = pyamf.get_encoder(self.encoding, buf)
-
-        for a in args:
-            encoder.writeElement(a)
+        if self.encodeCache is None:
+            _encode(self.encoding, args, buf)
+        else:
+            self.encodeCache.encode(self.encoding, args, buf)
 
 
     def dispatch(self, listener, timestamp):
@@ -369,9 +369,10 @@ class ServerNegotiator(BaseNegotiator):
         """
         Called to build the ack packet, based on the state of the negotiations.
 
-        C{RTMP} payloads are just random.
+        The ack echoes the payload of the client's syn, which the client
+        verifies.
         """
-        packet.payload = _generate_payload()
+        packet.payload = self.peer_syn.payload
 
 
     def synReceived(self):
@@ -30,6 +30,21 @@ class IMessageDispatcher(Interface):
         """
 
 
+    def dispatchFragment(stream, datatype, timestamp, data, marker,
+                         bodyLength):
+        """
+        Called with each frame of a message that is being streamed as it is
+        received. See L{codec.Decoder}.
+
+        @param stream: The L{Stream} to receive this fragment.
+        @param datatype: The RTMP datatype for the message.
+        @param timestamp: The absolute timestamp of the message.
+        @param data: The raw data of this part of the message.
+        @param marker: A combination of the C{codec.FRAGMENT_*} markers.
+        @param bodyLength: The length of the whole message.
+        """
+
+
     def bytesInterval(bytes):
         """
         Called when a specified number of bytes has been read from the stream.
@@ -73,6 +73,7 @@ class MessageDispatcher(object):
 
     def __init__(self, streamer):
         self.streamer = streamer
+        self._fragments = codec.FragmentAssembler()
 
 
     def dispatchMessage(self, stream, datatype, timestamp, data):
@@ -90,6 +91,30 @@ class MessageDispatcher(object):
         m.dispatch(stream, timestamp)
 
 
+    def dispatchFragment(self, stream, datatype, timestamp, data, marker,
+                         bodyLength):
+        """
+        Called with each frame of an audio/video message as it is received.
+
+        The fragments are passed on to C{stream.onFragment} if the stream
+        provides it, otherwise they are put back together and dispatched as a
+        whole message.
+
+        @param marker: A combination of the C{codec.FRAGMENT_*} markers.
+        @param bodyLength: The length of the whole message.
+        """
+        func = getattr(stream, 'onFragment', None)
+
+        if func is not None:
+            func(datatype, timestamp, data, marker, bodyLength)
+
+            return
+
+        data = self._fragments.add((stream, datatype), data, marker)
+
+        if data is not None:
+            self.dispatchMessage(stream, datatype, timestamp, data)
+
 
     def bytesInterval(self, bytes):
         """
@@ -103,17 +128,129 @@ class MessageDispatcher(object):
 
 
 
+class WriteAggregator(object):
+    """
+    Gathers the writes made to a transport and passes them on with a single
+    C{writeSequence} call after C{maxDelay} seconds (C{0} being the next
+    reactor turn).
+
+    Twisted already merges the writes made within one reactor turn. Allowing
+    a small delay merges writes from successive turns as well (e.g. the a/v
+    messages of a low bitrate stream), so fewer C{send} calls are made.
+
+    @ivar transport: The transport that the gathered writes are passed to.
+    @ivar maxDelay: The number of seconds that data may be held for.
+    @ivar maxBytes: Once this many bytes are pending, they are flushed
+        immediately.
+    @ivar pending: The data waiting to be written.
+    @ivar size: The number of bytes in C{pending}.
+    """
+
+
+    def __init__(self, transport, maxDelay=0, maxBytes=64 * 1024, clock=None):
+        self.transport = transport
+        self.maxDelay = maxDelay
+        self.maxBytes = maxBytes
+
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.clock = clock
+
+        self.pending = []
+        self.size = 0
+
+        self._call = None
+
+
+    def write(self, data):
+        if not data:
+            return
+
+        self.pending.append(data)
+        self.size += len(data)
+
+        self._scheduleFlush()
+
+
+    def writeSequence(self, seq):
+        for data in seq:
+            self.pending.append(data)
+            self.size += len(data)
+
+        self._scheduleFlush()
+
+
+    def _scheduleFlush(self):
+        if self.size >= self.maxBytes:
+            self.flush()
+        elif self._call is None and self.pending:
+            self._call = self.clock.callLater(self.maxDelay, self.flush)
+
+
+    def flush(self):
+        """
+        Passes any pending data to the transport.
+        """
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+
+            self._call = None
+
+        if not self.pending:
+            return
+
+        pending = self.pending
+
+        self.pending = []
+        self.size = 0
+
+        self.transport.writeSequence(pending)
+
+
+
 class BaseStreamer(object):
     """
     Provides all the base functionality for handling an RTMP input/output.
 
     @ivar decoder: RTMP Decoder that is fed data via L{dataReceived}
+    @ivar batchDecode: Whether to decode all buffered data as soon as it is
+        received, only handing over to the cooperator once a budget has been
+        exceeded. If C{False}, one frame is decoded per cooperator iteration.
+    @ivar decodeByteBudget: The maximum number of bytes to decode in one slice
+        when L{batchDecode} is set. C{0} means no limit.
+    @ivar decodeTimeBudget: The maximum number of seconds to spend decoding in
+        one slice when L{batchDecode} is set. C{0} means no limit.
+    @ivar coalesceWrites: Whether to gather the encoded output in a
+        L{WriteAggregator} rather than writing each chunk to the transport.
+    @ivar writeDelay: The number of seconds that L{coalesceWrites} may hold
+        output for.
+    @ivar writeBufferSize: The number of bytes that L{coalesceWrites} may hold
+        before flushing.
+    @ivar maxChannels: The maximum number of RTMP channels the peer may use.
+        Exceeding it is a decode error, which drops the connection.
+    @ivar streamFragments: Whether audio/video messages are dispatched a frame
+        at a time as they arrive, rather than once they are complete. See
+        L{MessageDispatcher.dispatchFragment}.
     """
 
     implements(message.IMessageListener)
 
     dispatcher = MessageDispatcher
 
+    batchDecode = False
+    decodeByteBudget = 0
+    decodeTimeBudget = 0
+
+    coalesceWrites = False
+    writeDelay = 0
+    writeBufferSize = 64 * 1024
+
+    maxChannels = 1024
+
+    streamFragments = False
+
 
     @property
     def decoding(self):
@@ -122,7 +259,7 @@ class BaseStreamer(object):
 
         If all the input buffer has been consumed, this will be C{False}.
         """
-        return getattr(self, 'decoding_task', None) is not None
+        return getattr(self, 'decoder_task', None) is not None
 
 
     @property
@@ -130,7 +267,7 @@ class BaseStreamer(object):
         """
         Whether this streamer is currently encoding RTMP message/s.
         """
-        return getattr(self, 'encoding_task', None) is not None
+        return getattr(self, 'encoder_task', None) is not None
 
 
     def getWriter(self):
@@ -175,9 +312,21 @@ class BaseStreamer(object):
         self._decodingBuffer = BufferedByteStream()
         self._encodingBuffer = BufferedByteStream()
 
+        self.writer = self.getWriter()
+
+        if self.coalesceWrites:
+            self.writer = WriteAggregator(self.writer, self.writeDelay,
+                self.writeBufferSize)
+
         self.decoder = codec.Decoder(self.getDispatcher(), self.streamManager,
             stream=self._decodingBuffer)
-        self.encoder = codec.Encoder(self.getWriter(),
+        self.decoder.maxChannels = self.maxChannels
+
+        if self.streamFragments:
+            self.decoder.streamingTypes = (message.AUDIO_DATA,
+                message.VIDEO_DATA)
+
+        self.encoder = codec.Encoder(self.writer,
             stream=self._encodingBuffer)
 
         self.decoder_task = None
@@ -189,6 +338,9 @@ class BaseStreamer(object):
         """
         self.streamManager.closeAllStreams()
 
+        if isinstance(self.writer, WriteAggregator):
+            self.writer.flush()
+
         self._decodingBuffer.truncate()
         self._encodingBuffer.truncate()
 
@@ -197,6 +349,7 @@ class BaseStreamer(object):
 
         del self.decoder_task, self.decoder
         del self.encoder_task, self.encoder
+        del self.writer
 
 
     def dataReceived(self, data):
@@ -205,8 +358,15 @@ class BaseStreamer(object):
         """
         self.decoder.send(data)
 
-        if not self.decoding:
-            self.startDecoding()
+        if self.decoding:
+            # the running task will pick up the new data
+            return
+
+        if self.batchDecode:
+            if self.decoder.drain(self.decodeByteBudget, self.decodeTimeBudget):
+                return
+
+        self.startDecoding()
 
 
     def startDecoding(self):
@@ -289,7 +449,7 @@ class BaseStreamer(object):
             # todo: make this better
             raise RuntimeError('No streaming channel available')
 
-        return codec.StreamingChannel(channel, stream.streamId, self.getWriter())
+        return codec.StreamingChannel(channel, stream.streamId, self.writer)
 
 
     def onFrameSize(self, size, timestamp):
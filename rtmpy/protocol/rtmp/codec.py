@@ -27,11 +27,12 @@ The Encoder/Decoder is not thread safe.
 """
 
 import collections
+import time
 
 from pyamf.util import BufferedByteStream
 
-from rtmpy.protocol.rtmp import header
-from rtmpy import message
+from rtmpy.protocol.rtmp import header, scheduler
+from rtmpy import message, _speedups
 
 
 
@@ -53,6 +54,13 @@ MAX_CHANNELS = 0xffff + 64 - 2
 #  stream. It cannot be deleted and is integral to the RTMP protocol.
 COMMAND_CHANNEL_ID = 0
 
+#: Markers for the fragments of a message delivered as it arrives. See
+#  L{ChannelDemuxer.readFragment}. A message that fits in one frame is marked
+#  C{FRAGMENT_START | FRAGMENT_END}.
+FRAGMENT_CONTINUE = 0
+FRAGMENT_START = 1
+FRAGMENT_END = 2
+
 
 
 class BaseError(Exception):
@@ -83,8 +91,8 @@ class BaseChannel(object):
     @ivar channelId: The id that this channel has been assigned (duh?!)
     @type channelId: C{int}
     @ivar header: The calculated header for this channel. RTMP can send
-        relative headers, which will be merged with the previous headers to
-        calculate the absolute values for the header.
+        relative headers, which will be merged in place with the previous
+        headers to calculate the absolute values for the header.
     @type header: L{header.Header} or C{None}
     @ivar stream: The byte container which frames are marshalled.
     @type stream: L{BufferedByteStream}
@@ -98,6 +106,9 @@ class BaseChannel(object):
     @type bytes: C{int}
     """
 
+    __slots__ = ('channelId', 'stream', 'frameSize', 'frameRemaining',
+        'bytes', 'timestamp', 'header', '_bodyRemaining', '_lastDelta')
+
 
     def __init__(self, channelId, stream, frameSize):
         self.channelId = channelId
@@ -126,19 +137,16 @@ class BaseChannel(object):
     def setHeader(self, new):
         """
         Applies a new header to this channel. If this channel already has a
-        header, then the new values are merged with the existing.
+        header, then the new values are merged into the existing one, which
+        is updated in place.
 
         @param new: The header to apply to this channel.
         @type new: L{header.Header}
-        @return: The previous header, if there is one.
-        @rtype: L{header.Header} or C{None}
         """
-        old = self.header
-
         if self.header is None:
             self.header = new
         else:
-            self.header = header.merge(self.header, new)
+            self.header.merge(new)
 
         if new.timestamp == -1:
             # receiving a new message and no timestamp has been supplied means
@@ -151,8 +159,6 @@ class BaseChannel(object):
 
         self._bodyRemaining = self.header.bodyLength - self.bytes
 
-        return old
-
 
     def marshallFrame(self, size):
         """
@@ -165,6 +171,13 @@ class BaseChannel(object):
         raise NotImplementedError
 
 
+    def frameLength(self):
+        """
+        Returns the number of body bytes in the next frame.
+        """
+        return min(self.frameRemaining, self.frameSize, self._bodyRemaining)
+
+
     def marshallOneFrame(self):
         """
         Marshalls one RTMP frame and adjusts internal counters accordingly.
@@ -248,6 +261,8 @@ class ConsumingChannel(BaseChannel):
     Reads RTMP frames.
     """
 
+    __slots__ = ()
+
 
     def marshallFrame(self, size):
         """
@@ -265,19 +280,65 @@ class ProducingChannel(BaseChannel):
     Writes RTMP frames.
 
     @ivar buffer: Any data waiting to be written to the underlying stream.
+        Allocated on first use and freed by L{release}.
     @type buffer: L{BufferedByteStream}
     @ivar acquired: Whether this channel is acquired. See L{ChannelMuxer.
         acquireChannel}
     """
 
+    __slots__ = ('acquired', 'callback', '_buffer', '_nextHeader')
+
 
     def __init__(self, channelId, stream, frameSize):
         BaseChannel.__init__(self, channelId, stream, frameSize)
 
-        self.buffer = BufferedByteStream()
+        self._buffer = None
         self.acquired = False
         self.callback = None
 
+        self._nextHeader = header.Header(channelId)
+
+
+    def buildHeader(self, timestamp, datatype, bodyLength, streamId):
+        """
+        Returns the header for the next message to be written to this channel.
+
+        The same instance is returned for every message, it must not be held
+        on to once the message has been written.
+
+        @rtype: L{header.Header}
+        """
+        h = self._nextHeader
+
+        h.timestamp = timestamp
+        h.datatype = datatype
+        h.bodyLength = bodyLength
+        h.streamId = streamId
+        h.full = False
+        h.continuation = False
+
+        return h
+
+
+    @property
+    def buffer(self):
+        b = self._buffer
+
+        if b is None:
+            b = self._buffer = BufferedByteStream()
+            # a fresh stream reserves a few KB on the first write, whereas a
+            # truncated one only allocates what is appended
+            b.truncate()
+
+        return b
+
+
+    def release(self):
+        """
+        Called when the channel is idle. Frees the buffer.
+        """
+        self._buffer = None
+
 
     def setCallback(self, cb):
         """
@@ -293,9 +354,12 @@ class ProducingChannel(BaseChannel):
         """
         BaseChannel.reset(self)
 
-        self.buffer.seek(0)
-        self.buffer.truncate()
+        if self._buffer is not None:
+            self._buffer.seek(0)
+            self._buffer.truncate()
+
         self.header = None
+        self.callback = None
 
 
     def append(self, data):
@@ -309,7 +373,7 @@ class ProducingChannel(BaseChannel):
         """
         Writes a section of the buffer as part of the RTMP frame.
         """
-        self.stream.write(self.buffer.read(size))
+        self.stream.write(self._buffer.read(size))
 
 
 
@@ -322,8 +386,11 @@ class Codec(object):
     @ivar channels: A L{dict} of L{BaseChannel} objects that are handling data.
     @ivar frameSize: The maximum size for an individual frame. Read-only, use
         L{setFrameSize} instead.
+    @ivar maxChannels: The maximum number of channels that will be allocated.
     """
 
+    maxChannels = MAX_CHANNELS
+
 
     def __init__(self, stream=None):
         self.stream = stream or BufferedByteStream()
@@ -387,10 +454,21 @@ class FrameReader(Codec):
     A frame consists of a header and then a chunk of data. Each header will
     contain the channel that the frame is destined for. RTMP allows multiple
     channels to be interleaved together.
+
+    The sizes of the header and the frame body are known before either is
+    parsed, so the reader checks that enough data is available up front rather
+    than trying and backing out.
+
+    @ivar needed: The number of bytes the stream must hold before the next
+        call to L{readFrame} can make progress.
     """
 
+    #: The number of bytes that have been read from the stream before it is
+    #  compacted. See L{compact}.
+    compactThreshold = 64 * 1024
 
     _currentChannel = None
+    needed = 1
 
 
     def buildChannel(self, channelId):
@@ -401,13 +479,67 @@ class FrameReader(Codec):
         return ConsumingChannel(channelId, self.stream, self.frameSize)
 
 
+    def getChannel(self, channelId):
+        """
+        Returns the channel for C{channelId}, allocating it if this is the first
+        time the peer has used it.
+
+        @raise DecodeError: The peer has used more than C{maxChannels}
+            channels.
+        """
+        try:
+            return self.channels[channelId]
+        except KeyError:
+            pass
+
+        if len(self.channels) >= self.maxChannels:
+            raise DecodeError('Channel limit of %d reached (channelId=%r)' % (
+                self.maxChannels, channelId))
+
+        return Codec.getChannel(self, channelId)
+
+
     def readHeader(self):
         """
         Reads an RTMP header from the stream.
 
+        @return: The header or C{None} if the stream does not hold all of it,
+            in which case the stream is left untouched.
         @rtype: L{header.Header}
         """
-        return header.decode(self.stream)
+        stream = self.stream
+
+        if stream.remaining() >= header.MAX_HEADER_LENGTH:
+            # enough for any header
+            pos = stream.tell()
+            h = header.decode(stream)
+            self.bytes += stream.tell() - pos
+
+            return h
+
+        buf = stream.peek(header.MAX_HEADER_LENGTH)
+        ret = header.unpack_from(buf)
+
+        if ret is None:
+            if not buf:
+                self.needed = 1
+            else:
+                length = header.get_header_length(ord(buf[0]))
+
+                if len(buf) >= length:
+                    # the extended timestamp is missing
+                    length += 4
+
+                self.needed = length
+
+            return None
+
+        h, length = ret
+
+        stream.seek(stream.tell() + length)
+        self.bytes += length
+
+        return h
 
 
     def send(self, data):
@@ -427,42 +559,41 @@ class FrameReader(Codec):
            received)
          * An L{IChannelMeta} instance.
 
-        If an attempt to read from the stream comes to a natural end then
-        C{StopIteration} is raised, otherwise C{IOError}.
+        C{None} is returned if the stream does not hold a complete frame yet,
+        see L{needed}. A header that has been read is kept until its frame
+        body arrives.
         """
-        pos = self.stream.tell()
         channel = self._currentChannel
 
         if channel is None:
-            try:
-                h = self.readHeader()
-            except IOError:
-                self.stream.seek(pos, 0)
+            h = self.readHeader()
 
-                raise
-
-            new_pos = self.stream.tell()
-            self.bytes += new_pos - pos
-            pos = new_pos
+            if h is None:
+                return None
 
             channel = self._currentChannel = self.getChannel(h.channelId)
 
             channel.setHeader(h)
 
-        try:
-            bytes = channel.marshallOneFrame()
-        except IOError:
-            self.stream.seek(pos, 0)
+        size = channel.frameLength()
 
-            raise
-        else:
-            self._currentChannel = None
+        if self.stream.remaining() < size:
+            self.needed = size
 
-        self.bytes += self.stream.tell() - pos
+            return None
+
+        bytes = channel.marshallOneFrame()
+
+        self._currentChannel = None
+        self.needed = 1
+        self.bytes += size
         complete = channel.complete()
         h = channel.header
 
         if complete:
+            # the channel header is reused for the next message, so hand out a
+            # snapshot
+            h = h.copy()
             h.timestamp = channel.timestamp
 
             channel.reset()
@@ -470,6 +601,18 @@ class FrameReader(Codec):
         return bytes, complete, h
 
 
+    def compact(self):
+        """
+        Discards the data that has been read from the stream. This copies any
+        unread data, so it is only done when nothing is left to read or more
+        than C{compactThreshold} bytes have been read.
+        """
+        stream = self.stream
+
+        if stream.at_eof() or stream.tell() >= self.compactThreshold:
+            stream.consume()
+
+
     def __iter__(self):
         return self
 
@@ -485,15 +628,24 @@ class ChannelDemuxer(FrameReader):
     else is not. This means that the raw data is buffered until the channel is
     complete.
 
+    Incomplete channel data is held as a list of frame bodies and joined
+    once the channel is complete. Concatenating each frame onto the partial
+    body instead would copy the body again for every frame received.
+
     @ivar bucket: Buffers any incomplete channel data.
-    @type bucket: channel -> buffered data.
+    @type bucket: channelId -> C{list} of frame bodies.
+    @ivar streamingTypes: The datatypes of the messages that are not buffered
+        but handed out a frame at a time by L{readFragment}.
     """
 
+    streamingTypes = ()
+
 
     def __init__(self, stream=None):
         FrameReader.__init__(self, stream=stream)
 
         self.bucket = {}
+        self._fragmented = set()
 
 
     def readFrame(self):
@@ -507,23 +659,87 @@ class ChannelDemuxer(FrameReader):
         * The associated L{IChannelMeta} instance
 
         C{None, None} will be returned if a frame was read, but no channel was
-        complete.
+        complete. C{None} is returned if there is not enough data to read a
+        frame.
         """
-        data, complete, meta = FrameReader.readFrame(self)
+        frame = FrameReader.readFrame(self)
+
+        if frame is None:
+            return None
+
+        return self._collect(*frame)
 
+
+    def _collect(self, data, complete, meta):
         if complete:
-            data = self.bucket.pop(meta.channelId, '') + data
+            frames = self.bucket.pop(meta.channelId, None)
+
+            if frames is not None:
+                # one copy of the body, regardless of the number of frames
+                frames.append(data)
+                data = ''.join(frames)
 
             return data, meta
 
-        channelId = meta.channelId
+        frames = self.bucket.get(meta.channelId, None)
 
-        self.bucket[channelId] = self.bucket.get(channelId, '') + data
+        if frames is None:
+            self.bucket[meta.channelId] = [data]
+        else:
+            frames.append(data)
 
         # nothing was available
         return None, None
 
 
+    def readFragment(self):
+        """
+        Like L{readFrame}, but the frames of messages with a datatype in
+        C{streamingTypes} are returned as they are read instead of being
+        buffered.
+
+        Returns a tuple containing:
+
+        * the raw bytes for the frame or channel
+        * The associated L{IChannelMeta} instance. For fragments, the
+          timestamp is that of the whole message.
+        * A combination of the C{FRAGMENT_*} markers, or C{None} if this is a
+          buffered message.
+
+        C{None} is returned if there is not enough data to read a frame.
+        """
+        frame = FrameReader.readFrame(self)
+
+        if frame is None:
+            return None
+
+        data, complete, meta = frame
+
+        if meta.datatype not in self.streamingTypes:
+            data, meta = self._collect(data, complete, meta)
+
+            return data, meta, None
+
+        channelId = meta.channelId
+        fragmented = self._fragmented
+
+        if channelId in fragmented:
+            marker = FRAGMENT_CONTINUE
+        else:
+            marker = FRAGMENT_START
+
+        if complete:
+            marker |= FRAGMENT_END
+            fragmented.discard(channelId)
+        else:
+            fragmented.add(channelId)
+
+            meta = meta.copy()
+            meta.timestamp = self.channels[channelId].timestamp
+
+        return data, meta, marker
+
+
 
 class Decoder(ChannelDemuxer):
     """
@@ -532,6 +748,9 @@ class Decoder(ChannelDemuxer):
     At this layer, a message is a datatype, a timestamp and a blob of data. It
     is up to the dispatcher to decide how to handle the decoding of the data.
 
+    The frames of messages with a datatype in C{streamingTypes} are passed to
+    the dispatcher's C{dispatchFragment} as they arrive instead.
+
     @ivar dispatcher: Receives dispatched messages generated by the decoder.
     @type dispatcher: Provides L{interfaces.IMessageDispatcher}
     @ivar stream_factory: Builds stream listener objects.
@@ -569,14 +788,24 @@ class Decoder(ChannelDemuxer):
         This function does not return anything. Call it iteratively to pump RTMP
         messages out of the stream.
 
-        If C{IOError} is raised, something went wrong decoding the stream,
-        otherwise C{StopIteration} will be raised if the end of the stream is
-        reached.
+        C{StopIteration} will be raised if the stream does not hold a complete
+        frame.
         """
-        try:
-            data, meta = ChannelDemuxer.readFrame(self)
-        except IOError:
-            self.stream.consume()
+        marker = None
+
+        if self.streamingTypes:
+            frame = self.readFragment()
+
+            if frame is not None:
+                data, meta, marker = frame
+        else:
+            frame = ChannelDemuxer.readFrame(self)
+
+            if frame is not None:
+                data, meta = frame
+
+        if frame is None:
+            self.compact()
 
             raise StopIteration
 
@@ -589,6 +818,12 @@ class Decoder(ChannelDemuxer):
 
         stream = self.stream_factory.getStream(meta.streamId)
 
+        if marker is not None:
+            self.dispatcher.dispatchFragment(stream, meta.datatype,
+                meta.timestamp, data, marker, meta.bodyLength)
+
+            return
+
         self.dispatcher.dispatchMessage(
             stream, meta.datatype, meta.timestamp, data)
 
@@ -596,16 +831,96 @@ class Decoder(ChannelDemuxer):
     __next__ = next
 
 
+    def feed(self, data):
+        """
+        Adds C{data} to the stream and decodes every message that is complete
+        in one go, without involving the C{dispatcher} or C{stream_factory}.
+        Incomplete data is kept for the next call.
+
+        This is the fast path for offline processing (dumps, recordings,
+        analytics). C{streamingTypes} and C{bytesInterval} are ignored, but
+        frame size messages are applied as they are decoded.
+
+        @return: A list of C{(streamId, datatype, timestamp, body)} tuples, in
+            the order that the messages were completed.
+        """
+        readFrame = self.readFrame
+        messages = []
+        append = messages.append
+
+        self.stream.append(data)
+
+        while True:
+            frame = readFrame()
+
+            if frame is None:
+                break
+
+            body, meta = frame
+
+            if body is None:
+                continue
+
+            datatype = meta.datatype
+
+            if datatype == message.FRAME_SIZE:
+                m = message.FrameSize()
+                m.decode(BufferedByteStream(body))
+
+                self.setFrameSize(m.size)
+
+            append((meta.streamId, datatype, meta.timestamp, body))
+
+        self.compact()
+
+        return messages
+
+
+    def drain(self, maxBytes=0, maxTime=0):
+        """
+        Decodes and dispatches every complete frame in the stream in one go,
+        rather than one frame per call to L{next}.
+
+        @param maxBytes: Stop once this many bytes have been decoded. C{0}
+            means no limit.
+        @param maxTime: Stop once this many seconds have elapsed. C{0} means
+            no limit.
+        @return: C{True} if the stream was exhausted, C{False} if a limit was
+            reached before that happened.
+        """
+        limit = maxBytes and self.bytes + maxBytes
+        deadline = maxTime and time.time() + maxTime
+        next = self.next
+
+        try:
+            while True:
+                next()
+
+                if limit and self.bytes >= limit:
+                    return False
+
+                if deadline and time.time() >= deadline:
+                    return False
+        except StopIteration:
+            return True
+
+
+
 class ChannelMuxer(Codec):
     """
     Manages RTMP channels and marshalls the data so that the channels can be
     interleaved.
 
-    @ivar releasedChannels: A list of channel ids that have been released.
-    @type releasedChannels: C{collections.deque}
+    @ivar pending: A fifo queue of messages that are waiting to be assigned a
+        channel.
+    @type pending: C{collections.deque}
+    @ivar freeChannels: The channels that have been released, most recently
+        released first. When empty, every channel id up to C{channelsInUse}
+        is in use.
+    @type freeChannels: C{collections.deque}
     @ivar channelsInUse: Number of RTMP channels currently in use.
-    @ivar activeChannels: A list of L{BaseChannel} objects that are active (and
-        therefore unavailable)
+    @ivar scheduler: Decides the order in which the frames of the active
+        channels are interleaved. See L{scheduler}.
     @ivar nextHeaders: A collection of L{header.Header}s to be applied to the
         channel the next time it is asked to marshall a frame.
     @ivar timestamps: A collection of last known timestamps for a given channel.
@@ -614,14 +929,16 @@ class ChannelMuxer(Codec):
     @ivar callbacks: A collection of channel->callback (if any).
     """
 
+    scheduler_class = scheduler.WeightedScheduler
+
 
     def __init__(self, stream=None):
         Codec.__init__(self, stream=stream)
 
-        self.pending = []
+        self.pending = collections.deque()
 
-        self.releasedChannels = collections.deque()
-        self.activeChannels = {}
+        self.freeChannels = collections.deque()
+        self.scheduler = self.scheduler_class()
         self.channelsInUse = 0
 
         self.nextHeaders = {}
@@ -648,16 +965,16 @@ class ChannelMuxer(Codec):
         @rtype: L{Channel} or C{None}
         """
         try:
-            channelId = self.releasedChannels.popleft()
+            c = self.freeChannels.popleft()
         except IndexError:
             channelId = self.channelsInUse + 1
 
-            if channelId > MAX_CHANNELS:
+            if channelId > self.maxChannels:
                 return None
 
-        self.channelsInUse += 1
+            c = self.getChannel(channelId)
 
-        c = self.getChannel(channelId)
+        self.channelsInUse += 1
         c.acquired = True
 
         return c
@@ -670,14 +987,19 @@ class ChannelMuxer(Codec):
 
         @param channelId: The id of the channel being released.
         """
-        c = self.getChannel(channelId)
+        c = self.channels.get(channelId, None)
 
-        if c.acquired is False:
+        if c is None or c.acquired is False:
             raise EncodeError('Attempted to release an inactive channel '
                 '(channelId=%r)' % (channelId,))
 
-        c.acquired = False
-        self.releasedChannels.appendleft(channelId)
+        self._releaseChannel(c)
+
+
+    def _releaseChannel(self, channel):
+        channel.acquired = False
+        channel.release()
+        self.freeChannels.appendleft(channel)
         self.channelsInUse -= 1
 
 
@@ -687,12 +1009,13 @@ class ChannelMuxer(Codec):
         """
         h = self.nextHeaders.pop(channel, None)
 
-        if h is not None:
-            h = channel.setHeader(h)
-        else:
-            h = channel.header
+        if h is None:
+            header.encode(self.stream, channel.header, channel.header)
+
+            return
 
-        header.encode(self.stream, channel.header, h)
+        header.encode(self.stream, h, channel.header)
+        channel.setHeader(h)
 
 
     def flush(self):
@@ -738,16 +1061,37 @@ class ChannelMuxer(Codec):
             # busy with one message at a time. Command messages are always
             # written right away
             channel = self.getChannel(COMMAND_CHANNEL_ID)
-        else:
-            channel = self.acquireChannel()
 
-            if not channel:
-                self.pending.append((data, datatype, streamId, timestamp, whenDone))
+            self._writeMessage(channel, data, datatype, streamId, timestamp,
+                whenDone)
 
-                return
+            while not self._encodeOneFrame(channel):
+                pass
+
+            channel.reset()
+            self.flush()
+
+            return
 
-        h = header.Header(
-            channel.channelId,
+        # messages already waiting for a channel go first
+        channel = None if self.pending else self.acquireChannel()
+
+        if channel is None:
+            self.pending.append((data, datatype, streamId, timestamp, whenDone))
+
+            return
+
+        self._writeMessage(channel, data, datatype, streamId, timestamp,
+            whenDone)
+        self.scheduler.activate(channel, datatype, streamId)
+
+
+    def _writeMessage(self, channel, data, datatype, streamId, timestamp,
+                      whenDone):
+        """
+        Prepares C{channel} to encode a message.
+        """
+        h = channel.buildHeader(
             timestamp - channel.timestamp,
             datatype,
             len(data),
@@ -759,38 +1103,56 @@ class ChannelMuxer(Codec):
         channel.append(data)
         self.nextHeaders[channel] = h
 
-        if channel.channelId == COMMAND_CHANNEL_ID:
-            while not self._encodeOneFrame(channel):
-                pass
 
-            channel.reset()
-            self.flush()
+    def _assignPending(self):
+        """
+        Assigns channels to the pending messages, for as long as there are
+        channels available.
+        """
+        pending = self.pending
+        acquire = self.acquireChannel
+        activate = self.scheduler.activate
 
-            return
+        while pending:
+            channel = acquire()
 
-        self.activeChannels[channel] = channel.channelId
+            if channel is None:
+                return
+
+            data, datatype, streamId, timestamp, whenDone = pending.popleft()
+
+            self._writeMessage(channel, data, datatype, streamId, timestamp,
+                whenDone)
+            activate(channel, datatype, streamId)
 
 
     def next(self):
         """
-        Encodes one RTMP frame from all the active channels.
+        Runs one round of the scheduler, encoding RTMP frames from the active
+        channels.
         """
-        while self.pending and self.channelsInUse <= MAX_CHANNELS:
-            self.send(*self.pending.pop(0))
+        if self.pending:
+            self._assignPending()
 
-        if not bool(self.activeChannels):
+        if not self.scheduler:
             raise StopIteration
 
-        to_release = []
+        for channel in self.scheduler.run(self._encodeOneFrame):
+            channel.reset()
+            self._releaseChannel(channel)
 
-        for channel in self.activeChannels:
-            if self._encodeOneFrame(channel):
-                channel.reset()
-                to_release.append(channel)
 
-        for channel in to_release:
-            self.releaseChannel(channel.channelId)
-            del self.activeChannels[channel]
+    def getStats(self):
+        """
+        Returns the queue depth statistics of the scheduler, along with the
+        number of messages waiting for a free channel (C{pending}).
+
+        @see: L{scheduler.RoundRobinScheduler.getStats}
+        """
+        stats = self.scheduler.getStats()
+        stats['pending'] = len(self.pending)
+
+        return stats
 
 
 
@@ -804,8 +1166,6 @@ class Encoder(ChannelMuxer):
     To think about::
         - Stale messages; A timestamp less than the last known timestamp.
 
-    @ivar pending: An fifo queue of messages that are waiting to be assigned a
-        channel.
     @ivar output: A C{write}able object that will receive the final encoded RTMP
         stream. The instance only needs to implement C{write} and accept 1 param
         (the data).
@@ -833,6 +1193,9 @@ class Encoder(ChannelMuxer):
         """
         s = self.stream.getvalue()
 
+        if not s:
+            return
+
         self.output.write(s)
         self.stream.consume()
 
@@ -840,7 +1203,7 @@ class Encoder(ChannelMuxer):
 
     @property
     def active(self):
-        return bool(self.activeChannels)
+        return bool(self.scheduler)
 
     def __iter__(self):
         return self
@@ -852,6 +1215,12 @@ class Encoder(ChannelMuxer):
 
 class StreamingChannel(object):
     """
+    Writes audio/video messages for a single stream directly to C{output},
+    bypassing the muxer.
+
+    @ivar output: The object that the encoded bytes are written to. If it
+        provides a I{writeSequence} method, relayed messages are written
+        without joining the header and body together first.
     """
 
 
@@ -862,17 +1231,16 @@ class StreamingChannel(object):
         self.output = output
         self.stream = BufferedByteStream()
 
-        self._lastHeader = None
+        self._fragment = None
         self._oldStream = channel.stream
         channel.stream = self.stream
 
-        h = header.Header(channel.channelId)
+        # the datatype, body length and timestamp delta of the last header
+        self._last = None
+        self._template = header.get_template(channel.channelId)
+        self._continuationHeader = self._template.continuation
 
-        # encode a continuation header for speed
-        header.encode(self.stream, h, h)
-
-        self._continuationHeader = self.stream.getvalue()
-        self.stream.consume()
+        self._writeSequence = getattr(output, 'writeSequence', None)
 
 
     def __del__(self):
@@ -886,25 +1254,41 @@ class StreamingChannel(object):
         self.type = type
 
 
-    def sendData(self, data, timestamp):
+    def sendData(self, data, timestamp, frames=None):
+        """
+        Writes an RTMP message containing C{data} to C{output}.
+
+        @param frames: When the same message is being relayed to many
+            subscribers, a C{dict} shared between their L{StreamingChannel}s.
+            The body is split into frames once for each frame size/channel id
+            combination and the result is written as is, only the message
+            header is encoded per subscriber.
+        @type frames: C{dict} or C{None}
+        """
         c = self.channel
+        prefix = self._encodeHeader(timestamp, len(data))
 
-        if timestamp < c.timestamp:
-            relTimestamp = timestamp
-        else:
-            relTimestamp = timestamp - c.timestamp
+        if frames is not None:
+            key = (c.frameSize, c.channelId)
 
-        h = header.Header(c.channelId, relTimestamp, self.type, len(data), self.streamId)
+            try:
+                body = frames[key]
+            except KeyError:
+                body = frames[key] = split_frames(data, c.frameSize,
+                    self._continuationHeader)
 
-        if self._lastHeader is None:
-            h.full = True
+            c.reset()
 
-        c.setHeader(h)
-        c.append(data)
+            if self._writeSequence is not None:
+                self._writeSequence([prefix, body])
+            else:
+                self.output.write(prefix + body)
+
+            return
 
-        header.encode(self.stream, h, self._lastHeader)
-        self._lastHeader = h
+        c.append(data)
 
+        self.stream.write(prefix)
         c.marshallOneFrame()
 
         while not c.complete():
@@ -916,6 +1300,168 @@ class StreamingChannel(object):
         self.stream.consume()
 
 
+    def _encodeHeader(self, timestamp, bodyLength):
+        """
+        Applies the header of the next message to the channel and returns it
+        encoded.
+
+        Only the first header is built and packed in full. After that the
+        fields of a type 1 or 2 header are patched into the preformatted
+        buffers of the channel's L{header.HeaderTemplate}.
+
+        @rtype: C{str}
+        """
+        c = self.channel
+        datatype = self.type
+
+        if timestamp < c.timestamp:
+            relTimestamp = timestamp
+        else:
+            relTimestamp = timestamp - c.timestamp
+
+        h = c.buildHeader(relTimestamp, datatype, bodyLength, self.streamId)
+        last = self._last
+        self._last = (datatype, bodyLength, relTimestamp)
+
+        if last is None:
+            h.full = True
+            c.setHeader(h)
+
+            return header.pack(h)
+
+        c.setHeader(h)
+
+        if last[0] != datatype or last[1] != bodyLength:
+            return self._template.relative(relTimestamp, datatype, bodyLength)
+
+        if last[2] != relTimestamp:
+            return self._template.delta(relTimestamp)
+
+        return self._continuationHeader
+
+
+    def sendFragment(self, data, timestamp, marker, bodyLength):
+        """
+        Writes part of a message as it is received, see
+        L{ChannelDemuxer.readFragment}. Only whole RTMP frames are written so
+        that other channels can be interleaved; the remainder is held until
+        the next fragment. Fragments of one message must not be interleaved
+        with L{sendData}.
+
+        @param marker: The C{FRAGMENT_*} markers of C{data}.
+        @param bodyLength: The length of the whole message.
+        """
+        if marker & FRAGMENT_START:
+            prefix = self._encodeHeader(timestamp, bodyLength)
+
+            # prefix, held bytes, whether a frame has been written
+            self._fragment = [prefix, '', False]
+        elif self._fragment is None:
+            raise EncodeError('Fragment received before the start of the '
+                'message')
+
+        state = self._fragment
+        frameSize = self.channel.frameSize
+        end = marker & FRAGMENT_END
+
+        buf = state[1] + data if state[1] else data
+        out = []
+        pos = 0
+
+        if not state[2]:
+            if len(buf) < frameSize and not end:
+                state[1] = buf
+
+                return
+
+            out.append(state[0])
+            out.append(buf[:frameSize])
+            pos = frameSize
+            state[2] = True
+
+        while len(buf) - pos >= frameSize or (end and pos < len(buf)):
+            out.append(self._continuationHeader)
+            out.append(buf[pos:pos + frameSize])
+            pos += frameSize
+
+        state[1] = buf[pos:]
+
+        if end:
+            self._fragment = None
+            self.channel.reset()
+
+        if not out:
+            return
+
+        if self._writeSequence is not None:
+            self._writeSequence(out)
+        else:
+            self.output.write(''.join(out))
+
+
+
+class FragmentAssembler(object):
+    """
+    Puts the fragments of streamed messages back together.
+
+    @ivar parts: The fragments received so far, keyed by whatever identifies
+        the message to the caller.
+    """
+
+
+    def __init__(self):
+        self.parts = {}
+
+
+    def add(self, key, data, marker):
+        """
+        Adds a fragment of the message identified by C{key}.
+
+        Fragments that arrive without the start of their message are ignored.
+
+        @return: The whole message once the last fragment has been added,
+            otherwise C{None}.
+        """
+        if marker & FRAGMENT_START:
+            if marker & FRAGMENT_END:
+                self.parts.pop(key, None)
+
+                return data
+
+            self.parts[key] = [data]
+
+            return None
+
+        parts = self.parts.get(key, None)
+
+        if parts is None:
+            return None
+
+        parts.append(data)
+
+        if not marker & FRAGMENT_END:
+            return None
+
+        del self.parts[key]
+
+        return ''.join(parts)
+
+
+
+def split_frames(data, frameSize, continuation):
+    """
+    Splits a message body into RTMP frames of C{frameSize} bytes, separated by
+    the C{continuation} header. The leading message header is not included.
+
+    @rtype: C{str}
+    """
+    if len(data) <= frameSize:
+        return data
+
+    return continuation.join([data[i:i + frameSize]
+        for i in xrange(0, len(data), frameSize)])
+
+
 
 def is_command_type(datatype):
     """
@@ -923,3 +1469,11 @@ def is_command_type(datatype):
     related RTMP message must be marshalled on channel id = 2.
     """
     return datatype <= message.UPSTREAM_BANDWIDTH
+
+
+
+_speedups.install(globals(), 'codec', [
+    'BaseChannel.marshallOneFrame',
+    'ProducingChannel.marshallFrame',
+    'FrameReader.readFrame',
+])
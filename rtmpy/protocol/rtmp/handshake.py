@@ -46,9 +46,9 @@ class RandomPayloadNegotiator(object):
         """
         Called to build the ack packet, based on the state of the negotiations.
 
-        C{RTMP} payloads are just random.
+        The ack echoes the payload of the peer's syn, which the peer verifies.
         """
-        packet.payload = _generate_payload()
+        packet.payload = self.peer_syn.payload
 
 
 class ClientNegotiator(RandomPayloadNegotiator, handshake.ClientNegotiator):
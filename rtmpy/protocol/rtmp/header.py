@@ -20,14 +20,36 @@ Utility/helper functions for encoding and decoding RTMP headers.
     #rtmp_packet_structure>}
 """
 
+import struct
+
+from rtmpy import _speedups
+
+
 __all__ = [
     'Header',
+    'HeaderTemplate',
     'encode',
     'decode',
-    'merge'
+    'pack',
+    'unpack_from',
+    'merge',
+    'get_template'
 ]
 
 
+#: The maximum number of bytes an encoded header can occupy.
+MAX_HEADER_LENGTH = 18
+
+# Precompiled structs for the fields following the channel id, indexed by the
+# size bits of the first byte. 24 bit ints are packed as a high byte and a low
+# short, apart from the full header where the stream id is little endian.
+_FULL_HEADER = struct.Struct('<BBBBBBBL')
+_RELATIVE_HEADER = struct.Struct('!BHBHB')
+_TIMESTAMP_HEADER = struct.Struct('!BH')
+_EXTENDED_TIMESTAMP = struct.Struct('!L')
+_SHORT_CHANNEL = struct.Struct('<BH')
+
+
 class HeaderError(Exception):
     """
     Raised if a header related operation failed.
@@ -52,6 +74,45 @@ class Header(object):
         self.full = full
         self.continuation = continuation
 
+    def copy(self):
+        """
+        Returns a snapshot of this header.
+
+        @rtype: L{Header}
+        """
+        return Header(self.channelId, self.timestamp, self.datatype,
+            self.bodyLength, self.streamId, self.full, self.continuation)
+
+    def merge(self, new):
+        """
+        Merges the values of C{new} into this header, in place. Values that are
+        not set on C{new} are left untouched.
+
+        The C{full} and C{continuation} flags describe how a header was
+        encoded, not the state of the channel, so they are cleared.
+
+        @type new: L{Header}
+        @raise HeaderError: The channel ids do not match.
+        """
+        if self.channelId != new.channelId:
+            raise HeaderError('channelId mismatch on merge old=%r, new=%r' % (
+                self.channelId, new.channelId))
+
+        if new.streamId != -1:
+            self.streamId = new.streamId
+
+        if new.bodyLength != -1:
+            self.bodyLength = new.bodyLength
+
+        if new.datatype != -1:
+            self.datatype = new.datatype
+
+        if new.timestamp != -1:
+            self.timestamp = new.timestamp
+
+        self.full = False
+        self.continuation = False
+
     def __repr__(self):
         attrs = []
 
@@ -70,24 +131,136 @@ class Header(object):
             id(self))
 
 
+class HeaderTemplate(object):
+    """
+    Preformatted relative headers for a single channel. Only the fields of
+    the next header are packed into the buffers, the channel id is encoded
+    once.
+
+    Templates hold no state between calls and can be shared by everything
+    writing to the same channel id, see L{get_template}. They are not thread
+    safe.
+
+    @ivar channelId: The channel id that the headers are encoded for.
+    @ivar continuation: The encoded continuation (type 3) header.
+    @type continuation: C{str}
+    """
+
+    __slots__ = ('channelId', 'continuation', '_offset', '_relative',
+        '_relativeExtended', '_timestamp', '_timestampExtended')
+
+    def __init__(self, channelId):
+        h = Header(channelId)
+
+        self.channelId = channelId
+        self.continuation = pack(h, h)
+        self._offset = offset = len(self.continuation)
+
+        relative = bytearray(self.continuation)
+        relative[0] = (relative[0] & 0x3f) | 0x40
+        timestamp = bytearray(self.continuation)
+        timestamp[0] = (timestamp[0] & 0x3f) | 0x80
+
+        self._relative = relative + bytearray(7)
+        self._relativeExtended = relative + bytearray(11)
+        self._timestamp = timestamp + bytearray(3)
+        self._timestampExtended = timestamp + bytearray(7)
+
+        _RELATIVE_HEADER.pack_into(self._relativeExtended, offset,
+            0xff, 0xffff, 0, 0, 0)
+        _TIMESTAMP_HEADER.pack_into(self._timestampExtended, offset,
+            0xff, 0xffff)
+
+    def relative(self, timestamp, datatype, bodyLength):
+        """
+        Returns the encoded relative (type 1) header.
+
+        @param timestamp: The timestamp delta.
+        @rtype: C{str}
+        """
+        offset = self._offset
+
+        if timestamp >= 0xffffff:
+            buf = self._relativeExtended
+
+            _RELATIVE_HEADER.pack_into(buf, offset, 0xff, 0xffff,
+                bodyLength >> 16, bodyLength & 0xffff, datatype)
+            _EXTENDED_TIMESTAMP.pack_into(buf, offset + 7, timestamp)
+        else:
+            buf = self._relative
+
+            _RELATIVE_HEADER.pack_into(buf, offset, timestamp >> 16,
+                timestamp & 0xffff, bodyLength >> 16, bodyLength & 0xffff,
+                datatype)
+
+        return str(buf)
+
+    def delta(self, timestamp):
+        """
+        Returns the encoded timestamp (type 2) header.
+
+        @param timestamp: The timestamp delta.
+        @rtype: C{str}
+        """
+        if timestamp >= 0xffffff:
+            buf = self._timestampExtended
+
+            _EXTENDED_TIMESTAMP.pack_into(buf, self._offset + 3, timestamp)
+        else:
+            buf = self._timestamp
+
+            _TIMESTAMP_HEADER.pack_into(buf, self._offset, timestamp >> 16,
+                timestamp & 0xffff)
+
+        return str(buf)
+
+
+#: channelId -> L{HeaderTemplate}
+_templates = {}
+
+
+def get_template(channelId):
+    """
+    Returns the shared L{HeaderTemplate} for C{channelId}.
+
+    @rtype: L{HeaderTemplate}
+    """
+    try:
+        return _templates[channelId]
+    except KeyError:
+        t = _templates[channelId] = HeaderTemplate(channelId)
+
+        return t
+
+
 def encode(stream, header, previous=None):
     """
     Encodes a RTMP header to C{stream}.
 
-    We expect the stream to already be in network endian mode.
+    @param stream: The stream to write the encoded header.
+    @type stream: L{util.BufferedByteStream}
+    @param header: The L{Header} to encode.
+    @param previous: The previous header (if any).
+    @see: L{pack}
+    """
+    stream.write(pack(header, previous))
+
+
+def pack(header, previous=None):
+    """
+    Returns the encoded bytes for a RTMP header.
 
     The channel id can be encoded in up to 3 bytes. The first byte is special as
     it contains the size of the rest of the header as described in
-    L{getHeaderSize}.
+    L{get_header_length}.
 
     0 >= channelId > 64: channelId
     64 >= channelId > 320: 0, channelId - 64
     320 >= channelId > 0xffff + 64: 1, channelId - 64 (written as 2 byte int)
 
-    @param stream: The stream to write the encoded header.
-    @type stream: L{util.BufferedByteStream}
     @param header: The L{Header} to encode.
     @param previous: The previous header (if any).
+    @rtype: C{str}
     """
     if previous is None:
         mask = 0
@@ -100,38 +273,41 @@ def encode(stream, header, previous=None):
     channelId = header.channelId + 2
 
     if channelId < 64:
-        stream.write_uchar(mask | channelId)
+        bytes = chr(mask | channelId)
     elif channelId < 320:
-        stream.write_uchar(mask)
-        stream.write_uchar(channelId - 64)
+        bytes = chr(mask) + chr(channelId - 64)
     else:
-        channelId -= 64
-
-        stream.write_uchar(mask + 1)
-        stream.write_uchar(channelId & 0xff)
-        stream.write_uchar(channelId >> 0x08)
+        bytes = _SHORT_CHANNEL.pack(mask + 1, channelId - 64)
 
     if mask == 0xc0:
-        return
+        return bytes
 
-    if mask <= 0x80:
-        if header.timestamp >= 0xffffff:
-            stream.write_24bit_uint(0xffffff)
-        else:
-            stream.write_24bit_uint(header.timestamp)
+    timestamp = header.timestamp
 
-    if mask <= 0x40:
-        stream.write_24bit_uint(header.bodyLength)
-        stream.write_uchar(header.datatype)
+    if timestamp >= 0xffffff:
+        ts = 0xffffff
+    else:
+        ts = timestamp
 
     if mask == 0:
-        stream.endian = '<'
-        stream.write_ulong(header.streamId)
-        stream.endian = '!'
+        bodyLength = header.bodyLength
+
+        bytes += _FULL_HEADER.pack(
+            ts >> 16, (ts >> 8) & 0xff, ts & 0xff,
+            bodyLength >> 16, (bodyLength >> 8) & 0xff, bodyLength & 0xff,
+            header.datatype, header.streamId)
+    elif mask == 0x40:
+        bodyLength = header.bodyLength
+
+        bytes += _RELATIVE_HEADER.pack(ts >> 16, ts & 0xffff,
+            bodyLength >> 16, bodyLength & 0xffff, header.datatype)
+    else:
+        bytes += _TIMESTAMP_HEADER.pack(ts >> 16, ts & 0xffff)
+
+    if ts == 0xffffff:
+        bytes += _EXTENDED_TIMESTAMP.pack(timestamp)
 
-    if mask <= 0x80:
-        if header.timestamp >= 0xffffff:
-            stream.write_ulong(header.timestamp)
+    return bytes
 
 
 def decode(stream):
@@ -139,13 +315,27 @@ def decode(stream):
     Reads a header from the incoming stream.
 
     A header can be of varying lengths and the properties that get updated
-    depend on the length.
+    depend on the length. The fields following the channel id are read and
+    unpacked in one go.
 
     @param stream: The byte stream to read the header from.
     @type stream: C{pyamf.util.BufferedByteStream}
     @return: The read header from the stream.
     @rtype: L{Header}
+    @raise IOError: Not enough data in C{stream} to decode the header. The
+        stream position is left unchanged.
     """
+    pos = stream.tell()
+
+    try:
+        return _decode(stream)
+    except IOError:
+        stream.seek(pos)
+
+        raise
+
+
+def _decode(stream):
     # read the size and channelId
     channelId = stream.read_uchar()
     bits = channelId >> 6
@@ -153,30 +343,30 @@ def decode(stream):
 
     if channelId == 0:
         channelId = stream.read_uchar() + 64
-
-    if channelId == 1:
-        channelId = stream.read_uchar() + 64 + (stream.read_uchar() << 8)
-
-    header = Header(channelId - 2)
+    elif channelId == 1:
+        channelId = _SHORT_CHANNEL.unpack('\x00' + stream.read(2))[1] + 64
 
     if bits == 3:
+        header = Header(channelId - 2)
         header.continuation = True
 
         return header
 
-    header.timestamp = stream.read_24bit_uint()
+    if bits == 2:
+        t1, t2 = _TIMESTAMP_HEADER.unpack(stream.read(3))
 
-    if bits < 2:
-        header.bodyLength = stream.read_24bit_uint()
-        header.datatype = stream.read_uchar()
+        header = Header(channelId - 2, (t1 << 16) | t2)
+    elif bits == 1:
+        t1, t2, l1, l2, datatype = _RELATIVE_HEADER.unpack(stream.read(7))
 
-    if bits < 1:
-        # streamId is little endian
-        stream.endian = '<'
-        header.streamId = stream.read_ulong()
-        stream.endian = '!'
+        header = Header(channelId - 2, (t1 << 16) | t2, datatype,
+            (l1 << 16) | l2)
+    else:
+        t1, t2, t3, l1, l2, l3, datatype, streamId = _FULL_HEADER.unpack(
+            stream.read(11))
 
-        header.full = True
+        header = Header(channelId - 2, (t1 << 16) | (t2 << 8) | t3, datatype,
+            (l1 << 16) | (l2 << 8) | l3, streamId, True)
 
     if header.timestamp == 0xffffff:
         header.timestamp = stream.read_ulong()
@@ -184,40 +374,119 @@ def decode(stream):
     return header
 
 
-def merge(old, new):
+def unpack_from(buf, offset=0):
     """
-    Merge the values of C{new} and C{old} together, returning the result.
+    Decodes a header from the raw bytes in C{buf}, starting at C{offset}.
 
-    @type old: L{Header}
-    @type new: L{Header}
-    @rtype: L{Header}
+    @param buf: The bytes to decode.
+    @type buf: C{str}
+    @return: A tuple containing the decoded L{Header} and the number of bytes
+        it occupied, or C{None} if C{buf} does not hold the complete header.
     """
-    if old.channelId != new.channelId:
-        raise HeaderError('channelId mismatch on merge old=%r, new=%r' % (
-            old.channelId, new.channelId))
+    end = len(buf)
+    start = offset
 
-    # what to do about full/continuation flags?
-    merged = Header(new.channelId)
+    if offset >= end:
+        return None
 
-    if new.streamId != -1:
-        merged.streamId = new.streamId
-    else:
-        merged.streamId = old.streamId
+    channelId = ord(buf[offset])
+    bits = channelId >> 6
+    channelId &= 0x3f
+    offset += 1
 
-    if new.bodyLength != -1:
-        merged.bodyLength = new.bodyLength
-    else:
-        merged.bodyLength = old.bodyLength
+    if channelId == 0:
+        if offset >= end:
+            return None
+
+        channelId = ord(buf[offset]) + 64
+        offset += 1
+    elif channelId == 1:
+        if offset + 2 > end:
+            return None
+
+        channelId = ord(buf[offset]) + 64 + (ord(buf[offset + 1]) << 8)
+        offset += 2
+
+    if bits == 3:
+        header = Header(channelId - 2)
+        header.continuation = True
+
+        return header, offset - start
+
+    if bits == 2:
+        if offset + 3 > end:
+            return None
+
+        t1, t2 = _TIMESTAMP_HEADER.unpack_from(buf, offset)
+
+        header = Header(channelId - 2, (t1 << 16) | t2)
+        offset += 3
+    elif bits == 1:
+        if offset + 7 > end:
+            return None
 
-    if new.datatype != -1:
-        merged.datatype = new.datatype
+        t1, t2, l1, l2, datatype = _RELATIVE_HEADER.unpack_from(buf, offset)
+
+        header = Header(channelId - 2, (t1 << 16) | t2, datatype,
+            (l1 << 16) | l2)
+        offset += 7
     else:
-        merged.datatype = old.datatype
+        if offset + 11 > end:
+            return None
+
+        t1, t2, t3, l1, l2, l3, datatype, streamId = \
+            _FULL_HEADER.unpack_from(buf, offset)
+
+        header = Header(channelId - 2, (t1 << 16) | (t2 << 8) | t3, datatype,
+            (l1 << 16) | (l2 << 8) | l3, streamId, True)
+        offset += 11
+
+    if header.timestamp == 0xffffff:
+        if offset + 4 > end:
+            return None
+
+        header.timestamp = _EXTENDED_TIMESTAMP.unpack_from(buf, offset)[0]
+        offset += 4
+
+    return header, offset - start
+
 
-    if new.timestamp != -1:
-        merged.timestamp = new.timestamp
+def get_header_length(byte):
+    """
+    Returns the number of bytes that a header starting with C{byte} occupies,
+    excluding any extended timestamp.
+
+    @param byte: The first byte of the encoded header.
+    @type byte: C{int}
+    """
+    channelId = byte & 0x3f
+
+    if channelId == 0:
+        length = 2
+    elif channelId == 1:
+        length = 3
     else:
-        merged.timestamp = old.timestamp
+        length = 1
+
+    return length + _FIELD_LENGTHS[byte >> 6]
+
+
+#: The number of bytes following the channel id, indexed by the size bits.
+_FIELD_LENGTHS = (11, 7, 3, 0)
+
+
+def merge(old, new):
+    """
+    Merge the values of C{new} and C{old} together, returning the result.
+
+    Neither header is modified, see L{Header.merge} for the in place version.
+
+    @type old: L{Header}
+    @type new: L{Header}
+    @rtype: L{Header}
+    """
+    merged = old.copy()
+    merged.merge(new)
 
     return merged
 
@@ -249,3 +518,6 @@ def get_size_mask(old, new):
         return 0x80
 
     return 0x40
+
+
+_speedups.install(globals(), 'header')
@@ -0,0 +1,271 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Schedulers decide the order in which L{codec.ChannelMuxer} interleaves the
+frames of the messages it is encoding.
+
+A scheduler is given each channel as it becomes active and is then asked to
+run one round at a time. Every round each active channel is credited with a
+number of bytes that it may write, so no message is starved.
+"""
+
+import collections
+
+from rtmpy import message
+
+
+__all__ = [
+    'RoundRobinScheduler',
+    'WeightedScheduler',
+]
+
+
+#: Traffic classes, in order of priority.
+CONTROL = 0
+AUDIO = 1
+VIDEO = 2
+DATA = 3
+
+#: Names of the traffic classes, as used by C{getStats}.
+CLASS_NAMES = ('control', 'audio', 'video', 'data')
+
+
+
+def get_class(datatype):
+    """
+    Returns the traffic class of an RTMP message type.
+    """
+    if datatype <= message.UPSTREAM_BANDWIDTH:
+        return CONTROL
+
+    if datatype == message.AUDIO_DATA:
+        return AUDIO
+
+    if datatype == message.VIDEO_DATA:
+        return VIDEO
+
+    return DATA
+
+
+
+class Flow(object):
+    """
+    The scheduling state of an active channel.
+
+    @ivar channel: The L{codec.ProducingChannel} being encoded.
+    @ivar klass: The traffic class of the message.
+    @ivar weight: The number of frames' worth of bytes the channel may write
+        per round.
+    @ivar deficit: The number of bytes the channel is owed from previous
+        rounds.
+    """
+
+    __slots__ = ('channel', 'klass', 'weight', 'deficit')
+
+
+    def __init__(self, channel, klass, weight):
+        self.channel = channel
+        self.klass = klass
+        self.weight = weight
+        self.deficit = 0
+
+
+
+class RoundRobinScheduler(object):
+    """
+    Encodes one frame from each active channel per round, in the order that
+    the channels became active.
+
+    @ivar queues: A list of C{OrderedDict}s (channel -> L{Flow}), one for
+        each priority. Higher priorities come first.
+    @ivar framesSent: The number of frames encoded, indexed by traffic class.
+    @ivar bytesSent: The number of body bytes encoded, indexed by traffic
+        class.
+    """
+
+    #: The number of priorities this scheduler uses.
+    priorities = 1
+
+
+    def __init__(self):
+        self.queues = [collections.OrderedDict()
+            for i in xrange(self.priorities)]
+
+        self.framesSent = [0] * len(CLASS_NAMES)
+        self.bytesSent = [0] * len(CLASS_NAMES)
+
+
+    def __len__(self):
+        return sum([len(q) for q in self.queues])
+
+
+    def __nonzero__(self):
+        for q in self.queues:
+            if q:
+                return True
+
+        return False
+
+
+    def getPriority(self, klass):
+        """
+        Returns the index of the queue that messages of C{klass} are placed
+        in.
+        """
+        return 0
+
+
+    def getWeight(self, klass, streamId):
+        """
+        Returns the number of frames that a message of C{klass} on
+        C{streamId} may write per round.
+        """
+        return 1
+
+
+    def activate(self, channel, datatype, streamId):
+        """
+        Called when C{channel} has been given a message to encode.
+        """
+        klass = get_class(datatype)
+        flow = Flow(channel, klass, self.getWeight(klass, streamId))
+
+        self.queues[self.getPriority(klass)][channel] = flow
+
+
+    def run(self, encode):
+        """
+        Runs one round of deficit round robin over the active channels.
+
+        @param encode: Called with a channel to encode its next frame. Must
+            return C{True} once the message on the channel is complete.
+        @return: A list of channels that completed their messages. They are
+            no longer active.
+        """
+        done = []
+        framesSent = self.framesSent
+        bytesSent = self.bytesSent
+
+        for queue in self.queues:
+            if not queue:
+                continue
+
+            for flow in queue.values():
+                channel = flow.channel
+                buf = channel.buffer
+
+                flow.deficit += flow.weight * channel.frameSize
+
+                while True:
+                    cost = min(buf.remaining(), channel.frameSize)
+
+                    if cost > flow.deficit:
+                        break
+
+                    flow.deficit -= cost
+                    framesSent[flow.klass] += 1
+                    bytesSent[flow.klass] += cost
+
+                    if encode(channel):
+                        del queue[channel]
+                        done.append(channel)
+
+                        break
+
+        return done
+
+
+    def getStats(self):
+        """
+        Returns the queue depth of the scheduler and the amount that has been
+        sent, per traffic class.
+
+        @rtype: C{dict} of class name -> C{dict} with keys C{channels} (active
+            messages), C{bytes} (body bytes yet to be encoded), C{framesSent}
+            and C{bytesSent}.
+        """
+        stats = {}
+
+        for klass, name in enumerate(CLASS_NAMES):
+            stats[name] = {
+                'channels': 0,
+                'bytes': 0,
+                'framesSent': self.framesSent[klass],
+                'bytesSent': self.bytesSent[klass],
+            }
+
+        for queue in self.queues:
+            for flow in queue.itervalues():
+                s = stats[CLASS_NAMES[flow.klass]]
+
+                s['channels'] += 1
+                s['bytes'] += flow.channel.buffer.remaining()
+
+        return stats
+
+
+
+class WeightedScheduler(RoundRobinScheduler):
+    """
+    Deficit round robin weighted by traffic class. Each round the classes are
+    visited in order of priority (control, audio, video then data) and each
+    message may write C{weight} frames' worth of bytes, so a large C{Invoke}
+    result cannot hold up the audio.
+
+    @ivar weights: Frames per round for each traffic class.
+    @ivar streamWeights: Multipliers applied to the weight of the messages of
+        a stream, stream id -> weight. See L{setStreamWeight}.
+    """
+
+    priorities = len(CLASS_NAMES)
+
+    #: The default frames per round, indexed by traffic class.
+    defaultWeights = (8, 4, 2, 1)
+
+
+    def __init__(self, weights=None):
+        RoundRobinScheduler.__init__(self)
+
+        self.weights = list(weights or self.defaultWeights)
+        self.streamWeights = {}
+
+
+    def getPriority(self, klass):
+        return klass
+
+
+    def getWeight(self, klass, streamId):
+        return self.weights[klass] * self.streamWeights.get(streamId, 1)
+
+
+    def setStreamWeight(self, streamId, weight):
+        """
+        Sets the multiplier for the weight of messages sent on C{streamId}.
+        Messages that are already being encoded are unaffected.
+
+        @param weight: Must be greater than 0. Weights below 1 let a message
+            write a frame every few rounds. C{None} restores the default.
+        """
+        if weight is None:
+            self.streamWeights.pop(streamId, None)
+
+            return
+
+        if weight <= 0:
+            raise ValueError('Stream weight must be positive (got %r)' % (
+                weight,))
+
+        self.streamWeights[streamId] = weight
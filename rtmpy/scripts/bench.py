@@ -0,0 +1,769 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Load tests an RTMP server with synthetic publishers and subscribers.
+
+Each publisher pushes generated audio/video messages that look like FLV
+AAC/AVC tags. The wall clock time at which a message is sent is embedded in
+its payload so that the subscribers can work out the end-to-end latency
+(publisher and subscribers run in the same process, so share a clock).
+
+The server is either started in this process (the default) or is an RTMP
+server on another process, see C{--url}. The results are written as JSON.
+
+@since: 0.2
+"""
+
+import math
+import optparse
+import os
+import struct
+import sys
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+__all__ = ['run', 'LoadTest']
+
+
+#: The latency histogram buckets, in milliseconds.
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+# send time, sequence number
+_STAMP = struct.Struct('!dL')
+
+_VIDEO_HEADER_SIZE = 5
+_AUDIO_HEADER_SIZE = 2
+
+#: AVC/AAC sequence headers sent when a publisher starts.
+VIDEO_SEQUENCE_HEADER = '\x17\x00\x00\x00\x00\x01\x42\x00\x1e\xff'
+AUDIO_SEQUENCE_HEADER = '\xaf\x00\x12\x10'
+
+
+
+def make_video(seq, keyframe, size, now=None):
+    """
+    Returns an AVC video payload of C{size} bytes with the send time and
+    C{seq} embedded.
+    """
+    if keyframe:
+        prefix = '\x17\x01\x00\x00\x00'
+    else:
+        prefix = '\x27\x01\x00\x00\x00'
+
+    data = prefix + _STAMP.pack(now or time.time(), seq)
+
+    return data + '\x00' * (size - len(data))
+
+
+
+def make_audio(seq, size, now=None):
+    """
+    Returns an AAC audio payload of C{size} bytes with the send time and
+    C{seq} embedded.
+    """
+    data = '\xaf\x01' + _STAMP.pack(now or time.time(), seq)
+
+    return data + '\x00' * (size - len(data))
+
+
+
+def read_stamp(data):
+    """
+    Returns the C{(send time, sequence number)} embedded in a payload made by
+    L{make_video} or L{make_audio}, or C{None} for other payloads (e.g.
+    sequence headers).
+    """
+    if data[:2] in ('\x17\x01', '\x27\x01'):
+        offset = _VIDEO_HEADER_SIZE
+    elif data[:2] == '\xaf\x01':
+        offset = _AUDIO_HEADER_SIZE
+    else:
+        return None
+
+    if len(data) < offset + _STAMP.size:
+        return None
+
+    return _STAMP.unpack_from(data, offset)
+
+
+
+def percentile(values, p):
+    """
+    Returns the C{p}th percentile of the sorted list C{values} (nearest
+    rank).
+    """
+    if not values:
+        return None
+
+    i = int(math.ceil(p / 100.0 * len(values))) - 1
+
+    return values[max(0, min(i, len(values) - 1))]
+
+
+
+def summarise_latency(samples):
+    """
+    Returns the percentiles and histogram of the latency C{samples} (in
+    milliseconds) as a C{dict}.
+    """
+    samples = sorted(samples)
+    histogram = []
+    i = 0
+
+    for bound in LATENCY_BUCKETS:
+        count = 0
+
+        while i < len(samples) and samples[i] <= bound:
+            count += 1
+            i += 1
+
+        histogram.append(['<=%d' % (bound,), count])
+
+    histogram.append(['>%d' % (LATENCY_BUCKETS[-1],), len(samples) - i])
+
+    ret = {
+        'samples': len(samples),
+        'histogram': histogram,
+    }
+
+    if not samples:
+        return ret
+
+    ret.update({
+        'min': samples[0],
+        'mean': sum(samples) / len(samples),
+        'p50': percentile(samples, 50),
+        'p90': percentile(samples, 90),
+        'p99': percentile(samples, 99),
+        'p999': percentile(samples, 99.9),
+        'max': samples[-1],
+    })
+
+    return ret
+
+
+
+def get_rss(pid='self'):
+    """
+    Returns the resident set size of a process in bytes, or C{None} if it
+    cannot be found.
+    """
+    try:
+        f = open('/proc/%s/status' % (pid,))
+    except IOError:
+        if pid != 'self':
+            return None
+
+        import resource
+
+        # the peak, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    try:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    finally:
+        f.close()
+
+
+
+def get_cpu_time(pid='self'):
+    """
+    Returns the user + system CPU time used by a process in seconds, or
+    C{None} if it cannot be found.
+    """
+    if pid == 'self':
+        t = os.times()
+
+        return t[0] + t[1]
+
+    try:
+        f = open('/proc/%s/stat' % (pid,))
+    except IOError:
+        return None
+
+    try:
+        # the command name may contain spaces
+        fields = f.read().rsplit(')', 1)[1].split()
+    finally:
+        f.close()
+
+    return (int(fields[11]) + int(fields[12])) / \
+        float(os.sysconf('SC_CLK_TCK'))
+
+
+
+class Usage(object):
+    """
+    Measures the CPU time and memory used by a process over a period.
+    """
+
+    def __init__(self, pid='self'):
+        self.pid = pid
+        self.baselineRSS = get_rss(pid)
+
+
+    def start(self):
+        self.startTime = time.time()
+        self.startCPU = get_cpu_time(self.pid)
+
+
+    def stop(self, connections):
+        """
+        @return: A C{dict} of the CPU and memory usage, in total and per
+            connection.
+        """
+        elapsed = time.time() - self.startTime
+        cpu = get_cpu_time(self.pid)
+        rss = get_rss(self.pid)
+        connections = max(connections, 1)
+
+        ret = {}
+
+        if cpu is not None and self.startCPU is not None:
+            cpu -= self.startCPU
+
+            ret['cpu'] = {
+                'seconds': cpu,
+                'percent': 100.0 * cpu / elapsed,
+                'percentPerConnection': 100.0 * cpu / elapsed / connections,
+            }
+
+        if rss is not None and self.baselineRSS is not None:
+            ret['rss'] = {
+                'baselineBytes': self.baselineRSS,
+                'bytes': rss,
+                'bytesPerConnection': (rss - self.baselineRSS) / connections,
+            }
+
+        return ret
+
+
+
+class Counter(object):
+    """
+    Counts messages and bytes.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+
+    def add(self, data):
+        self.messages += 1
+        self.bytes += len(data)
+
+
+    def reset(self):
+        self.messages = self.bytes = 0
+
+
+    def summarise(self, elapsed, connections):
+        connections = max(connections, 1)
+
+        return {
+            'messages': self.messages,
+            'bytes': self.bytes,
+            'messagesPerSec': self.messages / elapsed,
+            'bytesPerSec': self.bytes / elapsed,
+            'messagesPerSecPerConnection': self.messages / elapsed /
+                connections,
+            'bytesPerSecPerConnection': self.bytes / elapsed / connections,
+        }
+
+
+
+class Publisher(object):
+    """
+    Publishes a synthetic a/v stream.
+
+    @ivar stream: The publishing L{client.NetStream}.
+    @ivar counter: Counts the a/v messages sent.
+    """
+
+    def __init__(self, test, stream):
+        self.test = test
+        self.stream = stream
+        self.counter = test.sent
+
+        self.seq = 0
+        self.frames = 0
+        self.audioPackets = 0
+
+
+    def start(self):
+        """
+        Sends the meta data and sequence headers.
+        """
+        test = self.test
+
+        self.startTime = time.time()
+
+        self.stream.setMetaData({
+            'framerate': test.fps,
+            'videocodecid': 7,
+            'audiocodecid': 10,
+        })
+
+        self.stream.sendVideo(VIDEO_SEQUENCE_HEADER, 0)
+        self.stream.sendAudio(AUDIO_SEQUENCE_HEADER, 0)
+
+
+    def tick(self, now):
+        """
+        Sends the video frames and audio packets that are due.
+        """
+        test = self.test
+        elapsed = now - self.startTime
+        timestamp = int(elapsed * 1000)
+
+        while self.frames < elapsed * test.fps + 1:
+            keyframe = self.frames % test.keyframeInterval == 0
+            data = make_video(self.seq, keyframe, test.videoBytes, now)
+
+            self.stream.sendVideo(data, timestamp)
+            self.counter.add(data)
+
+            self.frames += 1
+            self.seq += 1
+
+        while self.audioPackets < elapsed * test.audioRate + 1:
+            data = make_audio(self.seq, test.audioBytes, now)
+
+            self.stream.sendAudio(data, timestamp)
+            self.counter.add(data)
+
+            self.audioPackets += 1
+            self.seq += 1
+
+
+
+class Subscriber(object):
+    """
+    Receives a stream played from the server and records the latency of each
+    message.
+    """
+
+    def __init__(self, test):
+        self.test = test
+        self.counter = test.received
+
+
+    def _received(self, data):
+        stamp = read_stamp(data)
+
+        if stamp is None:
+            return
+
+        self.counter.add(data)
+
+        if self.test.recording:
+            self.test.latencies.append((time.time() - stamp[0]) * 1000.0)
+
+
+    def videoDataReceived(self, data, timestamp):
+        self._received(data)
+
+
+    def audioDataReceived(self, data, timestamp):
+        self._received(data)
+
+
+    def onMetaData(self, data):
+        pass
+
+
+    def unpublish(self):
+        pass
+
+
+
+class LoadTest(object):
+    """
+    Runs C{publishers} synthetic publishers and C{subscribers} subscribers
+    against the application at C{url}. The subscribers are spread evenly
+    over the published streams.
+
+    The a/v data is sent for C{warmup} seconds before C{duration} seconds of
+    measurements are taken.
+
+    @ivar sent: Counts the a/v messages sent by the publishers.
+    @ivar received: Counts the a/v messages received by the subscribers.
+    @ivar latencies: The latency of each message received while measuring,
+        in milliseconds.
+    """
+
+    fps = 25
+    audioRate = 43
+    videoBytes = 4096
+    audioBytes = 256
+    keyframeInterval = 50
+    tickInterval = 0.01
+
+    def __init__(self, url, publishers=1, subscribers=1, duration=10,
+                 warmup=2, serverPid=None, reactor=None, **kwargs):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.url = url
+        self.publishers = publishers
+        self.subscribers = subscribers
+        self.duration = duration
+        self.warmup = warmup
+        self.serverPid = serverPid
+        self.reactor = reactor
+
+        for k, v in kwargs.items():
+            if not hasattr(self.__class__, k):
+                raise TypeError('Unknown option %r' % (k,))
+
+            setattr(self, k, v)
+
+        self.sent = Counter()
+        self.received = Counter()
+        self.latencies = []
+        self.recording = False
+
+        self._publishers = []
+        self._pools = []
+        self._ticker = None
+
+
+    def getConfig(self):
+        return {
+            'url': self.url,
+            'publishers': self.publishers,
+            'subscribers': self.subscribers,
+            'duration': self.duration,
+            'warmup': self.warmup,
+            'fps': self.fps,
+            'audioRate': self.audioRate,
+            'videoBytes': self.videoBytes,
+            'audioBytes': self.audioBytes,
+            'keyframeInterval': self.keyframeInterval,
+        }
+
+
+    def streamName(self, i):
+        return 'bench%d' % (i % max(self.publishers, 1),)
+
+
+    def connect(self, size):
+        from rtmpy import client
+
+        pool = client.ConnectionPool(self.url, size, reactor=self.reactor)
+
+        self._pools.append(pool)
+
+        return pool.start()
+
+
+    def play(self, pool):
+        """
+        Plays a stream on each connection of the subscriber C{pool}. Playing
+        waits until the streams are published.
+        """
+        def play(nc, i):
+            def cb(stream):
+                stream.listener = Subscriber(self)
+                stream.play(self.streamName(i))
+
+            return nc.createStream().addCallback(cb)
+
+        from twisted.internet import defer
+
+        return defer.DeferredList([play(nc, i)
+            for i, nc in enumerate(pool.connections)], consumeErrors=True)
+
+
+    def publish(self, pool):
+        """
+        Publishes a stream from each connection of the publisher C{pool}.
+        """
+        def publish(nc, i):
+            def cb(stream):
+                return stream.publish(self.streamName(i))
+
+            def started(stream):
+                p = Publisher(self, stream)
+
+                p.start()
+                self._publishers.append(p)
+
+            d = nc.createStream()
+
+            d.addCallback(cb)
+            d.addCallback(started)
+
+            return d
+
+        from twisted.internet import defer
+
+        return defer.DeferredList([publish(nc, i)
+            for i, nc in enumerate(pool.connections)], consumeErrors=True)
+
+
+    def tick(self):
+        now = time.time()
+
+        for p in self._publishers:
+            p.tick(now)
+
+
+    def sleep(self, seconds):
+        from twisted.internet import task
+
+        return task.deferLater(self.reactor, seconds, lambda: None)
+
+
+    def run(self):
+        """
+        Runs the load test.
+
+        @return: A L{defer.Deferred} that fires with the results as a
+            C{dict}.
+        """
+        from twisted.internet import task
+
+        usage = Usage()
+        serverUsage = None
+
+        if self.serverPid is not None:
+            serverUsage = Usage(self.serverPid)
+
+        state = {}
+
+        def subscribe(pool):
+            state['subscribers'] = pool
+
+            return self.play(pool)
+
+        def publishers(res):
+            return self.connect(self.publishers)
+
+        def publish(pool):
+            state['publishers'] = pool
+
+            return self.publish(pool)
+
+        def start(res):
+            self._ticker = task.LoopingCall(self.tick)
+            self._ticker.clock = self.reactor
+            self._ticker.start(self.tickInterval)
+
+            return self.sleep(self.warmup)
+
+        def measure(res):
+            self.sent.reset()
+            self.received.reset()
+            self.recording = True
+
+            usage.start()
+
+            if serverUsage:
+                serverUsage.start()
+
+            state['start'] = time.time()
+
+            return self.sleep(self.duration)
+
+        def finish(res):
+            elapsed = time.time() - state['start']
+            self.recording = False
+
+            self._ticker.stop()
+
+            publishers = len(state['publishers'].connections)
+            subscribers = len(state['subscribers'].connections)
+            connections = publishers + subscribers
+
+            result = {
+                'config': self.getConfig(),
+                'elapsed': elapsed,
+                'connections': {
+                    'publishers': publishers,
+                    'publishing': len(self._publishers),
+                    'subscribers': subscribers,
+                    'failed': len(state['publishers'].failures) +
+                        len(state['subscribers'].failures),
+                },
+                'sent': self.sent.summarise(elapsed, publishers),
+                'received': self.received.summarise(elapsed, subscribers),
+                'latency': summarise_latency(self.latencies),
+                'client': usage.stop(connections),
+            }
+
+            if serverUsage:
+                result['server'] = serverUsage.stop(connections)
+
+            return result
+
+        d = self.connect(self.subscribers)
+
+        d.addCallback(subscribe)
+        d.addCallback(publishers)
+        d.addCallback(publish)
+        d.addCallback(start)
+        d.addCallback(measure)
+        d.addCallback(finish)
+
+        return d
+
+
+    def close(self):
+        """
+        Closes all the connections.
+        """
+        from twisted.internet import defer
+
+        pools, self._pools = self._pools, []
+
+        return defer.DeferredList([p.close() for p in pools])
+
+
+
+def start_server(app='live', reactor=None):
+    """
+    Starts an RTMP server in this process, listening on a free port of the
+    loopback interface.
+
+    @return: The url of the application.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+
+    from rtmpy import server
+
+    factory = server.ServerFactory({app: server.Application()})
+    port = reactor.listenTCP(0, factory, interface='127.0.0.1')
+
+    return 'rtmp://127.0.0.1:%d/%s' % (port.getHost().port, app)
+
+
+
+def build_parser():
+    parser = optparse.OptionParser(usage='%prog [options]')
+
+    parser.add_option('--url', help='The rtmp:// url of the application to '
+        'test. By default a server is started in this process.')
+    parser.add_option('--server-pid', type='int', dest='serverPid',
+        help='The process id of the server given by --url, to report its CPU '
+        'and memory usage (Linux only).')
+    parser.add_option('-p', '--publishers', type='int', default=1,
+        help='The number of publishers [default: %default]')
+    parser.add_option('-s', '--subscribers', type='int', default=10,
+        help='The number of subscribers [default: %default]')
+    parser.add_option('-d', '--duration', type='float', default=10,
+        help='The number of seconds to measure for [default: %default]')
+    parser.add_option('-w', '--warmup', type='float', default=2,
+        help='The number of seconds to run before measuring '
+        '[default: %default]')
+    parser.add_option('--fps', type='float', default=LoadTest.fps,
+        help='Video frames per second [default: %default]')
+    parser.add_option('--audio-rate', type='float', dest='audioRate',
+        default=LoadTest.audioRate,
+        help='Audio packets per second [default: %default]')
+    parser.add_option('--video-bytes', type='int', dest='videoBytes',
+        default=LoadTest.videoBytes,
+        help='The size of each video frame [default: %default]')
+    parser.add_option('--audio-bytes', type='int', dest='audioBytes',
+        default=LoadTest.audioBytes,
+        help='The size of each audio packet [default: %default]')
+    parser.add_option('--keyframe-interval', type='int',
+        dest='keyframeInterval', default=LoadTest.keyframeInterval,
+        help='The number of frames between keyframes [default: %default]')
+    parser.add_option('-o', '--output', default=None,
+        help='Write the JSON results to this file [default: stdout]')
+
+    return parser
+
+
+
+def run(args=None):
+    from twisted.internet import reactor
+
+    parser = build_parser()
+    options, args = parser.parse_args(args)
+
+    mode = 'external'
+    url = options.url
+
+    if url is None:
+        mode = 'in-process'
+        url = start_server()
+
+    test = LoadTest(url, options.publishers, options.subscribers,
+        duration=options.duration, warmup=options.warmup,
+        serverPid=options.serverPid, fps=options.fps,
+        audioRate=options.audioRate, videoBytes=options.videoBytes,
+        audioBytes=options.audioBytes,
+        keyframeInterval=options.keyframeInterval)
+
+    output = {}
+
+    def cb(result):
+        from rtmpy import __version__
+
+        result['mode'] = mode
+        result['rtmpy'] = str(__version__)
+        result['python'] = sys.version.split()[0]
+
+        output['result'] = result
+
+        return test.close()
+
+    def eb(fail):
+        output['failure'] = fail
+
+    def stop(res):
+        reactor.stop()
+
+    d = test.run()
+
+    d.addCallback(cb)
+    d.addErrback(eb)
+    d.addBoth(stop)
+
+    reactor.run()
+
+    if 'failure' in output:
+        output['failure'].printTraceback(sys.stderr)
+
+        sys.exit(1)
+
+    data = json.dumps(output['result'], indent=2, sort_keys=True)
+
+    if options.output:
+        f = open(options.output, 'w')
+
+        try:
+            f.write(data + '\n')
+        finally:
+            f.close()
+    else:
+        sys.stdout.write(data + '\n')
+
+
+
+if __name__ == '__main__':
+    run()
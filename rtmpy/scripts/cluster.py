@@ -0,0 +1,93 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Runs an RTMP server in several processes, see L{rtmpy.cluster}.
+
+@since: 0.2
+"""
+
+import optparse
+import sys
+
+
+__all__ = ['run']
+
+
+
+def build_parser():
+    parser = optparse.OptionParser(usage='%prog [options] --factory '
+        'module.buildFactory')
+
+    parser.add_option('--factory', help='Fully qualified name of a callable '
+        'that returns the rtmpy.server.ServerFactory of each worker.')
+    parser.add_option('--port', type='int', default=1935,
+        help='The port to listen on [default: %default]')
+    parser.add_option('--interface', default='',
+        help='The interface to listen on [default: all]')
+    parser.add_option('--workers', type='int', default=None,
+        help='The number of worker processes [default: number of CPUs]')
+    parser.add_option('--reuse-port', action='store_true', dest='reusePort',
+        default=False, help='Bind the port in each worker with SO_REUSEPORT '
+        'instead of sharing one socket.')
+    parser.add_option('--socket-dir', dest='socketDir', default=None,
+        help='Where to create the registry and relay sockets '
+        '[default: a temporary directory]')
+
+    # used by the supervisor to start the workers
+    parser.add_option('--worker', action='store_true', default=False,
+        help=optparse.SUPPRESS_HELP)
+    parser.add_option('--registry', help=optparse.SUPPRESS_HELP)
+    parser.add_option('--relay', help=optparse.SUPPRESS_HELP)
+    parser.add_option('--fd', type='int', default=None,
+        help=optparse.SUPPRESS_HELP)
+
+    return parser
+
+
+
+def run(args=None):
+    from twisted.internet import reactor
+    from twisted.python import log
+
+    from rtmpy import cluster
+
+    parser = build_parser()
+    options, args = parser.parse_args(args)
+
+    if not options.factory:
+        parser.error('--factory is required')
+
+    log.startLogging(sys.stderr)
+
+    if options.worker:
+        cluster.run_worker(options.factory, options.registry, options.relay,
+            fd=options.fd, port=options.port, interface=options.interface)
+
+        return
+
+    supervisor = cluster.Supervisor(options.factory, options.port,
+        workers=options.workers, interface=options.interface,
+        reusePort=options.reusePort, socketDir=options.socketDir)
+
+    reactor.callWhenRunning(supervisor.start)
+    reactor.addSystemEventTrigger('before', 'shutdown', supervisor.stop)
+
+    reactor.run()
+
+
+
+if __name__ == '__main__':
+    run()
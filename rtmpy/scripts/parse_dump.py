@@ -62,8 +62,6 @@ def parse_dump(f, observer):
 
         endpoint.dataReceived(data)
 
-        [y for y in endpoint]
-
 
 
 def read_dump(f):
@@ -198,21 +196,14 @@ class ControlStream(Stream):
     """
     A specialised stream that handles the most basic RTMP command message/s.
 
-    In this case all we need to look out for is the frame size.
+    The decoder applies frame size changes itself, see L{codec.Decoder.feed}.
     """
 
-    def __init__(self, observer, decoder):
-        Stream.__init__(self, observer)
-
-        self.decoder = decoder
-
     def onFrameSize(self, size, timestamp):
         m = Message('frame_size', size=size)
 
         self.observer.messageReceived(m)
 
-        self.decoder.setFrameSize(size)
-
 
 
 class StreamFactory(object):
@@ -233,7 +224,7 @@ class StreamFactory(object):
             return s
 
         if streamId == 0:
-            s = ControlStream(self.observer, self.decoder)
+            s = ControlStream(self.observer)
         else:
             s = Stream(self.observer)
 
@@ -265,7 +256,8 @@ class StreamFactory(object):
 class RTMPEndpoint(object):
     """
     Represents one side of the TCP transmission. Handles the handshake and
-    pushes all data to the RTMP decoder.
+    pushes all data to the RTMP decoder, dispatching the decoded messages in
+    batches.
     """
 
     handshake_size = 1536 * 2 + 1
@@ -277,8 +269,6 @@ class RTMPEndpoint(object):
         self.factory = StreamFactory(self.label, self.observer)
         self.decoder = codec.Decoder(self.factory, self.factory)
 
-        self.factory.decoder = self.decoder
-
         self.handshake = False
         self.buffer = ''
 
@@ -294,11 +284,14 @@ class RTMPEndpoint(object):
                 data = self.buffer[self.handshake_size:]
                 del self.buffer
 
-        if self.handshake:
-            self.decoder.send(data)
+        if not self.handshake:
+            return
+
+        factory = self.factory
 
-    def __iter__(self):
-        return self.decoder
+        for streamId, datatype, timestamp, body in self.decoder.feed(data):
+            factory.dispatchMessage(factory.getStream(streamId), datatype,
+                timestamp, body)
 
 
 
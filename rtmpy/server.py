@@ -16,16 +16,21 @@
 """
 Server implementation.
 """
+import collections
+import os.path
 import urlparse
 
 from zope.interface import Interface, Attribute, implements
-from twisted.internet import protocol, defer
+from twisted.internet import protocol, defer, threads
+from twisted.internet.interfaces import IPushProducer
 from twisted.python import failure, log
 import pyamf
 
-from rtmpy import util, exc, versions
+from rtmpy import util, exc, versions, flv
+from rtmpy import client as rtmp_client
 from rtmpy import message, rpc, status, core
 from rtmpy.protocol import rtmp, handshake, version
+from rtmpy.protocol.rtmp import codec
 from rtmpy.status import codes
 
 
@@ -177,12 +182,50 @@ class IPublishingStream(Interface):
         @param timestamp: The timestamp at which this data was received.
         """
 
+    def fragmentReceived(datatype, data, timestamp, marker, bodyLength):
+        """
+        Optional. Part of an a/v packet has been received from the publishing
+        stream, see L{rtmp.BaseStreamer.streamFragments}. If not provided, the
+        packet is passed to C{videoDataReceived}/C{audioDataReceived} once it
+        is complete.
+
+        @param marker: A combination of the C{codec.FRAGMENT_*} markers.
+        @param bodyLength: The length of the whole packet.
+        """
+
     def onMetaData(data):
         """
         The meta data for the a/v stream has been updated.
         """
 
 
+class IStreamRegistry(Interface):
+    """
+    Shares the names of published streams between the L{ServerFactory}s of
+    several processes, see L{rtmpy.cluster}. Set as L{ServerFactory.registry}.
+    """
+
+    def register(app, name):
+        """
+        Claims the stream C{name} of C{app} for this process.
+
+        @return: A L{defer.Deferred} that fails with L{exc.BadNameError} if
+            the stream is published by another process.
+        """
+
+    def unregister(app, name):
+        """
+        Releases a stream claimed with L{register}.
+        """
+
+    def whenPublished(app, name, cb):
+        """
+        Calls C{cb} once the stream C{name} of C{app} is published by another
+        process. C{cb} is called with an L{IPublishingStream} that relays the
+        stream to this process and must be stopped if it is not used.
+        """
+
+
 class Client(object):
     """
     A very basic client object that relates an application to a connected peer.
@@ -215,14 +258,30 @@ class NetStream(core.NetStream):
         receive the audio/video/meta data events from the peer. See
         L{StreamPublisher} for now.
     @type publisher: L{IPublishingStream}
+    @param queue: When playing, the L{SubscriberQueue} that a/v data is
+        written through.
+    @param source: When playing, the L{StreamPublisher} or L{FilePlayer} that
+        a/v data is received from.
+    @ivar recording: Whether the stream being published is also being
+        recorded to a file.
+    @cvar sharedFrames: Whether the audio/video events accept the C{frames}
+        cache used by L{StreamPublisher} to relay one encoded message to many
+        subscribers.
     """
 
+    sharedFrames = True
+
     def __init__(self, nc, streamId):
         core.NetStream.__init__(self, nc, streamId)
 
         self.state = None
         self.name = None
         self.publisher = None
+        self.queue = None
+        self.source = None
+        self.recording = False
+        self._held = []
+        self._fragments = codec.FragmentAssembler()
 
     def publishingStarted(self, publisher, name):
         """
@@ -270,6 +329,14 @@ class NetStream(core.NetStream):
 
             self.sendStatus(s)
 
+            if not isinstance(result, failure.Failure) and \
+                    type_ in ('record', 'append'):
+                self.recording = True
+
+                self.sendStatus(codes.NS_RECORD_START,
+                    description='Recording %s.' % (name,),
+                    clientid=self.client.id)
+
             return result
 
         d.addBoth(send_status)
@@ -291,6 +358,13 @@ class NetStream(core.NetStream):
                     description='%s is now unpublished.' % (self.name,),
                     clientid=self.nc.client.id))
 
+                if self.recording:
+                    self.recording = False
+
+                    self.sendStatus(codes.NS_RECORD_STOP,
+                        description='Stopped recording %s.' % (self.name,),
+                        clientid=self.nc.client.id)
+
                 return res
 
             d.addBoth(send_status)
@@ -298,6 +372,18 @@ class NetStream(core.NetStream):
         def clear_state(res):
             self.state = None
 
+            if self.source is not None:
+                try:
+                    self.source.removeSubscriber(self)
+                except KeyError:
+                    pass
+
+                self.source = None
+
+            if self.queue is not None:
+                self.nc.unregisterQueue(self.queue)
+                self.queue = None
+
             return res
 
         d.addBoth(clear_state)
@@ -337,6 +423,34 @@ class NetStream(core.NetStream):
         if self.publisher:
             self.publisher.audioDataReceived(data, timestamp)
 
+    def onFragment(self, datatype, timestamp, data, marker, bodyLength):
+        """
+        Called with each frame of an a/v message from the peer as it arrives,
+        when the protocol streams fragments.
+
+        Pushes the fragment on to the publisher, or the whole message if the
+        publisher does not accept fragments.
+        """
+        if not self.publisher:
+            return
+
+        func = getattr(self.publisher, 'fragmentReceived', None)
+
+        if func is not None:
+            func(datatype, data, timestamp, marker, bodyLength)
+
+            return
+
+        data = self._fragments.add(datatype, data, marker)
+
+        if data is None:
+            return
+
+        if datatype == message.VIDEO_DATA:
+            self.publisher.videoDataReceived(data, timestamp)
+        else:
+            self.publisher.audioDataReceived(data, timestamp)
+
     @rpc.expose('@setDataFrame')
     def setDataFrame(self, name, meta):
         """
@@ -386,6 +500,8 @@ class NetStream(core.NetStream):
             self._videoChannel.setType(message.VIDEO_DATA)
 
             self.state = 'playing'
+            self.name = name
+            self.source = res
 
             # wtf
             self.sendMessage(message.ControlMessage(4, 1))
@@ -401,6 +517,18 @@ class NetStream(core.NetStream):
 
             self.nc.call('onStatus', {'code': 'NetStream.Data.Start'})
 
+            self.queue = SubscriberQueue(self._audioChannel, self._videoChannel)
+            self.nc.registerQueue(self.queue)
+
+            held, self._held = self._held, []
+
+            for args in held:
+                self.queue.push(*args)
+
+            if isinstance(res, FilePlayer):
+                # only now can the end of a short recording be reported
+                res.start()
+
             return res
 
         def eb(fail):
@@ -416,24 +544,273 @@ class NetStream(core.NetStream):
 
         return d
 
+    @rpc.expose
+    def seek(self, offset):
+        """
+        Called by the peer to move playback of a recorded stream to C{offset}
+        milliseconds.
+        """
+        func = getattr(self.source, 'seek', None)
+
+        if func is None:
+            self.sendStatus(status.error(codes.NS_SEEK_FAILED,
+                'Seeking is not supported by this stream'))
+
+            return
+
+        if self.queue is not None:
+            self.queue.clear()
+
+        func(int(offset))
+
+        self.sendStatus(codes.NS_SEEK_NOTIFY,
+            description='Seeking %d (stream ID: %d).' % (offset,
+                self.streamId),
+            clientid=self.nc.clientId)
+
+    def playComplete(self):
+        """
+        Called when the end of a recorded stream has been sent.
+        """
+        self.call('onPlayStatus', {'code': codes.NS_PLAY_COMPLETE,
+            'level': 'status'})
+
+        self.sendStatus(codes.NS_PLAY_STOP,
+            description='Stopped playing %s.' % (self.name,),
+            clientid=self.nc.clientId)
+
     def onMetaData(self, data):
         """
         """
         self.call('onMetaData', data)
 
-    def videoDataReceived(self, data, timestamp):
-        self._videoChannel.sendData(data, timestamp)
+    def _push(self, datatype, data, timestamp, frames):
+        if self.queue is None:
+            # the publisher replays its cache before play has completed
+            self._held.append((datatype, data, timestamp, frames))
 
-    def audioDataReceived(self, data, timestamp):
-        self._audioChannel.sendData(data, timestamp)
+            return
+
+        self.queue.push(datatype, data, timestamp, frames)
+
+    def videoDataReceived(self, data, timestamp, frames=None):
+        self._push(message.VIDEO_DATA, data, timestamp, frames)
+
+    def audioDataReceived(self, data, timestamp, frames=None):
+        self._push(message.AUDIO_DATA, data, timestamp, frames)
+
+    def fragmentReceived(self, datatype, data, timestamp, marker, bodyLength):
+        if self.queue is None:
+            data = self._fragments.add(datatype, data, marker)
+
+            if data is not None:
+                self._push(datatype, data, timestamp, None)
+
+            return
+
+        self.queue.pushFragment(datatype, data, timestamp, marker, bodyLength)
+
+
+
+class SubscriberQueue(object):
+    """
+    Bounded queue of the a/v messages waiting to be written to a playing
+    L{NetStream}.
+
+    Messages are written straight through until the transport pauses us. While
+    paused, audio and video keyframes are queued (up to C{maxBytes}) and all
+    other video frames are dropped. Once video has been dropped, inter frames
+    continue to be dropped until the next keyframe arrives as they cannot be
+    decoded without the missing frames.
+
+    @ivar audio: The audio L{codec.StreamingChannel}.
+    @ivar video: The video L{codec.StreamingChannel}.
+    @ivar maxBytes: The maximum number of payload bytes to queue. When this is
+        exceeded, the oldest messages are dropped.
+    @ivar pending: The queued C{(datatype, data, timestamp, frames)} tuples.
+    @ivar size: The number of payload bytes in C{pending}.
+    @ivar paused: Whether the transport has asked us to stop writing.
+    @ivar droppedFrames: The number of messages that have been dropped.
+    @ivar droppedBytes: The number of payload bytes that have been dropped.
+
+    Messages may also arrive a fragment at a time (L{pushFragment}). If
+    nothing is queued when the first fragment arrives, the message is written
+    as it arrives and must then be completed, even if we are paused. Other
+    messages are queued in the meantime. Otherwise, the fragments are put
+    back together and the message is queued as a whole.
+    """
+
+    implements(IPushProducer)
+
+    maxBytes = 512 * 1024
+
+    def __init__(self, audio, video, maxBytes=None):
+        self.audio = audio
+        self.video = video
+
+        if maxBytes is not None:
+            self.maxBytes = maxBytes
+
+        self.pending = collections.deque()
+        self.size = 0
+        self.paused = False
+
+        self.droppedFrames = 0
+        self.droppedBytes = 0
+
+        self._waitKeyframe = False
+        # datatype -> [mode, timestamp, parts]
+        self._fragments = {}
+        self._writing = 0
+
+    def _drop(self, data):
+        self.droppedFrames += 1
+        self.droppedBytes += len(data)
+
+    def _write(self, datatype, data, timestamp, frames):
+        if datatype == message.VIDEO_DATA:
+            self.video.sendData(data, timestamp, frames)
+        else:
+            self.audio.sendData(data, timestamp, frames)
+
+    def push(self, datatype, data, timestamp, frames=None):
+        """
+        Writes or queues an a/v message.
+
+        @param datatype: L{message.AUDIO_DATA} or L{message.VIDEO_DATA}.
+        """
+        if datatype == message.VIDEO_DATA:
+            if flv.is_keyframe(data):
+                self._waitKeyframe = False
+            elif self.paused or self._waitKeyframe:
+                self._waitKeyframe = True
+                self._drop(data)
+
+                return
+
+        if not self.paused and not self.pending and not self._writing:
+            self._write(datatype, data, timestamp, frames)
+
+            return
+
+        self.pending.append((datatype, data, timestamp, frames))
+        self.size += len(data)
+
+        while self.size > self.maxBytes:
+            old = self.pending.popleft()
+
+            if old[0] == message.VIDEO_DATA:
+                self._waitKeyframe = True
+
+            self.size -= len(old[1])
+            self._drop(old[1])
+
+        if not self.paused:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes queued messages until the queue is empty or we are paused.
+        """
+        pending = self.pending
+
+        while pending and not self.paused and not self._writing:
+            datatype, data, timestamp, frames = pending.popleft()
+            self.size -= len(data)
+
+            self._write(datatype, data, timestamp, frames)
+
+    def pushFragment(self, datatype, data, timestamp, marker, bodyLength):
+        """
+        Writes or queues part of an a/v message.
+
+        @param marker: A combination of the C{codec.FRAGMENT_*} markers.
+        @param bodyLength: The length of the whole message.
+        """
+        if marker & codec.FRAGMENT_START:
+            if (datatype == message.VIDEO_DATA and not flv.is_keyframe(data)
+                    and (self.paused or self._waitKeyframe)):
+                self._waitKeyframe = True
+                mode = 'drop'
+            elif not self.paused and not self.pending:
+                mode = 'write'
+                self._writing += 1
+            else:
+                mode = 'queue'
+
+            if datatype == message.VIDEO_DATA and flv.is_keyframe(data):
+                self._waitKeyframe = False
+
+            state = self._fragments[datatype] = [mode, timestamp, []]
+        else:
+            state = self._fragments.get(datatype, None)
+
+            if state is None:
+                # the start of the message was not seen
+                return
+
+        mode = state[0]
+        end = marker & codec.FRAGMENT_END
+
+        if mode == 'write':
+            if datatype == message.VIDEO_DATA:
+                channel = self.video
+            else:
+                channel = self.audio
+
+            channel.sendFragment(data, state[1], marker, bodyLength)
+        elif mode == 'queue':
+            state[2].append(data)
+
+        if not end:
+            return
+
+        del self._fragments[datatype]
+
+        if mode == 'write':
+            self._writing -= 1
+
+            self.flush()
+        elif mode == 'queue':
+            self.push(datatype, ''.join(state[2]), state[1])
+        else:
+            self.droppedFrames += 1
+            self.droppedBytes += bodyLength
+
+    def clear(self):
+        """
+        Discards all queued messages.
+        """
+        self.pending.clear()
+        self.size = 0
+
+    # IPushProducer
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+        self.flush()
+
+    def stopProducing(self):
+        self.paused = True
+
+        self.clear()
 
 
 
 class NetConnection(core.NetConnection):
     """
     Server side NetConnection implementation.
+
+    @ivar queues: The L{SubscriberQueue}s of the streams playing on this
+        connection. Flow control from the transport is passed on to each one.
     """
 
+    implements(IPushProducer)
+
     objectEncoding = pyamf.AMF0
 
     def __init__(self, protocol):
@@ -442,6 +819,48 @@ class NetConnection(core.NetConnection):
         self.connected = False
         self.application = None
         self.clientId = None
+        self.queues = []
+
+
+    def registerQueue(self, queue):
+        """
+        Registers the L{SubscriberQueue} of a playing stream. The first queue
+        registers this connection as the push producer of the transport.
+        """
+        if not self.queues:
+            self.protocol.transport.registerProducer(self, True)
+
+        self.queues.append(queue)
+
+
+    def unregisterQueue(self, queue):
+        """
+        Removes a L{SubscriberQueue} previously added with L{registerQueue}.
+        """
+        try:
+            self.queues.remove(queue)
+        except ValueError:
+            return
+
+        queue.clear()
+
+        if not self.queues:
+            self.protocol.transport.unregisterProducer()
+
+
+    def pauseProducing(self):
+        for queue in self.queues:
+            queue.pauseProducing()
+
+
+    def resumeProducing(self):
+        for queue in list(self.queues):
+            queue.resumeProducing()
+
+
+    def stopProducing(self):
+        for queue in self.queues:
+            queue.stopProducing()
 
 
     def buildStream(self, streamId):
@@ -520,7 +939,33 @@ class NetConnection(core.NetConnection):
 
     def playStream(self, name, subscriber, *args):
         """
+        Plays the live or recorded stream C{name} to C{subscriber}.
+
+        @param args: The optional C{start} argument of C{NetStream.play}: C{-2}
+            (the default) plays the live stream if it is published, otherwise
+            the recording if there is one, otherwise waits for the live
+            stream. C{-1} only plays the live stream. C{0} or more plays the
+            recording from that many seconds in.
+        @return: The L{StreamPublisher} or L{FilePlayer}, or a
+            L{defer.Deferred} that fires with the publisher once the stream has
+            been published.
         """
+        start = -2
+
+        if args and isinstance(args[0], (int, long, float)):
+            start = args[0]
+
+        if start >= 0 or (start == -2 and
+                name not in self.application.streams):
+            player = self.application.playFile(name, subscriber,
+                int(max(start, 0) * 1000))
+
+            if player is not None:
+                return player
+
+            if start >= 0:
+                raise exc.StreamNotFound('Unknown stream %r' % (name,))
+
         d = defer.Deferred()
 
         def whenPublished(publisher):
@@ -753,20 +1198,71 @@ class ServerProtocol(rtmp.RTMPProtocol):
 
 
 
+class CachedFrames(dict):
+    """
+    The C{frames} of a message in the L{StreamPublisher} cache. The bodies
+    that the subscribers' L{codec.StreamingChannel}s split into frames are
+    counted towards the publisher's C{cacheBytes} for as long as the message
+    is cached.
+
+    @ivar publisher: The L{StreamPublisher} or C{None} once the message is no
+        longer cached.
+    @ivar data: The message body.
+    """
+
+    __slots__ = ('publisher', 'data')
+
+    def __init__(self, publisher, data):
+        dict.__init__(self)
+
+        self.publisher = publisher
+        self.data = data
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+
+        publisher = self.publisher
+
+        # bodies that fit into one frame are not copied
+        if publisher is not None and value is not self.data:
+            publisher._addCacheBytes(len(value))
+
+
+
 class StreamPublisher(object):
     """
     Linked to a L{NetStream} when it makes a publish request. Manages a list of
     subscribers to the stream and propagates the events when the stream produces
     them.
 
+    The last group of pictures (every a/v message since the most recent video
+    keyframe) is cached along with the AVC/AAC sequence headers and replayed to
+    new subscribers so that they can start decoding immediately.
+
     @ivar stream: The publishing L{NetStream}
     @ivar client: The linked L{Client} object. Not used right now.
     @ivar subscribers: A list of subscribers that are listening to the stream.
-    @ivar
+    @ivar maxCacheBytes: The maximum number of bytes held by the cached
+        group of pictures: the message bodies plus the copies split into
+        frames for the subscribers (see L{CachedFrames}). If a group grows
+        past this, it is discarded and caching resumes at the next keyframe.
+        Set to C{0} to disable caching.
+    @ivar videoHeader: The last AVC sequence header or C{None}.
+    @ivar audioHeader: The last AAC sequence header or C{None}.
+    @ivar gop: The cached C{(datatype, data, timestamp, frames)} tuples,
+        starting with a keyframe. C{frames} is a L{CachedFrames}.
+    @ivar cacheBytes: The number of bytes held in C{gop}.
     """
 
     implements(IPublishingStream)
 
+    maxCacheBytes = 4 * 1024 * 1024
+
+    _events = {
+        message.VIDEO_DATA: 'videoDataReceived',
+        message.AUDIO_DATA: 'audioDataReceived',
+    }
+
     def __init__(self, stream, client):
         self.stream = stream
         self.client = client
@@ -775,6 +1271,14 @@ class StreamPublisher(object):
         self.meta = {}
         self.timestamp = self.baseTimestamp = 0
 
+        self.videoHeader = None
+        self.audioHeader = None
+        self.gop = []
+        self.cacheBytes = 0
+
+        # datatype -> [timestamp, parts or None]
+        self._fragments = {}
+
     def _updateTimestamp(self, timestamp):
         """
         """
@@ -789,40 +1293,134 @@ class StreamPublisher(object):
 
     def addSubscriber(self, subscriber):
         """
-        Adds a subscriber to this publisher.
+        Adds a subscriber to this publisher. Any meta data and cached a/v
+        messages are sent to the subscriber straight away.
         """
-        self.subscribers[subscriber] = {
-            'timestamp': self.timestamp
+        context = self.subscribers[subscriber] = {
+            'timestamp': self.timestamp,
+            'shared': getattr(subscriber, 'sharedFrames', False),
+            'fragments': hasattr(subscriber, 'fragmentReceived'),
         }
 
         if self.meta:
             subscriber.onMetaData(self.meta)
 
+        try:
+            self._replay(subscriber, context)
+        except:
+            log.err()
+            self.removeSubscriber(subscriber)
+
     def removeSubscriber(self, subscriber):
         """
         Removes the subscriber from this publisher.
         """
         self.subscribers.pop(subscriber)
 
-    # events called by the stream
+    def clearCache(self):
+        """
+        Discards the cached group of pictures.
+        """
+        for entry in self.gop:
+            entry[3].publisher = None
 
-    def videoDataReceived(self, data, timestamp):
+        del self.gop[:]
+        self.cacheBytes = 0
+
+    def _addCacheBytes(self, size):
+        self.cacheBytes += size
+
+        if self.cacheBytes > self.maxCacheBytes:
+            self.clearCache()
+
+    def _cache(self, datatype, data, timestamp):
         """
-        A video packet has been received from the publishing stream.
+        Adds an a/v message to the cache.
 
-        @param data: The raw video data.
-        @type data: C{str}
-        @param timestamp: The timestamp at which this data was received.
+        @return: The C{frames} to relay the message with, or C{None} if it
+            was not cached.
+        """
+        if datatype == message.VIDEO_DATA:
+            if flv.is_avc_sequence_header(data):
+                self.videoHeader = data
+
+                return None
+
+            if flv.is_keyframe(data):
+                self.clearCache()
+            elif not self.gop:
+                # waiting for a keyframe
+                return None
+        elif flv.is_aac_sequence_header(data):
+            self.audioHeader = data
+
+            return None
+        elif not self.gop:
+            return None
+
+        frames = CachedFrames(self, data)
+
+        self.gop.append((datatype, data, timestamp, frames))
+        self._addCacheBytes(len(data))
+
+        return frames
+
+    def _replay(self, subscriber, context):
+        """
+        Sends the sequence headers and cached group of pictures to a new
+        subscriber. The subscriber's timeline is rebased to start at the
+        cached keyframe.
+        """
+        shared = context['shared']
+
+        if self.gop:
+            context['timestamp'] = base = self.gop[0][2]
+        else:
+            base = self.timestamp
+
+        if self.videoHeader is not None:
+            self._send(subscriber, shared, message.VIDEO_DATA,
+                self.videoHeader, 0, {})
+
+        if self.audioHeader is not None:
+            self._send(subscriber, shared, message.AUDIO_DATA,
+                self.audioHeader, 0, {})
+
+        for datatype, data, timestamp, frames in self.gop:
+            self._send(subscriber, shared, datatype, data,
+                max(0, timestamp - base), frames)
+
+    def _send(self, subscriber, shared, datatype, data, timestamp, frames):
+        func = getattr(subscriber, self._events[datatype])
+
+        if shared:
+            func(data, timestamp, frames)
+        else:
+            func(data, timestamp)
+
+    # events called by the stream
+
+    def _relay(self, datatype, data, timestamp):
+        """
+        Sends an a/v message to all subscribers. Subscribers that share
+        frames receive the same C{frames} cache so that the message body is
+        only split into RTMP frames once.
         """
         timestamp = self._updateTimestamp(timestamp)
 
+        frames = None
         to_remove = []
 
-        for subscriber, context in self.subscribers.iteritems():
-            relTimestamp = timestamp - context['timestamp']
+        if self.maxCacheBytes:
+            frames = self._cache(datatype, data, timestamp)
+
+        if frames is None:
+            frames = {}
 
+        for subscriber, context in self.subscribers.iteritems():
             try:
-                subscriber.videoDataReceived(data, relTimestamp)
+                self._send(subscriber, context['shared'], datatype, data,
+                    timestamp - context['timestamp'], frames)
             except:
                 log.err()
                 to_remove.append(subscriber)
@@ -831,27 +1429,83 @@ class StreamPublisher(object):
             for subscriber in to_remove:
                 self.removeSubscriber(subscriber)
 
-    def audioDataReceived(self, data, timestamp):
+    def videoDataReceived(self, data, timestamp):
         """
-        An audio packet has been received from the publishing stream.
+        A video packet has been received from the publishing stream.
 
-        @param data: The raw audio data.
+        @param data: The raw video data.
         @type data: C{str}
         @param timestamp: The timestamp at which this data was received.
         """
-        timestamp = self._updateTimestamp(timestamp)
+        self._relay(message.VIDEO_DATA, data, timestamp)
+
+    def fragmentReceived(self, datatype, data, timestamp, marker, bodyLength):
+        """
+        Part of an a/v packet has been received from the publishing stream.
+
+        Subscribers that accept fragments receive it straight away. The packet
+        is only put back together if it needs to be cached or there are
+        subscribers that do not accept fragments.
+        """
+        if marker & codec.FRAGMENT_START:
+            parts = None
+
+            if self.maxCacheBytes or [c for c in self.subscribers.itervalues()
+                    if not c['fragments']]:
+                parts = []
+
+            state = self._fragments[datatype] = [
+                self._updateTimestamp(timestamp), parts]
+        else:
+            state = self._fragments.get(datatype, None)
+
+            if state is None:
+                return
+
+        timestamp, parts = state
+        whole = None
+        frames = None
         to_remove = []
 
+        if parts is not None:
+            parts.append(data)
+
+        if marker & codec.FRAGMENT_END:
+            del self._fragments[datatype]
+
+            if parts is not None:
+                whole = ''.join(parts)
+
+                if self.maxCacheBytes:
+                    frames = self._cache(datatype, whole, timestamp)
+
+                if frames is None:
+                    frames = {}
+
         for subscriber, context in self.subscribers.iteritems():
             try:
-                subscriber.audioDataReceived(data, timestamp - context['timestamp'])
+                if context['fragments']:
+                    subscriber.fragmentReceived(datatype, data,
+                        timestamp - context['timestamp'], marker, bodyLength)
+                elif whole is not None:
+                    self._send(subscriber, context['shared'], datatype, whole,
+                        timestamp - context['timestamp'], frames)
             except:
                 log.err()
                 to_remove.append(subscriber)
 
-        if to_remove:
-            for subscriber in to_remove:
-                self.removeSubscriber(subscriber)
+        for subscriber in to_remove:
+            self.removeSubscriber(subscriber)
+
+    def audioDataReceived(self, data, timestamp):
+        """
+        An audio packet has been received from the publishing stream.
+
+        @param data: The raw audio data.
+        @type data: C{str}
+        @param timestamp: The timestamp at which this data was received.
+        """
+        self._relay(message.AUDIO_DATA, data, timestamp)
 
     def onMetaData(self, data):
         """
@@ -875,6 +1529,423 @@ class StreamPublisher(object):
         self.subscribers = {}
 
 
+class FilePlayer(object):
+    """
+    Plays an FLV file to a subscriber (video on demand). The tags are sent in
+    real time according to their timestamps, up to C{bufferTime} ahead so
+    that the peer can fill its buffer.
+
+    Quacks like a L{StreamPublisher} as far as the subscriber is concerned.
+    Once the end of the file has been sent, the C{playComplete} method of the
+    subscriber is called, if it has one.
+
+    @ivar file: The L{flv.FLVFile} being played.
+    @ivar subscriber: The subscriber or C{None}.
+    @ivar position: The index of the next tag to be sent.
+    @ivar offset: The time (milliseconds) that L{start} plays from by
+        default.
+    @ivar clock: Provides C{seconds} and C{callLater}. Defaults to the
+        reactor.
+    """
+
+    #: The number of seconds of media that is sent ahead of real time.
+    bufferTime = 1.0
+
+    _events = {
+        message.VIDEO_DATA: 'videoDataReceived',
+        message.AUDIO_DATA: 'audioDataReceived',
+    }
+
+    def __init__(self, file, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.file = file
+        self.clock = clock
+        self.subscriber = None
+        self.position = 0
+        self.offset = 0
+
+        self._call = None
+        self._started = 0
+        self._base = 0
+
+    def addSubscriber(self, subscriber):
+        """
+        Sets the subscriber that the file is played to. Any meta data is sent
+        straight away. Playback starts with L{start}.
+        """
+        self.subscriber = subscriber
+
+        if self.file.meta:
+            subscriber.onMetaData(self.file.meta)
+
+    def removeSubscriber(self, subscriber):
+        """
+        Stops playback and closes the file.
+        """
+        self.subscriber = None
+
+        self.stop()
+        self.file.close()
+
+    def start(self, timestamp=None):
+        """
+        Starts playing from the keyframe at or before C{timestamp}
+        (milliseconds), or L{offset} if not given.
+        """
+        if timestamp is None:
+            timestamp = self.offset
+
+        self.seek(timestamp)
+
+    def seek(self, timestamp):
+        """
+        Moves playback to the keyframe at or before C{timestamp}
+        (milliseconds).
+        """
+        self.stop()
+
+        f = self.file
+        self.position = f.seek(timestamp)
+
+        if self.position < len(f):
+            self._base = f.timestamps[self.position]
+        else:
+            self._base = f.duration
+
+        self._started = self.clock.seconds()
+
+        self._play()
+
+    def stop(self):
+        """
+        Pauses playback. See L{seek} to resume.
+        """
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+
+            self._call = None
+
+    def _play(self):
+        self._call = None
+
+        subscriber = self.subscriber
+
+        if subscriber is None:
+            return
+
+        f = self.file
+        timestamps = f.timestamps
+        count = len(f)
+        events = self._events
+
+        # the media time that may be sent by now
+        now = self._base + int((self.clock.seconds() - self._started +
+            self.bufferTime) * 1000)
+
+        while self.position < count:
+            timestamp = timestamps[self.position]
+
+            if timestamp > now:
+                self._call = self.clock.callLater(
+                    (timestamp - now) / 1000.0, self._play)
+
+                return
+
+            tagType, timestamp, data = f.getTag(self.position)
+            self.position += 1
+
+            getattr(subscriber, events[tagType])(data, timestamp)
+
+            if self.subscriber is not subscriber:
+                # stopped by the subscriber
+                return
+
+        func = getattr(subscriber, 'playComplete', None)
+
+        if func is not None:
+            func()
+
+
+
+class StreamRecorder(object):
+    """
+    Records a published stream to an FLV file. Subscribes to the
+    L{StreamPublisher} like a playing stream.
+
+    The disk is never touched from the reactor thread. Tags are buffered and
+    written by a thread pool, one batch at a time: whatever arrives while a
+    batch is being written goes in the next one. If the disk falls behind
+    and C{maxBufferBytes} is reached, new tags are dropped, and video then
+    waits for the next keyframe.
+
+    @ivar path: The name of the file.
+    @ivar append: Whether to add to the end of an existing file.
+    @ivar pending: The C{(tagType, timestamp, data)} tuples waiting to be
+        written.
+    @ivar pendingBytes: The number of payload bytes in C{pending}.
+    @ivar dropped: The number of tags that were dropped.
+    @ivar writer: The L{flv.FLVWriter}, only touched from the thread pool.
+    """
+
+    #: The maximum number of payload bytes waiting to be written.
+    maxBufferBytes = 4 * 1024 * 1024
+
+    def __init__(self, path, append=False, threadpool=None, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        if threadpool is None:
+            threadpool = reactor.getThreadPool()
+
+        self.path = path
+        self.append = append
+        self.reactor = reactor
+        self.threadpool = threadpool
+
+        self.writer = None
+        self.pending = []
+        self.pendingBytes = 0
+        self.dropped = 0
+
+        self._writing = False
+        self._needKeyframe = False
+        self._stopped = None
+        self._failed = False
+
+    def deferToThread(self, func, *args):
+        """
+        Runs C{func} in the thread pool.
+
+        @rtype: L{defer.Deferred}
+        """
+        return threads.deferToThreadPool(self.reactor, self.threadpool, func,
+            *args)
+
+    def _add(self, tagType, data, timestamp):
+        if self._stopped is not None or self._failed:
+            return
+
+        if self.pendingBytes + len(data) > self.maxBufferBytes:
+            if not self._needKeyframe:
+                log.msg('Recording to %s has fallen behind, dropping data' % (
+                    self.path,))
+
+            self.dropped += 1
+            self._needKeyframe = True
+
+            return
+
+        if self._needKeyframe and tagType == message.VIDEO_DATA:
+            if not flv.is_keyframe(data):
+                self.dropped += 1
+
+                return
+
+            self._needKeyframe = False
+
+        self.pending.append((tagType, timestamp, data))
+        self.pendingBytes += len(data)
+
+        self._flush()
+
+    def _flush(self):
+        """
+        Starts writing the pending tags if a write is not already in progress.
+        Once everything is written and the recorder has been stopped, the
+        file is closed.
+        """
+        if self._writing:
+            return
+
+        if self.pending:
+            tags, self.pending = self.pending, []
+            self.pendingBytes = 0
+
+            d = self.deferToThread(self._write, tags)
+        elif self._stopped is not None:
+            d = self.deferToThread(self._close)
+            d.chainDeferred(self._stopped)
+
+            return
+        else:
+            return
+
+        self._writing = True
+
+        d.addCallbacks(self._written, self._writeFailed)
+
+    def _written(self, res):
+        self._writing = False
+
+        self._flush()
+
+    def _writeFailed(self, fail):
+        log.err(fail, 'Recording to %s failed' % (self.path,))
+
+        self._writing = False
+        self._failed = True
+        del self.pending[:]
+        self.pendingBytes = 0
+
+        self._flush()
+
+    def _write(self, tags):
+        # runs in the thread pool
+        if self.writer is None:
+            self.writer = flv.FLVWriter(self.path, self.append)
+
+        self.writer.write(tags)
+
+    def _close(self):
+        # runs in the thread pool
+        if self.writer is not None:
+            self.writer.close()
+
+    def stop(self):
+        """
+        Stops recording. Tags that have been received are still written.
+
+        @return: A L{defer.Deferred} that fires once the file is closed.
+        """
+        if self._stopped is None:
+            self._stopped = defer.Deferred()
+
+            self._flush()
+
+        d = defer.Deferred()
+
+        def cb(res):
+            d.callback(res)
+
+            return res
+
+        self._stopped.addBoth(cb)
+
+        return d
+
+    # subscriber events
+
+    def videoDataReceived(self, data, timestamp):
+        self._add(message.VIDEO_DATA, data, timestamp)
+
+    def audioDataReceived(self, data, timestamp):
+        self._add(message.AUDIO_DATA, data, timestamp)
+
+    def onMetaData(self, data):
+        meta = pyamf.encode('onMetaData', data, encoding=pyamf.AMF0)
+
+        self._add(flv.TAG_SCRIPT, meta.getvalue(), 0)
+
+    def unpublish(self):
+        self.stop()
+
+
+class OriginPublisher(StreamPublisher):
+    """
+    Publishes a stream that is played from the origin server of an
+    application (see L{Application.origin}). The stream is pulled over one
+    RTMP connection for as long as it has subscribers.
+
+    @ivar application: The L{Application} that the stream is published in.
+    @ivar name: The name of the stream.
+    @ivar url: The url of the application on the origin server.
+    @ivar connection: The L{rtmp_client.NetConnection} to the origin server
+        once connected.
+    @ivar done: Whether the stream has ended.
+    """
+
+    def __init__(self, application, name, url):
+        client = Client(None)
+        client.id = 'origin:' + url
+
+        StreamPublisher.__init__(self, None, client)
+
+        self.application = application
+        self.name = name
+        self.url = url
+        self.connection = None
+        self.done = False
+
+    def connect(self):
+        """
+        Connects to the origin server.
+
+        @return: A L{defer.Deferred} that fires with the
+            L{rtmp_client.NetConnection}.
+        """
+        return rtmp_client.connect(self.url)
+
+    def start(self):
+        """
+        Connects to the origin server and plays the stream from it.
+        """
+        def play(stream):
+            stream.listener = self
+
+            return stream.play(self.name)
+
+        def cb(nc):
+            self.connection = nc
+
+            if self.done:
+                nc.close()
+
+                return
+
+            return nc.createStream().addCallback(play)
+
+        def eb(fail):
+            if not self.done:
+                log.err(fail, 'Unable to pull %r from %s' % (self.name,
+                    self.url))
+
+            self.unpublish()
+
+        d = defer.maybeDeferred(self.connect)
+
+        d.addCallback(cb)
+        d.addErrback(eb)
+
+        return d
+
+    def removeSubscriber(self, subscriber):
+        """
+        Removes the subscriber, ending the stream once there are none left.
+        """
+        StreamPublisher.removeSubscriber(self, subscriber)
+
+        if not self.subscribers:
+            self.stop()
+
+    def stop(self):
+        """
+        Disconnects from the origin server.
+        """
+        self.unpublish()
+
+    def unpublish(self):
+        """
+        The stream has ended (or the connection to the origin server has
+        gone). It is removed from the application and its subscribers are
+        told.
+        """
+        if self.done:
+            return
+
+        self.done = True
+
+        if self.application.streams.get(self.name, None) is self:
+            del self.application.streams[self.name]
+
+        if self.connection is not None:
+            self.connection.close()
+
+        StreamPublisher.unpublish(self)
+
+
 class Application(object):
     """
     The business logic behind
@@ -884,6 +1955,25 @@ class Application(object):
 
     client = Client
 
+    #: The directory that recorded streams are played from (video on demand).
+    #  C{None} disables playing files.
+    fileRoot = None
+
+    #: Builds the L{FilePlayer} for a recorded stream.
+    filePlayer = FilePlayer
+
+    #: Builds the L{StreamRecorder} for a stream published with the
+    #  C{record} or C{append} type.
+    streamRecorder = StreamRecorder
+
+    #: The C{rtmp://host[:port]/app} url of an origin server. Streams that
+    #  are played but not published here are played from the origin and
+    #  republished (see L{pullStream}). C{None} disables origin pull.
+    origin = None
+
+    #: Builds the L{OriginPublisher} for a stream pulled from L{origin}.
+    originPublisher = OriginPublisher
+
     def __init__(self):
         self.clients = {}
         self.streams = {}
@@ -940,7 +2030,8 @@ class Application(object):
             except:
                 log.err()
 
-            self.streams.pop(name, None)
+            if self.streams.pop(name, None) is not None:
+                self._unregisterStream(name)
 
         c = self.clients.pop(client.id, None)
 
@@ -994,6 +2085,9 @@ class Application(object):
         Will call C{cb} when a stream has been published under C{name}
 
         C{cb} will be called with one argument, the stream object itself.
+
+        If the application has an L{origin}, a stream that is not published
+        here is pulled from the origin straight away.
         """
         if not callable(cb):
             raise TypeError('cb must be callable for whenPublished')
@@ -1001,11 +2095,20 @@ class Application(object):
         try:
             publisher = self.streams[name]
         except KeyError:
-            cbs = self._pendingPublishedCallbacks.setdefault(name, [])
+            if self.origin is not None:
+                publisher = self.pullStream(name)
+            else:
+                cbs = self._pendingPublishedCallbacks.setdefault(name, [])
 
-            cbs.append(cb)
+                cbs.append(cb)
 
-            return
+                registry = self.getRegistry()
+
+                if registry is not None and len(cbs) == 1:
+                    registry.whenPublished(self, name, lambda publisher:
+                        self._publishedElsewhere(name, publisher))
+
+                return
 
         try:
             cb(publisher)
@@ -1032,23 +2135,115 @@ class Application(object):
         del self._pendingPublishedCallbacks[name]
 
 
+    def pullStream(self, name):
+        """
+        Publishes the stream C{name} as it is played from the L{origin}
+        server. All the subscribers share the one connection to the origin.
+
+        @return: The L{OriginPublisher}.
+        """
+        publisher = self.streams[name] = self.originPublisher(self, name,
+            self.origin)
+
+        publisher.start()
+
+        return publisher
+
+
+    def getRegistry(self):
+        """
+        Returns the L{IStreamRegistry} shared with other processes, or C{None}
+        if this application is not part of a cluster.
+        """
+        return getattr(getattr(self, 'factory', None), 'registry', None)
+
+
+    def _publishedElsewhere(self, name, publisher):
+        """
+        Called by the registry when a stream that is waited on has been
+        published by another process. C{publisher} relays it to this one.
+        """
+        if name in self.streams or \
+                name not in self._pendingPublishedCallbacks:
+            publisher.stop()
+
+            return
+
+        self.streams[name] = publisher
+
+        self._runCallbacksForPublishedStream(name, publisher)
+
+
+    def _unregisterStream(self, name):
+        registry = self.getRegistry()
+
+        if registry is None:
+            return
+
+        try:
+            registry.unregister(self, name)
+        except:
+            log.err()
+
+
     def publishStream(self, client, requestor, name, type_='live'):
         """
         The C{stream} is requesting to publish an audio/video stream under the
         name C{name}. Reject the publish request by raising an exception.
 
+        If the application is part of a cluster, the name is claimed from the
+        registry first (see L{getRegistry}) and a L{defer.Deferred} is
+        returned.
+
         @param client: The L{Client} requesting the publishing the stream.
         @param stream: The L{NetStream} that will receive the a/v data.
         @param name: The name of the stream that will be published.
-        @param type_: Ignored for now.
+        @param type_: C{live}, or C{record}/C{append} to also record the
+            stream to a file in L{fileRoot}, replacing or adding to any
+            previous recording.
         """
+        registry = self.getRegistry()
+
+        if registry is None or name in self.streams:
+            return self._publishStream(client, requestor, name, type_)
+
+        d = registry.register(self, name)
+
+        def cb(res):
+            try:
+                return self._publishStream(client, requestor, name, type_)
+            except:
+                if name not in self.streams:
+                    self._unregisterStream(name)
+
+                raise
+
+        d.addCallback(cb)
+
+        return d
+
+
+    def _publishStream(self, client, requestor, name, type_):
         stream = self.streams.get(name, None)
 
         if stream is None:
+            recorder = None
+
+            if type_ in ('record', 'append'):
+                path = self.getStreamPath(name, exists=False)
+
+                if path is None:
+                    raise exc.RecordNoAccess('Unable to record %r' % (name,))
+
+                recorder = self.streamRecorder(path, type_ == 'append')
+
             # brand new publish
             stream = self.streams[name] = StreamPublisher(requestor, client)
             self._streamingClients[client] = stream
 
+            if recorder is not None:
+                stream.addSubscriber(recorder)
+
         if client.id != stream.client.id:
             raise exc.BadNameError("'%s' is already used" % (name,))
 
@@ -1057,6 +2252,62 @@ class Application(object):
         return stream
 
 
+    def getStreamPath(self, name, exists=True):
+        """
+        Returns the path of the FLV file that holds the recorded stream
+        C{name}, or C{None} if there is no such file or playing/recording
+        files is disabled (see L{fileRoot}).
+
+        C{name} may be prefixed with C{flv:} and the C{.flv} extension is
+        optional. Names that would escape C{fileRoot} are rejected.
+
+        @param exists: Whether the file must already exist.
+        """
+        if self.fileRoot is None:
+            return None
+
+        if name.startswith('flv:'):
+            name = name[4:]
+
+        if not name.endswith('.flv'):
+            name += '.flv'
+
+        root = os.path.abspath(self.fileRoot)
+        path = os.path.abspath(os.path.join(root, name))
+
+        if not path.startswith(root + os.sep):
+            return None
+
+        if exists and not os.path.isfile(path):
+            return None
+
+        return path
+
+
+    def playFile(self, name, subscriber, start=0):
+        """
+        Plays the recorded stream C{name} to C{subscriber}, starting at the
+        keyframe at or before C{start} milliseconds.
+
+        Playback does not begin until L{FilePlayer.start} is called, so that
+        the subscriber can be readied first.
+
+        @return: The L{FilePlayer} or C{None} if there is no such recording.
+        @raise exc.FileStructureInvalid: The file is not a valid FLV file.
+        """
+        path = self.getStreamPath(name)
+
+        if path is None:
+            return None
+
+        player = self.filePlayer(flv.FLVFile(path))
+
+        player.offset = start
+        player.addSubscriber(subscriber)
+
+        return player
+
+
     def unpublishStream(self, name, stream):
         try:
             source = self.streams[name]
@@ -1073,6 +2324,8 @@ class Application(object):
 
         del self.streams[name]
 
+        self._unregisterStream(name)
+
 
     def addSubscriber(self, stream, subscriber):
         """
@@ -1158,6 +2411,8 @@ class ServerFactory(protocol.ServerFactory):
     @ivar _pendingApplications: A collection of applications that are pending
         activation.
     @type _pendingApplications: C{dict} of C{name} -> L{IApplication}
+    @ivar registry: The L{IStreamRegistry} that the applications share stream
+        names with other processes through, or C{None}. See L{rtmpy.cluster}.
     """
 
     protocol = ServerProtocol
@@ -1167,6 +2422,8 @@ class ServerFactory(protocol.ServerFactory):
     downstreamBandwidth = 2500000L
     fmsVer = versions.FMS_MIN_H264
 
+    registry = None
+
     def __init__(self, applications=None):
         self.applications = {}
         self._pendingApplications = {}
@@ -22,6 +22,7 @@ from twisted.trial import unittest
 from pyamf.util import BufferedByteStream
 
 from rtmpy.protocol.rtmp import codec, header
+from rtmpy import message
 
 
 class MockChannel(object):
@@ -85,6 +86,7 @@ class DispatchTester(object):
     def __init__(self, test):
         self.test = test
         self.messages = []
+        self.fragments = []
         self.intervals = []
 
     def dispatchMessage(self, *args):
@@ -95,6 +97,9 @@ class DispatchTester(object):
 
         self.messages.append(args)
 
+    def dispatchFragment(self, *args):
+        self.fragments.append(args)
+
     def bytesInterval(self, bytes):
         self.intervals.append(bytes)
 
@@ -146,6 +151,27 @@ class FrameReaderTestCase(unittest.TestCase):
 
         self.assertEqual(channel.bytes, 0)
 
+    def test_channel_limit(self):
+        """
+        Referencing more than C{maxChannels} channels is a decode error.
+        """
+        self.reader.maxChannels = 1
+
+        for channelId in (3, 3, 4):
+            h = header.Header(channelId, datatype=2, bodyLength=2, streamId=1,
+                timestamp=10)
+
+            header.encode(self.stream, h)
+            self.stream.write('a' * 2)
+
+        self.stream.seek(0)
+
+        self.reader.readFrame()
+        self.reader.readFrame()
+
+        self.assertRaises(codec.DecodeError, self.reader.readFrame)
+        self.assertEqual(self.channels.keys(), [3])
+
     def test_send(self):
         self.assertEqual(self.stream.getvalue(), '')
 
@@ -155,16 +181,77 @@ class FrameReaderTestCase(unittest.TestCase):
 
     def test_eof(self):
         self.assertTrue(self.stream.at_eof())
-        self.assertRaises(IOError, self.reader.readFrame)
+        self.assertEqual(self.reader.readFrame(), None)
+        self.assertEqual(self.reader.needed, 1)
 
-    def test_ioerror_seek(self):
+    def test_partial_header(self):
         self.stream.append('foo')
         self.stream.seek(1)
 
         self.assertEqual(self.stream.tell(), 1)
-        self.assertRaises(IOError, self.reader.readFrame)
+        self.assertEqual(self.reader.readFrame(), None)
 
         self.assertEqual(self.stream.tell(), 1)
+        self.assertEqual(self.reader.needed, 8)
+        self.assertEqual(self.reader.bytes, 0)
+
+    def test_extended_timestamp(self):
+        """
+        The extended timestamp is part of the header.
+        """
+        h = header.Header(3, datatype=2, bodyLength=2, streamId=1,
+            timestamp=0x1000000)
+        data = header.pack(h) + 'ab'
+
+        self.stream.append(data[:12])
+
+        self.assertEqual(self.reader.readFrame(), None)
+        self.assertEqual(self.reader.needed, 16)
+
+        self.stream.append(data[12:])
+
+        bytes, complete, meta = self.reader.readFrame()
+
+        self.assertEqual(bytes, 'ab')
+        self.assertEqual(meta.timestamp, 0x1000000)
+
+    def test_partial_body(self):
+        """
+        The header is kept until the body of the frame arrives.
+        """
+        h = header.Header(3, datatype=2, bodyLength=200, streamId=1,
+            timestamp=10)
+
+        self.stream.append(header.pack(h) + 'a' * 100)
+
+        self.assertEqual(self.reader.readFrame(), None)
+        self.assertEqual(self.reader.needed, 128)
+        self.assertEqual(self.stream.tell(), 12)
+
+        self.stream.append('a' * 28)
+
+        bytes, complete, meta = self.reader.readFrame()
+
+        self.assertEqual(bytes, 'a' * 128)
+        self.assertFalse(complete)
+        self.assertEqual(self.reader.needed, 1)
+        self.assertEqual(self.reader.bytes, 140)
+
+    def test_compact(self):
+        self.reader.compactThreshold = 10
+        self.stream.append('a' * 20)
+
+        self.stream.seek(5)
+        self.reader.compact()
+        self.assertEqual(self.stream.getvalue(), 'a' * 20)
+
+        self.stream.seek(10)
+        self.reader.compact()
+        self.assertEqual(self.stream.getvalue(), 'a' * 10)
+
+        self.stream.seek(10)
+        self.reader.compact()
+        self.assertEqual(self.stream.getvalue(), '')
 
     def test_simple(self):
         """
@@ -218,7 +305,7 @@ class FrameReaderTestCase(unittest.TestCase):
         self.assertTrue(complete)
         check_meta(meta, 10)
 
-        self.assertRaises(IOError, self.reader.readFrame)
+        self.assertEqual(self.reader.readFrame(), None)
 
 
     def test_reassign(self):
@@ -253,6 +340,37 @@ class FrameReaderTestCase(unittest.TestCase):
         self.assertEqual(meta.timestamp, 100)
 
 
+    def test_header_reuse(self):
+        """
+        Relative headers are merged into the channel header in place and a
+        snapshot is returned once the message is complete.
+        """
+        full = header.Header(3, datatype=2, bodyLength=200, streamId=1,
+            timestamp=10)
+
+        header.encode(self.stream, full)
+        self.stream.write('a' * 128)
+        header.encode(self.stream, full, full)
+        self.stream.write('b' * 72)
+
+        self.stream.seek(0)
+
+        bytes, complete, meta = self.reader.readFrame()
+        channel = self.channels[3]
+        h = channel.header
+
+        self.assertFalse(complete)
+        self.assertIdentical(meta, h)
+
+        bytes, complete, meta = self.reader.readFrame()
+
+        self.assertTrue(complete)
+        self.assertIdentical(channel.header, h)
+        self.assertNotIdentical(meta, h)
+        self.assertEqual(meta.timestamp, 10)
+        self.assertEqual(meta.bodyLength, 200)
+
+
 class DeMuxerTestCase(unittest.TestCase):
     """
     Tests for L{codec.DeMuxer}
@@ -279,14 +397,50 @@ class DeMuxerTestCase(unittest.TestCase):
             ('foo', False, meta), ('bar', False, meta), ('baz', True, meta))
 
         self.assertEqual(self.demuxer.readFrame(), (None, None))
-        self.assertEqual(self.demuxer.bucket, {1: 'foo'})
+        self.assertEqual(self.demuxer.bucket, {1: ['foo']})
 
         self.assertEqual(self.demuxer.readFrame(), (None, None))
-        self.assertEqual(self.demuxer.bucket, {1: 'foobar'})
+        self.assertEqual(self.demuxer.bucket, {1: ['foo', 'bar']})
 
         self.assertEqual(self.demuxer.readFrame(), ('foobarbaz', meta))
         self.assertEqual(self.demuxer.bucket, {})
 
+    def test_single_frame(self):
+        """
+        A message that fits into one frame is returned without buffering.
+        """
+        meta = ChannelMeta(channelId=1)
+        data = 'foo'
+
+        self.add_events((data, True, meta))
+
+        ret, m = self.demuxer.readFrame()
+
+        self.assertIdentical(ret, data)
+        self.assertIdentical(m, meta)
+        self.assertEqual(self.demuxer.bucket, {})
+
+    def test_interleaved(self):
+        """
+        Incomplete data for different channels is buffered separately.
+        """
+        m1 = ChannelMeta(channelId=1)
+        m2 = ChannelMeta(channelId=2)
+
+        self.add_events(
+            ('foo', False, m1), ('spam', False, m2), ('bar', True, m1),
+            ('eggs', True, m2))
+
+        self.assertEqual(self.demuxer.readFrame(), (None, None))
+        self.assertEqual(self.demuxer.readFrame(), (None, None))
+        self.assertEqual(self.demuxer.bucket, {1: ['foo'], 2: ['spam']})
+
+        self.assertEqual(self.demuxer.readFrame(), ('foobar', m1))
+        self.assertEqual(self.demuxer.bucket, {2: ['spam']})
+
+        self.assertEqual(self.demuxer.readFrame(), ('spameggs', m2))
+        self.assertEqual(self.demuxer.bucket, {})
+
 
         
 class DecoderTestCase(unittest.TestCase):
@@ -395,3 +549,226 @@ class BytesIntervalTestCase(unittest.TestCase):
         self.assertEqual(self.decoder.bytes, 12)
         self.assertEqual(self.dispatcher.intervals, [12])
 
+
+
+class DrainTestCase(unittest.TestCase):
+    """
+    Tests for L{codec.Decoder.drain}
+    """
+
+    message = '\x03\x00\x00\x00\x00\x00\x00\r\x00\x00\x00\x00'
+
+    def setUp(self):
+        self.dispatcher = DispatchTester(self)
+        self.stream_factory = MockStreamFactory(self)
+        self.decoder = codec.Decoder(self.dispatcher, self.stream_factory)
+
+    def getStream(self, streamId):
+        return MockStream()
+
+    def test_empty(self):
+        self.assertTrue(self.decoder.drain())
+        self.assertEqual(self.dispatcher.messages, [])
+
+    def test_all(self):
+        self.decoder.send(self.message * 3)
+
+        self.assertTrue(self.decoder.drain())
+        self.assertEqual(len(self.dispatcher.messages), 3)
+        self.assertEqual(self.decoder.stream.getvalue(), '')
+
+    def test_partial(self):
+        """
+        Incomplete frames are left in the stream.
+        """
+        self.decoder.send(self.message * 2 + self.message[:5])
+
+        self.assertTrue(self.decoder.drain())
+        self.assertEqual(len(self.dispatcher.messages), 2)
+        self.assertEqual(self.decoder.stream.peek(100), self.message[:5])
+
+        self.decoder.send(self.message[5:])
+
+        self.assertTrue(self.decoder.drain())
+        self.assertEqual(len(self.dispatcher.messages), 3)
+
+    def test_byte_budget(self):
+        self.decoder.send(self.message * 3)
+
+        self.assertFalse(self.decoder.drain(maxBytes=24))
+        self.assertEqual(len(self.dispatcher.messages), 2)
+
+        self.assertTrue(self.decoder.drain(maxBytes=24))
+        self.assertEqual(len(self.dispatcher.messages), 3)
+
+    def test_time_budget(self):
+        self.patch(codec.time, 'time', iter([0, 0, 10]).next)
+        self.decoder.send(self.message * 3)
+
+        self.assertFalse(self.decoder.drain(maxTime=5))
+        self.assertEqual(len(self.dispatcher.messages), 2)
+
+
+
+class FragmentTestCase(unittest.TestCase):
+    """
+    Tests for L{codec.Decoder.streamingTypes}
+    """
+
+    def setUp(self):
+        self.dispatcher = DispatchTester(self)
+        self.stream_factory = MockStreamFactory(self)
+        self.decoder = codec.Decoder(self.dispatcher, self.stream_factory)
+        self.decoder.streamingTypes = (message.VIDEO_DATA,)
+
+        self.stream = MockStream()
+
+    def getStream(self, streamId):
+        return self.stream
+
+    def encode(self, *messages):
+        output = BufferedByteStream()
+        encoder = codec.Encoder(output)
+
+        for args in messages:
+            encoder.send(*args)
+
+        for x in encoder:
+            pass
+
+        return output.getvalue()
+
+    def test_fragments(self):
+        body = 'v' * 300
+
+        self.decoder.send(self.encode(
+            (body, message.VIDEO_DATA, 1, 40),
+            ('i' * 200, message.INVOKE, 1, 50)))
+        self.decoder.drain()
+
+        self.assertEqual(self.dispatcher.fragments, [
+            (self.stream, message.VIDEO_DATA, 40, 'v' * 128,
+                codec.FRAGMENT_START, 300),
+            (self.stream, message.VIDEO_DATA, 40, 'v' * 128,
+                codec.FRAGMENT_CONTINUE, 300),
+            (self.stream, message.VIDEO_DATA, 40, 'v' * 44,
+                codec.FRAGMENT_END, 300),
+        ])
+
+        # other types are still buffered
+        self.assertEqual(self.dispatcher.messages, [
+            (self.stream, message.INVOKE, 50, 'i' * 200)])
+
+    def test_single_frame(self):
+        self.decoder.send(self.encode(('v' * 10, message.VIDEO_DATA, 1, 40)))
+        self.decoder.drain()
+
+        self.assertEqual(self.dispatcher.fragments, [
+            (self.stream, message.VIDEO_DATA, 40, 'v' * 10,
+                codec.FRAGMENT_START | codec.FRAGMENT_END, 10)])
+
+
+
+class FragmentAssemblerTestCase(unittest.TestCase):
+    """
+    Tests for L{codec.FragmentAssembler}
+    """
+
+    def setUp(self):
+        self.assembler = codec.FragmentAssembler()
+
+    def test_assemble(self):
+        add = self.assembler.add
+
+        self.assertEqual(add('a', 'foo', codec.FRAGMENT_START), None)
+        self.assertEqual(add('b', 'spam', codec.FRAGMENT_START |
+            codec.FRAGMENT_END), 'spam')
+        self.assertEqual(add('a', 'bar', codec.FRAGMENT_CONTINUE), None)
+        self.assertEqual(add('a', 'baz', codec.FRAGMENT_END), 'foobarbaz')
+
+        self.assertEqual(self.assembler.parts, {})
+
+    def test_no_start(self):
+        self.assertEqual(self.assembler.add('a', 'foo', codec.FRAGMENT_END),
+            None)
+        self.assertEqual(self.assembler.parts, {})
+
+
+
+class FeedTestCase(unittest.TestCase):
+    """
+    Tests for L{codec.Decoder.feed}
+    """
+
+    def setUp(self):
+        self.decoder = codec.Decoder(None, None)
+
+    def encode(self, *messages):
+        output = BufferedByteStream()
+        encoder = codec.Encoder(output)
+
+        for args in messages:
+            if args[1] == message.FRAME_SIZE:
+                for x in encoder:
+                    pass
+
+                encoder.send(*args)
+
+                for x in encoder:
+                    pass
+
+                encoder.setFrameSize(256)
+
+                continue
+
+            encoder.send(*args)
+
+        for x in encoder:
+            pass
+
+        return output.getvalue()
+
+    def test_empty(self):
+        self.assertEqual(self.decoder.feed(''), [])
+
+    def test_batch(self):
+        data = self.encode(
+            ('v' * 300, message.VIDEO_DATA, 1, 40),
+            ('a' * 10, message.AUDIO_DATA, 1, 50),
+            ('i' * 200, message.INVOKE, 0, 60))
+
+        self.assertEqual(self.decoder.feed(data), [
+            (1, message.AUDIO_DATA, 50, 'a' * 10),
+            (1, message.VIDEO_DATA, 40, 'v' * 300),
+            (0, message.INVOKE, 60, 'i' * 200),
+        ])
+        self.assertEqual(self.decoder.stream.getvalue(), '')
+
+    def test_partial(self):
+        """
+        Incomplete data is kept until the next call.
+        """
+        data = self.encode(('v' * 300, message.VIDEO_DATA, 1, 40))
+        messages = []
+
+        for i in xrange(len(data)):
+            messages.extend(self.decoder.feed(data[i]))
+
+        self.assertEqual(messages, [(1, message.VIDEO_DATA, 40, 'v' * 300)])
+        self.assertEqual(self.decoder.stream.getvalue(), '')
+
+    def test_frame_size(self):
+        """
+        Frame size messages take effect for the rest of the data.
+        """
+        data = self.encode(
+            ('\x00\x00\x01\x00', message.FRAME_SIZE, 0, 0),
+            ('v' * 600, message.VIDEO_DATA, 1, 40))
+
+        messages = self.decoder.feed(data)
+
+        self.assertEqual(self.decoder.frameSize, 256)
+        self.assertEqual(messages, [
+            (0, message.FRAME_SIZE, 0, '\x00\x00\x01\x00'),
+            (1, message.VIDEO_DATA, 40, 'v' * 600),
+        ])
@@ -21,7 +21,7 @@ import unittest
 
 from pyamf.util import BufferedByteStream
 
-from rtmpy.protocol.rtmp import codec
+from rtmpy.protocol.rtmp import codec, header, scheduler
 from rtmpy import message
 
 
@@ -51,12 +51,36 @@ class EncoderTestCase(BaseTestCase):
 
         self.encoder.send('bar', 12, 2, 3)
 
-        self.assertEqual(self.encoder.pending, [('bar', 12, 2, 3, None)])
+        self.assertEqual(list(self.encoder.pending), [('bar', 12, 2, 3, None)])
 
         self.encoder.channelsInUse -= 1
         self.encoder.next()
 
-        self.assertEqual(self.encoder.pending, [])
+        self.assertEqual(list(self.encoder.pending), [])
+
+    def test_saturated(self):
+        """
+        Pending messages stay queued, in order, until channels are released.
+        """
+        channels = [self.encoder.acquireChannel() for i in xrange(3)]
+        self.encoder.channelsInUse = codec.MAX_CHANNELS
+
+        self.encoder.send('foo', 8, 1, 0)
+        self.encoder.send('bar', 9, 1, 0)
+
+        self.assertRaises(StopIteration, self.encoder.next)
+        self.assertEqual(len(self.encoder.pending), 2)
+
+        self.encoder.releaseChannel(channels[1].channelId)
+
+        # the channel is taken so that 'baz' does not jump the queue
+        self.encoder.send('baz', 8, 1, 0)
+        self.encoder.next()
+
+        self.assertEqual(list(self.encoder.pending), [
+            ('bar', 9, 1, 0, None), ('baz', 8, 1, 0, None)])
+        self.assertEqual(self.output.getvalue(),
+            '\x04\x00\x00\x00\x00\x00\x03\x08\x01\x00\x00\x00foo')
 
 
 class AquireChannelTestCase(BaseTestCase):
@@ -88,6 +112,59 @@ class AquireChannelTestCase(BaseTestCase):
         self.assertEqual(self.encoder.acquireChannel(), None)
 
 
+    def test_header(self):
+        """
+        Each channel reuses the same header for every message it writes.
+        """
+        c = self.encoder.acquireChannel()
+
+        h = c.buildHeader(10, 8, 5, 1)
+
+        self.assertEqual(h.channelId, c.channelId)
+        self.assertEqual(h.timestamp, 10)
+        self.assertEqual(h.datatype, 8)
+        self.assertEqual(h.bodyLength, 5)
+        self.assertEqual(h.streamId, 1)
+
+        self.assertIdentical(c.buildHeader(20, 9, 6, 2), h)
+        self.assertEqual(h.timestamp, 20)
+
+
+class ChannelTestCase(BaseTestCase):
+    """
+    Tests for L{codec.ProducingChannel}
+    """
+
+    def test_slots(self):
+        c = self.encoder.acquireChannel()
+
+        self.assertRaises(AttributeError, setattr, c, 'foo', 'bar')
+
+    def test_lazy_buffer(self):
+        c = self.encoder.acquireChannel()
+
+        self.assertEqual(c._buffer, None)
+        self.encoder.releaseChannel(c.channelId)
+
+        self.encoder.send('foo', 8, 1, 0)
+        self.assertTrue(c.acquired)
+
+        self.assertEqual(c.buffer.getvalue(), 'foo')
+
+        self.encoder.next()
+
+        # released channels do not hold on to a buffer
+        self.assertEqual(c._buffer, None)
+        self.assertFalse(c.acquired)
+
+    def test_limit(self):
+        self.encoder.maxChannels = 2
+
+        self.assertNotEqual(self.encoder.acquireChannel(), None)
+        self.assertNotEqual(self.encoder.acquireChannel(), None)
+        self.assertEqual(self.encoder.acquireChannel(), None)
+
+
 class ReleaseChannelTestCase(BaseTestCase):
     """
     Tests for L{codec.Encoder.releaseChannel}
@@ -105,6 +182,28 @@ class ReleaseChannelTestCase(BaseTestCase):
 
         self.assertEqual(self.encoder.channelsInUse, 0)
 
+    def test_reuse(self):
+        """
+        The most recently released channel is acquired first.
+        """
+        a = self.encoder.acquireChannel()
+        b = self.encoder.acquireChannel()
+
+        self.encoder.releaseChannel(a.channelId)
+        self.encoder.releaseChannel(b.channelId)
+
+        self.assertIdentical(self.encoder.acquireChannel(), b)
+        self.assertIdentical(self.encoder.acquireChannel(), a)
+        self.assertEqual(self.encoder.acquireChannel().channelId, 3)
+
+    def test_twice(self):
+        c = self.encoder.acquireChannel()
+
+        self.encoder.releaseChannel(c.channelId)
+
+        self.assertRaises(codec.EncodeError, self.encoder.releaseChannel,
+            c.channelId)
+
 
 class WritingTestCase(BaseTestCase):
     """
@@ -163,6 +262,38 @@ class WritingTestCase(BaseTestCase):
         self.assertRaises(StopIteration, self.encoder.next)
 
     def test_interleave(self):
+        """
+        Audio is scheduled ahead of data and may write several frames per
+        round.
+        """
+        # dispatch two messages
+        self.encoder.send('a' * (128 + 1), 15, 7, 0)
+        self.encoder.send('b' * (128 + 50), 8, 0xfffe, 0)
+
+        self.encoder.next()
+
+        self.output.seek(0)
+        self.assertEqual(self.output.read(12),
+            '\x04\x00\x00\x00\x00\x00\xb2\x08\xfe\xff\x00\x00')
+        self.assertEqual(self.output.read(128), 'b' * 128)
+        self.assertEqual(self.output.read(1), '\xc4')
+        self.assertEqual(self.output.read(50), 'b' * 50)
+        self.assertEqual(self.output.read(12),
+            '\x03\x00\x00\x00\x00\x00\x81\x0f\x07\x00\x00\x00')
+        self.assertEqual(self.output.read(128), 'a' * 128)
+        self.assertTrue(self.output.at_eof())
+        self.output.consume()
+
+        self.encoder.next()
+
+        self.output.seek(0)
+        self.assertEqual(self.output.read(1), '\xc3')
+        self.assertEqual(self.output.read(1), 'a')
+        self.assertTrue(self.output.at_eof())
+
+    def test_interleave_round_robin(self):
+        self.encoder.scheduler = scheduler.RoundRobinScheduler()
+
         # dispatch two messages
         self.encoder.send('a' * (128 + 1), 15, 7, 0)
         self.encoder.send('b' * (128 + 50), 8, 0xfffe, 0)
@@ -188,6 +319,21 @@ class WritingTestCase(BaseTestCase):
         self.assertEqual(self.output.read(50), 'b' * 50)
         self.assertTrue(self.output.at_eof())
 
+    def test_callback_reset(self):
+        """
+        The callback of a message must not fire for the next message written
+        to the same channel.
+        """
+        called = []
+
+        self.encoder.send('a', 8, 1, 0, lambda: called.append(True))
+        self.encoder.next()
+
+        self.encoder.send('b', 8, 1, 0)
+        self.encoder.next()
+
+        self.assertEqual(called, [True])
+
     def test_reappropriate_channel(self):
         self.encoder.send('a' * 2, 8, 5, 0)
 
@@ -213,6 +359,112 @@ class WritingTestCase(BaseTestCase):
         self.assertTrue(self.output.at_eof())
 
 
+class SchedulerTestCase(BaseTestCase):
+    """
+    Tests for L{scheduler.WeightedScheduler} driving the encoder.
+    """
+
+    def setUp(self):
+        BaseTestCase.setUp(self)
+
+        self.frames = []
+        encode = self.encoder._encodeOneFrame
+
+        def record(channel):
+            self.frames.append(channel.channelId)
+
+            return encode(channel)
+
+        self.encoder._encodeOneFrame = record
+
+    def send(self, length, datatype, streamId=1):
+        """
+        Sends a message and returns the id of the channel it was given.
+        """
+        self.encoder.send('x' * length, datatype, streamId, 0)
+
+        return self.encoder.channelsInUse
+
+    def getFrames(self):
+        """
+        Returns the channel ids of the frames encoded since the last call.
+        """
+        frames, self.frames = self.frames, []
+
+        return frames
+
+    def test_classes(self):
+        self.assertEqual(scheduler.get_class(message.CONTROL),
+            scheduler.CONTROL)
+        self.assertEqual(scheduler.get_class(message.AUDIO_DATA),
+            scheduler.AUDIO)
+        self.assertEqual(scheduler.get_class(message.VIDEO_DATA),
+            scheduler.VIDEO)
+        self.assertEqual(scheduler.get_class(message.INVOKE), scheduler.DATA)
+        self.assertEqual(scheduler.get_class(message.NOTIFY), scheduler.DATA)
+
+    def test_weights(self):
+        data = self.send(128 * 10, message.INVOKE)
+        video = self.send(128 * 10, message.VIDEO_DATA)
+        audio = self.send(128 * 10, message.AUDIO_DATA)
+
+        self.encoder.next()
+
+        self.assertEqual(self.getFrames(),
+            [audio] * 4 + [video] * 2 + [data])
+
+    def test_stream_weight(self):
+        self.encoder.scheduler.setStreamWeight(2, 3)
+
+        a = self.send(128 * 10, message.INVOKE, 1)
+        b = self.send(128 * 10, message.INVOKE, 2)
+
+        self.encoder.next()
+
+        self.assertEqual(self.getFrames(), [a] + [b] * 3)
+
+    def test_fractional_weight(self):
+        self.encoder.scheduler.setStreamWeight(1, 0.5)
+
+        a = self.send(128 * 2, message.INVOKE, 1)
+
+        self.encoder.next()
+        self.assertEqual(self.getFrames(), [])
+
+        self.encoder.next()
+        self.assertEqual(self.getFrames(), [a])
+
+    def test_invalid_weight(self):
+        self.assertRaises(ValueError,
+            self.encoder.scheduler.setStreamWeight, 1, 0)
+
+        self.encoder.scheduler.setStreamWeight(1, 2)
+        self.encoder.scheduler.setStreamWeight(1, None)
+
+        self.assertEqual(self.encoder.scheduler.streamWeights, {})
+
+    def test_stats(self):
+        self.send(300, message.INVOKE)
+        self.send(100, message.AUDIO_DATA)
+
+        stats = self.encoder.getStats()
+
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['data'], {
+            'channels': 1, 'bytes': 300, 'framesSent': 0, 'bytesSent': 0})
+        self.assertEqual(stats['audio'], {
+            'channels': 1, 'bytes': 100, 'framesSent': 0, 'bytesSent': 0})
+
+        self.encoder.next()
+
+        stats = self.encoder.getStats()
+
+        self.assertEqual(stats['data'], {
+            'channels': 1, 'bytes': 172, 'framesSent': 1, 'bytesSent': 128})
+        self.assertEqual(stats['audio'], {
+            'channels': 0, 'bytes': 0, 'framesSent': 1, 'bytesSent': 100})
+
+
 class TimestampTestCase(BaseTestCase):
     """
     Tests to check for relative or absolute timestamps are encoded properly
@@ -291,3 +543,159 @@ class CommandTypeTestCase(BaseTestCase):
         self.assertEqual(self.output.getvalue(), '')
         self.encoder.send('eggs', message.INVOKE, 0, 21)
         self.assertEqual(self.output.getvalue(), '')
+
+
+class SequenceWriter(object):
+    """
+    Records the calls made to C{write} and C{writeSequence}.
+    """
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def writeSequence(self, seq):
+        self.writes.append(list(seq))
+
+    def getvalue(self):
+        return ''.join([x if isinstance(x, str) else ''.join(x)
+            for x in self.writes])
+
+
+class StreamingChannelTestCase(BaseTestCase):
+    """
+    Tests for L{codec.StreamingChannel}
+    """
+
+    def build(self, output, encoder=None):
+        encoder = encoder or self.encoder
+        s = codec.StreamingChannel(encoder.acquireChannel(), 1, output)
+        s.setType(message.VIDEO_DATA)
+
+        return s
+
+    def send(self, streamer, shared=False):
+        for data, timestamp in [('a' * 300, 0), ('b' * 10, 40), ('c' * 129, 80)]:
+            if shared:
+                streamer.sendData(data, timestamp, {})
+            else:
+                streamer.sendData(data, timestamp)
+
+    def test_shared_frames(self):
+        """
+        Relaying with a C{frames} cache must produce the same bytes as the
+        normal path.
+        """
+        expected = BufferedByteStream()
+        self.send(self.build(expected))
+
+        output = SequenceWriter()
+        self.send(self.build(output, codec.Encoder(None)), True)
+
+        self.assertEqual(output.getvalue(), expected.getvalue())
+
+    def test_split_once(self):
+        """
+        Subscribers sharing a C{frames} cache write the same body object.
+        """
+        first, second = SequenceWriter(), SequenceWriter()
+        frames = {}
+
+        self.build(first).sendData('a' * 300, 0, frames)
+        self.build(second, codec.Encoder(None)).sendData('a' * 300, 0, frames)
+
+        body = frames.values()[0]
+
+        self.assertEqual(len(frames), 1)
+        self.assertTrue(first.writes[0][1] is body)
+        self.assertTrue(second.writes[0][1] is body)
+        self.assertEqual(first.writes[0][0], second.writes[0][0])
+
+    def test_headers(self):
+        """
+        Each message header is encoded against the previous one, including
+        extended timestamps.
+        """
+        output = SequenceWriter()
+        s = self.build(output)
+        channelId = s.channel.channelId
+        previous = None
+        timestamp = 0
+
+        for data, delta in [('a' * 10, 0), ('b' * 10, 40), ('c' * 20, 40),
+                ('d' * 20, 40), ('e' * 20, 0x1000000), ('f' * 5, 0x1000000)]:
+            timestamp += delta
+            h = header.Header(channelId, delta, message.VIDEO_DATA, len(data),
+                1, previous is None)
+
+            s.sendData(data, timestamp, {})
+
+            self.assertEqual(output.writes[-1][0], header.pack(h, previous))
+            previous = h
+
+    def test_split_frames(self):
+        self.assertEqual(codec.split_frames('abc', 3, '-'), 'abc')
+        self.assertEqual(codec.split_frames('abcdefg', 3, '-'), 'abc-def-g')
+
+    def test_fragments(self):
+        """
+        Writing a message as fragments produces the same stream as writing
+        it whole, whatever the size of the fragments.
+        """
+        body = ''.join([chr(i % 256) for i in xrange(700)])
+
+        def whole(frameSize):
+            output = BufferedByteStream()
+            s = codec.StreamingChannel(codec.Encoder(None).acquireChannel(),
+                1, output)
+            s.setType(message.VIDEO_DATA)
+            s.channel.setFrameSize(frameSize)
+
+            s.sendData(body, 0)
+            s.sendData('foo', 40)
+
+            return output.getvalue()
+
+        def fragmented(frameSize, size):
+            output = SequenceWriter()
+            s = codec.StreamingChannel(codec.Encoder(None).acquireChannel(),
+                1, output)
+            s.setType(message.VIDEO_DATA)
+            s.channel.setFrameSize(frameSize)
+
+            for i in xrange(0, len(body), size):
+                marker = codec.FRAGMENT_CONTINUE
+
+                if i == 0:
+                    marker |= codec.FRAGMENT_START
+
+                if i + size >= len(body):
+                    marker |= codec.FRAGMENT_END
+
+                s.sendFragment(body[i:i + size], 0, marker, len(body))
+
+            s.sendFragment('foo', 40, codec.FRAGMENT_START |
+                codec.FRAGMENT_END, 3)
+
+            # only whole frames are written until the end of the message.
+            # Each write is a list of alternating headers and frame bodies
+            for seq in output.writes[:-2]:
+                for frame in seq[1::2]:
+                    self.assertEqual(len(frame), frameSize)
+
+            return output.getvalue()
+
+        for frameSize in (128, 4096):
+            expected = whole(frameSize)
+
+            for size in (1, 50, 128, 300, 700):
+                self.assertEqual(fragmented(frameSize, size), expected)
+
+    def test_fragment_without_start(self):
+        s = codec.StreamingChannel(self.encoder.acquireChannel(), 1,
+            SequenceWriter())
+
+        self.assertRaises(codec.EncodeError, s.sendFragment, 'foo', 0,
+            codec.FRAGMENT_END, 3)
@@ -20,6 +20,7 @@ Tests for L{rtmpy.protocol.handshake}.
 import unittest
 
 from rtmpy.protocol import handshake
+from rtmpy.protocol.rtmp import handshake as rtmp_handshake
 from rtmpy.util import BufferedByteStream
 
 
@@ -357,3 +358,45 @@ class ServerClientAckTestCase(ServerNegotiatorTestCase):
 
         self.negotiator.dataReceived(payload)
         self.assertTrue(self.succeeded)
+
+
+class Peer(object):
+    """
+    One end of a handshake between two real negotiators.
+    """
+
+    def __init__(self):
+        self.written = []
+        self.succeeded = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def handshakeSuccess(self, data):
+        self.succeeded = True
+
+
+class NegotiationTestCase(unittest.TestCase):
+    """
+    The RTMP client negotiator and the server negotiator complete a
+    handshake with each other.
+    """
+
+    def test_handshake(self):
+        client, server = Peer(), Peer()
+
+        c = rtmp_handshake.ClientNegotiator(client, client)
+        s = handshake.ServerNegotiator(server, server)
+
+        c.start(0, 0)
+        s.start(0, 0)
+
+        while client.written or server.written:
+            data, client.written = ''.join(client.written), []
+            s.dataReceived(data)
+
+            data, server.written = ''.join(server.written), []
+            c.dataReceived(data)
+
+        self.assertTrue(client.succeeded)
+        self.assertTrue(server.succeeded)
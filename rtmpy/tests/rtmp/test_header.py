@@ -59,9 +59,11 @@ class HeaderTestCase(unittest.TestCase):
     def test_repr(self):
         h = header.Header(3)
 
-        self.assertEquals(repr(h), '<rtmpy.protocol.rtmp.header.Header '
+        # the compiled Header lives in rtmpy._speedups.header
+        self.assertEquals(repr(h), '<%s.Header '
             'streamId=None datatype=None timestamp=None bodyLength=None '
-            'channelId=3 full=False continuation=False at 0x%x>' % (id(h),))
+            'channelId=3 full=False continuation=False at 0x%x>' % (
+                header.Header.__module__, id(h)))
 
         d = {
             'channelId': 1,
@@ -73,9 +75,10 @@ class HeaderTestCase(unittest.TestCase):
 
         h = header.Header(**d)
 
-        self.assertEquals(repr(h), '<rtmpy.protocol.rtmp.header.Header '
+        self.assertEquals(repr(h), '<%s.Header '
             'streamId=98 datatype=20 timestamp=50 bodyLength=2000 channelId=1 '
-            'full=False continuation=False at 0x%x>' % (id(h),))
+            'full=False continuation=False at 0x%x>' % (
+                header.Header.__module__, id(h)))
 
 
 class EncodeTestCase(unittest.TestCase):
@@ -269,6 +272,74 @@ class DecodeTestCase(unittest.TestCase):
         self.assertEqual(h.channelId, 65597)
 
 
+class UnpackTestCase(unittest.TestCase):
+    """
+    Tests for L{header.unpack_from}
+    """
+
+    def test_empty(self):
+        self.assertEqual(header.unpack_from(''), None)
+
+    def test_offset(self):
+        h, length = header.unpack_from('foo\x95\x03\x92\xfa', 3)
+
+        self.assertEqual(length, 4)
+        self.assertEqual(h.channelId, 19)
+        self.assertEqual(h.timestamp, 234234)
+
+    def test_incomplete(self):
+        """
+        C{None} is returned for every truncation of a complete header.
+        """
+        full = '"\xff\xff\xff\x00z\n\x03-\x00\x00\x00\x01\x00\x00\x00'
+
+        for i in xrange(len(full)):
+            self.assertEqual(header.unpack_from(full[:i]), None)
+
+        h, length = header.unpack_from(full)
+
+        self.assertEqual(length, len(full))
+        self.assertEqual(h.timestamp, 0x1000000)
+        self.assertEqual(h.streamId, 45)
+        self.assertTrue(h.full)
+
+        self.assertEqual(header.unpack_from('\xc1\x00'), None)
+
+    def test_decode_incomplete(self):
+        """
+        L{header.decode} leaves the stream untouched if it cannot decode.
+        """
+        stream = util.BufferedByteStream('U\x03\x92\xfa\x00z\n')
+
+        self.assertRaises(IOError, header.decode, stream)
+        self.assertEqual(stream.tell(), 0)
+
+    def test_round_trip(self):
+        headers = [
+            header.Header(3, 10, 8, 500, 1),
+            header.Header(400, 0x1000000, 9, 2000, 0xfffe),
+            header.Header(70, 0xffffff, 20, 0, 3),
+        ]
+
+        for h in headers:
+            bytes = header.pack(h)
+            d, length = header.unpack_from(bytes)
+
+            self.assertEqual(length, len(bytes))
+
+            for k in ('channelId', 'timestamp', 'datatype', 'bodyLength',
+                    'streamId'):
+                self.assertEqual(getattr(d, k), getattr(h, k))
+
+    def test_header_length(self):
+        self.assertEqual(header.get_header_length(0x03), 12)
+        self.assertEqual(header.get_header_length(0x43), 8)
+        self.assertEqual(header.get_header_length(0x83), 4)
+        self.assertEqual(header.get_header_length(0xc3), 1)
+        self.assertEqual(header.get_header_length(0xc0), 2)
+        self.assertEqual(header.get_header_length(0x01), 14)
+
+
 class MergeTestCase(unittest.TestCase):
     """
     Tests for L{header.merge}
@@ -325,3 +396,98 @@ class MergeTestCase(unittest.TestCase):
 
         h = self.merge(streamId=15)
         self.assertEqual(h.streamId, 15)
+
+    def test_flags(self):
+        h = self.merge(full=True, continuation=True)
+
+        self.assertFalse(h.full)
+        self.assertFalse(h.continuation)
+
+    def test_copy(self):
+        """
+        L{header.merge} leaves both headers untouched.
+        """
+        h = self.merge(timestamp=999)
+
+        self.assertNotIdentical(h, self.absolute)
+        self.assertEqual(self.absolute.timestamp, 1000)
+
+
+class InPlaceMergeTestCase(unittest.TestCase):
+    """
+    Tests for L{header.Header.merge}
+    """
+
+    def setUp(self):
+        self.absolute = header.Header(3, timestamp=1000,
+            bodyLength=2000, datatype=3, streamId=243, full=True)
+
+    def test_different_channels(self):
+        self.assertRaises(header.HeaderError, self.absolute.merge,
+            header.Header(4))
+
+    def test_continuation(self):
+        self.absolute.merge(header.Header(3, continuation=True))
+
+        self.assertEqual(self.absolute.timestamp, 1000)
+        self.assertEqual(self.absolute.bodyLength, 2000)
+        self.assertEqual(self.absolute.datatype, 3)
+        self.assertEqual(self.absolute.streamId, 243)
+        self.assertFalse(self.absolute.full)
+        self.assertFalse(self.absolute.continuation)
+
+    def test_relative(self):
+        self.absolute.merge(header.Header(3, timestamp=10, bodyLength=5,
+            datatype=9))
+
+        self.assertEqual(self.absolute.timestamp, 10)
+        self.assertEqual(self.absolute.bodyLength, 5)
+        self.assertEqual(self.absolute.datatype, 9)
+        self.assertEqual(self.absolute.streamId, 243)
+
+    def test_copy(self):
+        h = self.absolute.copy()
+
+        self.assertNotIdentical(h, self.absolute)
+
+        for k in header.Header.__slots__:
+            self.assertEqual(getattr(h, k), getattr(self.absolute, k))
+
+
+class TemplateTestCase(unittest.TestCase):
+    """
+    Tests for L{header.HeaderTemplate}
+    """
+
+    def test_relative(self):
+        for channelId in (3, 100, 400):
+            t = header.HeaderTemplate(channelId)
+            previous = header.Header(channelId, 0, 8, 5, 1)
+
+            for timestamp in (0, 40, 0xfffffe, 0xffffff, 0x1000000):
+                h = header.Header(channelId, timestamp, 9, 0x12345, 1)
+
+                self.assertEqual(t.relative(timestamp, 9, 0x12345),
+                    header.pack(h, previous))
+
+    def test_delta(self):
+        for channelId in (3, 100, 400):
+            t = header.HeaderTemplate(channelId)
+            previous = header.Header(channelId, 0, 9, 500, 1)
+
+            for timestamp in (1, 40, 0xfffffe, 0xffffff, 0x1000000):
+                h = header.Header(channelId, timestamp, 9, 500, 1)
+
+                self.assertEqual(t.delta(timestamp), header.pack(h, previous))
+
+    def test_continuation(self):
+        h = header.Header(400)
+
+        self.assertEqual(header.HeaderTemplate(400).continuation,
+            header.pack(h, h))
+
+    def test_shared(self):
+        t = header.get_template(5)
+
+        self.assertTrue(header.get_template(5) is t)
+        self.assertFalse(header.get_template(6) is t)
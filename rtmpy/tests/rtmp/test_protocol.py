@@ -20,10 +20,12 @@ Tests for L{rtmpy.protocol.rtmp}
 """
 
 from twisted.trial import unittest
-from twisted.internet import error, defer, reactor
-from twisted.test.proto_helpers import StringTransportWithDisconnection
+from twisted.internet import error, defer, reactor, task
+from twisted.test.proto_helpers import StringTransportWithDisconnection, \
+    StringTransport
 
 from rtmpy.protocol import rtmp
+from rtmpy.protocol.rtmp import codec
 from rtmpy import message, core, exc, util
 
 
@@ -277,6 +279,207 @@ class DataReceivedTestCase(ProtocolTestCase):
 
         self.protocol.decoder_task.addErrback(lambda x: None)
 
+    def test_running_task(self):
+        """
+        A running decode task will pick up any newly received data.
+        """
+        self.connect()
+        self.protocol.handshakeSuccess('')
+
+        self.protocol.dataReceived('woot')
+        task = self.protocol.decoder_task
+
+        self.protocol.dataReceived('foo')
+        self.assertIdentical(self.protocol.decoder_task, task)
+
+        task.addErrback(lambda x: None)
+
+
+
+class BatchDecodeTestCase(ProtocolTestCase):
+    """
+    Tests for L{rtmp.BaseStreamer.batchDecode}
+    """
+
+    frameSize = ('\x03\x00\x00\x00\x00\x00\x04\x01\x00\x00\x00\x00'
+        '\x00\x00\x00\x32')
+
+    def setUp(self):
+        ProtocolTestCase.setUp(self)
+
+        self.connect()
+        self.protocol.handshakeSuccess('')
+        self.protocol.batchDecode = True
+
+        self.decoder = self.protocol.decoder
+
+    def test_drain(self):
+        """
+        All buffered messages are decoded without scheduling a task.
+        """
+        self.protocol.dataReceived(self.frameSize * 2)
+
+        self.assertEqual(self.protocol.decoder_task, None)
+        self.assertEqual(self.decoder.frameSize, 50)
+        self.assertEqual(self.decoder.stream.getvalue(), '')
+
+    def test_budget(self):
+        """
+        Exceeding the budget hands the rest of the decoding to a task.
+        """
+        self.protocol.decodeByteBudget = 16
+
+        self.protocol.dataReceived(self.frameSize * 2)
+
+        self.assertNotEqual(self.protocol.decoder_task, None)
+        self.assertEqual(self.decoder.bytes, 16)
+
+        return self.protocol.decoder_task
+
+
+class ChannelLimitTestCase(ProtocolTestCase):
+    """
+    Tests for L{rtmp.BaseStreamer.maxChannels}
+    """
+
+    def test_decoder(self):
+        self.protocol.maxChannels = 5
+
+        self.connect()
+        self.protocol.handshakeSuccess('')
+
+        self.assertEqual(self.protocol.decoder.maxChannels, 5)
+
+
+
+class AudioStream(object):
+    """
+    Records the audio data dispatched to it.
+    """
+
+    def __init__(self):
+        self.audio = []
+
+    def onAudioData(self, data, timestamp):
+        self.audio.append((data, timestamp))
+
+
+
+class FragmentTestCase(ProtocolTestCase):
+    """
+    Tests for L{rtmp.BaseStreamer.streamFragments}
+    """
+
+    def test_decoder(self):
+        self.protocol.streamFragments = True
+
+        self.connect()
+        self.protocol.handshakeSuccess('')
+
+        self.assertEqual(self.protocol.decoder.streamingTypes,
+            (message.AUDIO_DATA, message.VIDEO_DATA))
+
+    def test_default(self):
+        self.connect()
+        self.protocol.handshakeSuccess('')
+
+        self.assertEqual(self.protocol.decoder.streamingTypes, ())
+
+    def test_reassemble(self):
+        """
+        Streams without C{onFragment} receive whole messages.
+        """
+        stream = AudioStream()
+        dispatcher = rtmp.MessageDispatcher(None)
+
+        dispatcher.dispatchFragment(stream, message.AUDIO_DATA, 10, 'foo',
+            codec.FRAGMENT_START, 6)
+        self.assertEqual(stream.audio, [])
+
+        dispatcher.dispatchFragment(stream, message.AUDIO_DATA, 10, 'bar',
+            codec.FRAGMENT_END, 6)
+        self.assertEqual(stream.audio, [('foobar', 10)])
+
+
+
+class WriteAggregatorTestCase(unittest.TestCase):
+    """
+    Tests for L{rtmp.WriteAggregator}
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.transport = StringTransport()
+        self.writes = []
+
+        self.patch(self.transport, 'writeSequence', self.writes.append)
+
+        self.aggregator = rtmp.WriteAggregator(self.transport, 0.05, 10,
+            clock=self.clock)
+
+    def test_delay(self):
+        self.aggregator.write('foo')
+        self.aggregator.writeSequence(['bar', 'baz'])
+
+        self.assertEqual(self.writes, [])
+
+        self.clock.advance(0.05)
+
+        self.assertEqual(self.writes, [['foo', 'bar', 'baz']])
+        self.assertEqual(self.aggregator.size, 0)
+
+    def test_size(self):
+        """
+        Reaching C{maxBytes} flushes immediately.
+        """
+        self.aggregator.write('foo')
+        self.aggregator.write('x' * 7)
+
+        self.assertEqual(self.writes, [['foo', 'x' * 7]])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_empty(self):
+        self.aggregator.write('')
+        self.aggregator.flush()
+
+        self.assertEqual(self.writes, [])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+
+class CoalesceWritesTestCase(ProtocolTestCase):
+    """
+    Tests for L{rtmp.BaseStreamer.coalesceWrites}
+    """
+
+    def test_default(self):
+        self.connect()
+        self.protocol.handshakeSuccess('')
+
+        self.assertIdentical(self.protocol.writer, self.transport)
+        self.assertIdentical(self.protocol.encoder.output, self.transport)
+
+    def test_coalesce(self):
+        self.protocol.coalesceWrites = True
+        self.protocol.writeDelay = 0.01
+
+        self.connect()
+        self.protocol.handshakeSuccess('')
+
+        writer = self.protocol.writer
+
+        self.assertTrue(isinstance(writer, rtmp.WriteAggregator))
+        self.assertIdentical(writer.transport, self.transport)
+        self.assertEqual(writer.maxDelay, 0.01)
+        self.assertIdentical(self.protocol.encoder.output, writer)
+
+        writer.clock = task.Clock()
+        writer.write('foo')
+
+        self.protocol.connectionLost(None)
+
+        self.assertEqual(self.transport.value(), 'foo')
+
 
 
 class BasicResponseTestCase(ProtocolTestCase):
@@ -0,0 +1,124 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.scripts.bench}.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from rtmpy import server
+from rtmpy.scripts import bench
+from rtmpy.tests import test_client
+
+
+
+class PayloadTestCase(unittest.TestCase):
+    """
+    Tests for the generated a/v payloads.
+    """
+
+    def test_video(self):
+        key = bench.make_video(3, True, 100, 1234.5)
+        inter = bench.make_video(4, False, 100, 1234.5)
+
+        self.assertEqual(len(key), 100)
+        self.assertEqual(key[:2], '\x17\x01')
+        self.assertEqual(inter[:2], '\x27\x01')
+        self.assertEqual(bench.read_stamp(key), (1234.5, 3))
+        self.assertEqual(bench.read_stamp(inter), (1234.5, 4))
+
+
+    def test_audio(self):
+        data = bench.make_audio(7, 64, 1234.5)
+
+        self.assertEqual(len(data), 64)
+        self.assertEqual(bench.read_stamp(data), (1234.5, 7))
+
+
+    def test_sequence_headers(self):
+        self.assertEqual(bench.read_stamp(bench.VIDEO_SEQUENCE_HEADER), None)
+        self.assertEqual(bench.read_stamp(bench.AUDIO_SEQUENCE_HEADER), None)
+
+
+
+class LatencyTestCase(unittest.TestCase):
+    """
+    Tests for L{bench.summarise_latency}
+    """
+
+    def test_percentile(self):
+        values = range(1, 101)
+
+        self.assertEqual(bench.percentile(values, 50), 50)
+        self.assertEqual(bench.percentile(values, 99), 99)
+        self.assertEqual(bench.percentile(values, 100), 100)
+        self.assertEqual(bench.percentile([], 50), None)
+
+
+    def test_summary(self):
+        ret = bench.summarise_latency([0.5, 3.0, 1.5, 3000.0])
+
+        self.assertEqual(ret['samples'], 4)
+        self.assertEqual(ret['min'], 0.5)
+        self.assertEqual(ret['max'], 3000.0)
+        self.assertEqual(ret['histogram'][:3],
+            [['<=1', 1], ['<=2', 1], ['<=5', 1]])
+        self.assertEqual(ret['histogram'][-1], ['>2000', 1])
+
+
+    def test_empty(self):
+        ret = bench.summarise_latency([])
+
+        self.assertEqual(ret['samples'], 0)
+        self.assertFalse('p50' in ret)
+
+
+
+class LoadTestTestCase(unittest.TestCase):
+    """
+    Runs a short load test against an in-process server.
+    """
+
+    def setUp(self):
+        from twisted.internet import reactor
+
+        self.factory = test_client.ServerFactory({'live': server.Application()})
+        self.port = reactor.listenTCP(0, self.factory, interface='127.0.0.1')
+
+
+    def tearDown(self):
+        return defer.DeferredList([self.factory.whenDisconnected(),
+            defer.maybeDeferred(self.port.stopListening)])
+
+
+    def test_run(self):
+        url = 'rtmp://127.0.0.1:%d/live' % (self.port.getHost().port,)
+
+        test = bench.LoadTest(url, publishers=1, subscribers=2, duration=0.3,
+            warmup=0.1, videoBytes=512, audioBytes=64)
+
+        def cb(result):
+            self.assertEqual(result['connections'], {'publishers': 1,
+                'publishing': 1, 'subscribers': 2, 'failed': 0})
+            self.assertTrue(result['sent']['messages'] > 0)
+            self.assertTrue(result['received']['messages'] > 0)
+            self.assertTrue(result['latency']['samples'] > 0)
+            self.assertTrue('cpu' in result['client'])
+
+            return test.close()
+
+        return test.run().addCallback(cb)
@@ -0,0 +1,514 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.client}.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor, error
+
+from rtmpy import client, server, exc, status, message
+
+
+
+class ParseURLTestCase(unittest.TestCase):
+    """
+    Tests for L{client.parse_url}
+    """
+
+    def test_default_port(self):
+        self.assertEqual(client.parse_url('rtmp://localhost/live'),
+            ('localhost', 1935, 'live'))
+
+
+    def test_port(self):
+        self.assertEqual(client.parse_url('rtmp://localhost:1936/live/inst'),
+            ('localhost', 1936, 'live/inst'))
+
+
+    def test_scheme(self):
+        self.assertRaises(ValueError, client.parse_url, 'http://localhost/')
+
+
+
+class MockStreamingChannel(object):
+    """
+    Records the a/v data sent by a L{client.NetStream}.
+    """
+
+    def __init__(self, sent):
+        self.sent = sent
+
+
+    def setType(self, type):
+        self.type = type
+
+
+    def sendData(self, data, timestamp):
+        self.sent.append((self.type, data, timestamp))
+
+
+
+class MockNetConnection(object):
+    """
+    Records the messages sent by a L{client.NetStream}.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.calls = []
+        self.sent = []
+
+
+    def sendMessage(self, msg, stream=None, whenDone=None):
+        self.messages.append(msg)
+
+
+    def call(self, name, *args):
+        self.calls.append((name,) + args)
+
+
+    def getStreamingChannel(self, stream):
+        return MockStreamingChannel(self.sent)
+
+
+
+class Listener(object):
+    """
+    Records the events of a stream played by a L{client.NetStream}.
+    """
+
+    def __init__(self):
+        self.events = []
+
+
+    def videoDataReceived(self, data, timestamp):
+        self.events.append(('video', data, timestamp))
+
+
+    def audioDataReceived(self, data, timestamp):
+        self.events.append(('audio', data, timestamp))
+
+
+    def onMetaData(self, data):
+        self.events.append(('meta', data))
+
+
+    def unpublish(self):
+        self.events.append('unpublish')
+
+
+
+class NetStreamTestCase(unittest.TestCase):
+    """
+    Tests for L{client.NetStream}
+    """
+
+    def setUp(self):
+        self.nc = MockNetConnection()
+        self.stream = client.NetStream(self.nc, 1)
+        self.listener = self.stream.listener = Listener()
+
+
+    def test_play(self):
+        d = self.stream.play('foo', -1)
+
+        msg, = self.nc.messages
+
+        self.assertEqual(msg.name, 'play')
+        self.assertEqual(msg.argv, [None, 'foo', -1])
+        self.assertFalse(d.called)
+
+        self.stream.onStatus(status.status('NetStream.Play.Start', ''))
+
+        self.assertEqual(self.stream.state, 'playing')
+
+        return d.addCallback(self.assertIdentical, self.stream)
+
+
+    def test_play_failed(self):
+        d = self.stream.play('foo')
+
+        self.stream.onStatus(status.error('NetStream.Play.StreamNotFound',
+            'Unknown stream'))
+
+        return self.assertFailure(d, exc.StreamNotFound)
+
+
+    def test_data(self):
+        self.stream.onVideoData('\x17\x01', 10)
+        self.stream.onAudioData('\xaf\x01', 20)
+        self.stream.onMetaData({'width': 320})
+
+        self.assertEqual(self.listener.events, [('video', '\x17\x01', 10),
+            ('audio', '\xaf\x01', 20), ('meta', {'width': 320})])
+
+
+    def test_unpublish(self):
+        self.stream.play('foo')
+        self.stream.onStatus(status.status('NetStream.Play.Start', ''))
+        self.stream.onStatus(status.status('NetStream.Play.UnpublishNotify',
+            ''))
+
+        self.assertEqual(self.listener.events, ['unpublish'])
+        self.assertEqual(self.stream.state, None)
+
+
+    def test_close_pending(self):
+        d = self.stream.play('foo')
+
+        self.stream.closeStream()
+
+        self.assertEqual(self.listener.events, [])
+
+        return self.assertFailure(d, error.ConnectionDone)
+
+
+    def test_publish(self):
+        d = self.stream.publish('foo')
+
+        msg, = self.nc.messages
+
+        self.assertEqual(msg.name, 'publish')
+        self.assertEqual(msg.argv, [None, 'foo', 'live'])
+
+        self.stream.onStatus(status.status('NetStream.Publish.Start', ''))
+
+        self.assertEqual(self.stream.state, 'publishing')
+
+        return d.addCallback(self.assertIdentical, self.stream)
+
+
+    def test_publish_bad_name(self):
+        d = self.stream.publish('foo')
+
+        self.stream.onStatus(status.error('NetStream.Publish.BadName',
+            'foo is already used'))
+
+        return self.assertFailure(d, exc.BadNameError)
+
+
+    def test_send(self):
+        self.stream.sendVideo('\x17\x01', 0)
+        self.stream.sendAudio('\xaf\x01', 10)
+        self.stream.sendVideo('\x27\x01', 40)
+
+        self.assertEqual(self.nc.sent, [(message.VIDEO_DATA, '\x17\x01', 0),
+            (message.AUDIO_DATA, '\xaf\x01', 10),
+            (message.VIDEO_DATA, '\x27\x01', 40)])
+
+
+    def test_meta_data(self):
+        self.stream.setMetaData({'width': 320})
+
+        msg, = self.nc.messages
+
+        self.assertEqual(msg.name, '@setDataFrame')
+        self.assertEqual(msg.argv, [None, 'onMetaData', {'width': 320}])
+
+
+    def test_close(self):
+        self.stream.play('foo')
+        self.stream.onStatus(status.status('NetStream.Play.Start', ''))
+
+        self.stream.close()
+
+        self.assertEqual(self.nc.messages[-1].name, 'closeStream')
+        self.assertEqual(self.nc.calls, [('deleteStream', 1)])
+        self.assertEqual(self.listener.events, ['unpublish'])
+        self.assertEqual(self.stream.state, None)
+
+
+
+class NotifyingServerProtocol(server.ServerProtocol):
+    """
+    Tells the factory when the connection has been closed.
+    """
+
+    def connectionLost(self, reason):
+        server.ServerProtocol.connectionLost(self, reason)
+
+        self.factory.lost.append(self)
+
+        waiting, self.factory.waiting = self.factory.waiting, []
+
+        for d in waiting:
+            d.callback(None)
+
+
+
+class ServerFactory(server.ServerFactory):
+    protocol = NotifyingServerProtocol
+
+    def __init__(self, applications):
+        server.ServerFactory.__init__(self, applications)
+
+        self.connections = []
+        self.lost = []
+        self.waiting = []
+
+
+    def buildProtocol(self, addr):
+        p = server.ServerFactory.buildProtocol(self, addr)
+
+        self.connections.append(p)
+
+        return p
+
+
+    def whenDisconnected(self):
+        """
+        Fires once all the connections to this factory have been closed.
+        """
+        if len(self.lost) == len(self.connections):
+            return defer.succeed(None)
+
+        d = defer.Deferred()
+
+        self.waiting.append(d)
+
+        return d.addCallback(lambda _: self.whenDisconnected())
+
+
+
+class LoopbackTestCase(unittest.TestCase):
+    """
+    Connects a client to a server listening on the loopback interface.
+    """
+
+    def listen(self, app):
+        f = ServerFactory({'live': app})
+
+        port = reactor.listenTCP(0, f, interface='127.0.0.1')
+
+        self.factories.append(f)
+        self.ports.append(port)
+
+        return 'rtmp://127.0.0.1:%d/live' % (port.getHost().port,)
+
+
+    def setUp(self):
+        self.factories = []
+        self.ports = []
+        self.connections = []
+
+        self.app = server.Application()
+        self.url = self.listen(self.app)
+
+
+    def tearDown(self):
+        for nc in self.connections:
+            nc.close()
+
+        dl = [f.whenDisconnected() for f in self.factories]
+        dl.extend([defer.maybeDeferred(p.stopListening) for p in self.ports])
+
+        return defer.DeferredList(dl)
+
+
+    def connect(self, url=None):
+        d = client.connect(url or self.url)
+
+        def cb(nc):
+            self.connections.append(nc)
+
+            return nc
+
+        return d.addCallback(cb)
+
+
+    def publish(self, app, name='foo'):
+        c = server.Client(None)
+        c.id = 'publisher'
+
+        return app.publishStream(c, None, name)
+
+
+    def play(self, url=None, name='foo'):
+        listener = Listener()
+
+        def play(stream):
+            stream.listener = listener
+
+            return stream.play(name)
+
+        d = self.connect(url)
+
+        d.addCallback(lambda nc: nc.createStream())
+        d.addCallback(play)
+
+        return d.addCallback(lambda stream: listener)
+
+
+    def whenReceived(self, listener, count):
+        """
+        Fires once C{listener} has received C{count} events.
+        """
+        d = defer.Deferred()
+
+        def check():
+            if len(listener.events) >= count:
+                d.callback(listener)
+            else:
+                reactor.callLater(0.01, check)
+
+        check()
+
+        return d
+
+
+    def test_connect(self):
+        def cb(nc):
+            self.assertTrue(nc.connected)
+            self.assertEqual(nc.status.code, 'NetConnection.Connect.Success')
+            self.assertEqual(len(self.app.clients), 1)
+
+        return self.connect().addCallback(cb)
+
+
+    def test_unknown_application(self):
+        d = self.connect(self.url + 'foo')
+
+        return self.assertFailure(d, exc.InvalidApplication)
+
+
+    def test_play(self):
+        publisher = self.publish(self.app)
+
+        def cb(listener):
+            publisher.videoDataReceived('\x17\x01key', 40)
+            publisher.audioDataReceived('\xaf\x01aac', 80)
+
+            return self.whenReceived(listener, 2)
+
+        def check(listener):
+            self.assertEqual(listener.events, [('video', '\x17\x01key', 40),
+                ('audio', '\xaf\x01aac', 80)])
+
+        return self.play().addCallback(cb).addCallback(check)
+
+
+    def test_origin_pull(self):
+        """
+        Streams played from an edge server are pulled from the origin over
+        one connection.
+        """
+        edge = server.Application()
+        edge.origin = self.url
+        edgeURL = self.listen(edge)
+
+        publisher = self.publish(self.app)
+
+        def cb(listeners):
+            listeners = [l for ok, l in listeners]
+
+            self.assertEqual(len(self.factories[0].connections), 1)
+            self.assertEqual(len(publisher.subscribers), 1)
+
+            publisher.videoDataReceived('\x17\x01key', 40)
+
+            return defer.DeferredList([self.whenReceived(l, 1)
+                for l in listeners])
+
+        def check(listeners):
+            for ok, listener in listeners:
+                self.assertEqual(listener.events,
+                    [('video', '\x17\x01key', 40)])
+
+        d = self.play(edgeURL)
+
+        # the second subscriber shares the first one's connection
+        d.addCallback(lambda l: defer.DeferredList([defer.succeed(l),
+            self.play(edgeURL)]))
+        d.addCallback(cb)
+        d.addCallback(check)
+
+        return d
+
+
+    def test_publish(self):
+        def publish(nc):
+            d = nc.createStream()
+
+            return d.addCallback(lambda stream: stream.publish('foo'))
+
+        def play(publisher):
+            self.assertTrue('foo' in self.app.streams)
+
+            return self.play().addCallback(send, publisher)
+
+        def send(listener, publisher):
+            publisher.setMetaData({'width': 320})
+            publisher.sendVideo('\x17\x01key', 0)
+            publisher.sendVideo('\x27\x01inter', 40)
+
+            return self.whenReceived(listener, 3)
+
+        def check(listener):
+            self.assertEqual(sorted(listener.events), [
+                ('meta', {'width': 320}),
+                ('video', '\x17\x01key', 0),
+                ('video', "'\x01inter", 40)])
+
+        d = self.connect()
+
+        d.addCallback(publish)
+        d.addCallback(play)
+        d.addCallback(check)
+
+        return d
+
+
+    def test_pool(self):
+        pool = client.ConnectionPool(self.url, 3)
+        pool.maxConnecting = 2
+
+        def cb(res):
+            self.assertTrue(res is pool)
+            self.assertEqual(len(pool.connections), 3)
+            self.assertEqual(pool.failures, [])
+            self.assertEqual(len(self.app.clients), 3)
+
+            return pool.map(lambda nc: nc.createStream())
+
+        def check(results):
+            self.assertEqual([ok for ok, stream in results], [True] * 3)
+
+            return pool.close()
+
+        def closed(res):
+            self.assertEqual(pool.connections, [])
+
+            return self.factories[0].whenDisconnected()
+
+        d = pool.start()
+
+        d.addCallback(cb)
+        d.addCallback(check)
+        d.addCallback(closed)
+
+        return d
+
+
+    def test_pool_failures(self):
+        pool = client.ConnectionPool(self.url + 'foo', 2)
+
+        def cb(res):
+            self.assertEqual(pool.connections, [])
+            self.assertEqual(len(pool.failures), 2)
+            self.assertTrue(pool.failures[0].check(exc.InvalidApplication))
+
+        return pool.start().addCallback(cb)
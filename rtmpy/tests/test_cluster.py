@@ -0,0 +1,577 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.cluster}.
+"""
+
+import socket
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.python import failure
+from twisted.test.proto_helpers import StringTransport
+
+from rtmpy import cluster, server, exc
+
+
+KEYFRAME = '\x17\x01'
+INTERFRAME = '\x27\x01'
+
+
+
+def result_of(d):
+    """
+    Returns the result of a L{defer.Deferred} that has already fired.
+    """
+    results = []
+
+    d.addBoth(results.append)
+
+    return results[0]
+
+
+
+class Owner(object):
+    """
+    Records the streams it is told have been published.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def published(self, app, name, address):
+        self.events.append((app, name, address))
+
+
+
+class StreamRegistryTestCase(unittest.TestCase):
+    """
+    Tests for L{cluster.StreamRegistry}
+    """
+
+    def setUp(self):
+        self.registry = cluster.StreamRegistry()
+        self.first = Owner()
+        self.second = Owner()
+
+    def test_register(self):
+        self.registry.register(self.first, 'app', 'foo', '/a')
+
+        self.assertEqual(self.registry.streams, {('app', 'foo'): ('/a',
+            self.first)})
+
+        # registering again from the same worker is allowed
+        self.registry.register(self.first, 'app', 'foo', '/a')
+
+        self.assertRaises(exc.BadNameError, self.registry.register,
+            self.second, 'app', 'foo', '/b')
+
+        self.registry.register(self.second, 'other', 'foo', '/b')
+
+    def test_unregister(self):
+        self.registry.register(self.first, 'app', 'foo', '/a')
+
+        # only the publishing worker can unregister
+        self.registry.unregister(self.second, 'app', 'foo', '/b')
+        self.assertTrue(('app', 'foo') in self.registry.streams)
+
+        self.registry.unregister(self.first, 'app', 'foo', '/a')
+        self.assertEqual(self.registry.streams, {})
+
+    def test_watch_published(self):
+        self.registry.register(self.first, 'app', 'foo', '/a')
+
+        self.assertEqual(self.registry.watch(self.second, 'app', 'foo', '/b'),
+            '/a')
+        self.assertEqual(self.registry.watchers, {})
+
+    def test_watch(self):
+        self.assertEqual(self.registry.watch(self.second, 'app', 'foo', '/b'),
+            None)
+        self.assertEqual(self.registry.watch(self.first, 'app', 'foo', '/a'),
+            None)
+
+        self.registry.register(self.first, 'app', 'foo', '/a')
+
+        # the publishing worker is not told about its own stream
+        self.assertEqual(self.first.events, [])
+        self.assertEqual(self.second.events, [('app', 'foo', '/a')])
+        self.assertEqual(self.registry.watchers, {})
+
+    def test_remove_owner(self):
+        self.registry.register(self.first, 'app', 'foo', '/a')
+        self.registry.watch(self.first, 'app', 'bar', '/a')
+        self.registry.watch(self.second, 'app', 'bar', '/b')
+
+        self.registry.removeOwner(self.first)
+
+        self.assertEqual(self.registry.streams, {})
+        self.assertEqual(self.registry.watchers, {('app', 'bar'): {
+            self.second: '/b'}})
+
+
+
+class FakeAMP(object):
+    """
+    Answers the commands sent to the registry from a L{cluster.StreamRegistry}.
+    """
+
+    def __init__(self, registry, owner):
+        self.registry = registry
+        self.owner = owner
+        self.commands = []
+
+    def callRemote(self, command, **kwargs):
+        self.commands.append((command, kwargs))
+        args = (self.owner, kwargs['app'], kwargs['name'], kwargs['address'])
+
+        if command is cluster.Register:
+            return defer.maybeDeferred(self.registry.register, *args)
+
+        if command is cluster.Unregister:
+            return self.registry.unregister(*args)
+
+        address = self.registry.watch(*args)
+
+        if address is None:
+            return defer.succeed({})
+
+        return defer.succeed({'address': address})
+
+
+
+class Connector(object):
+    """
+    Records the relay connections made by a L{cluster.ClusterRegistry}.
+    """
+
+    def __init__(self):
+        self.connections = []
+
+    def connectUNIX(self, address, factory):
+        self.connections.append((address, factory))
+
+
+
+class ClusterRegistryTestCase(unittest.TestCase):
+    """
+    Tests for L{cluster.ClusterRegistry}
+    """
+
+    def setUp(self):
+        self.registry = cluster.StreamRegistry()
+        self.reactor = Connector()
+
+        self.app = server.Application()
+        self.app.name = 'app'
+
+        self.first = self.build('/a')
+        self.second = self.build('/b')
+
+    def build(self, address):
+        r = cluster.ClusterRegistry(address, self.reactor)
+        r.protocol = FakeAMP(self.registry, r)
+
+        return r
+
+    def test_not_connected(self):
+        r = cluster.ClusterRegistry('/a', self.reactor)
+
+        self.assertEqual(result_of(r.register(self.app, 'foo')), None)
+        r.unregister(self.app, 'foo')
+        r.whenPublished(self.app, 'foo', lambda publisher: None)
+
+        self.assertEqual(r.watching.keys(), [('app', 'foo')])
+
+    def test_register(self):
+        self.assertEqual(result_of(self.first.register(self.app, 'foo')), None)
+
+        f = result_of(self.second.register(self.app, 'foo'))
+
+        self.assertTrue(isinstance(f, failure.Failure))
+        f.trap(exc.BadNameError)
+
+        self.first.unregister(self.app, 'foo')
+        self.assertEqual(result_of(self.second.register(self.app, 'foo')),
+            None)
+
+    def test_when_published(self):
+        publishers = []
+
+        self.second.whenPublished(self.app, 'foo', publishers.append)
+        self.second.whenPublished(self.app, 'foo', publishers.append)
+
+        # only one watch is sent per stream
+        self.assertEqual(len(self.second.protocol.commands), 1)
+        self.assertEqual(publishers, [])
+
+        self.first.register(self.app, 'foo')
+
+        self.assertEqual(len(publishers), 2)
+        self.assertTrue(isinstance(publishers[0], cluster.RelayedPublisher))
+        self.assertEqual(publishers[0].address, '/a')
+        self.assertEqual(len(self.reactor.connections), 2)
+        self.assertEqual(self.second.watching, {})
+
+    def test_already_published(self):
+        publishers = []
+
+        self.first.register(self.app, 'foo')
+        self.second.whenPublished(self.app, 'foo', publishers.append)
+
+        self.assertEqual(len(publishers), 1)
+
+        address, factory = self.reactor.connections[0]
+
+        self.assertEqual(address, '/a')
+        self.assertEqual(factory.name, 'foo')
+        self.assertTrue(factory.app is self.app)
+        self.assertTrue(factory.publisher is publishers[0])
+
+    def test_own_stream(self):
+        publishers = []
+
+        self.first.whenPublished(self.app, 'foo', publishers.append)
+        self.first.published('app', 'foo', '/a')
+
+        self.assertEqual(publishers, [])
+
+
+
+class Subscriber(object):
+    """
+    Records the events from a publisher.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def videoDataReceived(self, data, timestamp):
+        self.events.append(('video', data, timestamp))
+
+    def audioDataReceived(self, data, timestamp):
+        self.events.append(('audio', data, timestamp))
+
+    def onMetaData(self, data):
+        self.events.append(('meta', data))
+
+    def unpublish(self):
+        self.events.append(('unpublish',))
+
+
+
+class RelayTestCase(unittest.TestCase):
+    """
+    Tests for relaying a stream between L{cluster.RelayServerProtocol} and
+    L{cluster.RelayClientProtocol}.
+    """
+
+    def setUp(self):
+        self.origin = server.Application()
+        self.origin.name = 'app'
+
+        client = server.Client(None)
+        client.id = 'abc'
+
+        self.publisher = server.StreamPublisher(None, client)
+        self.publisher.maxCacheBytes = 0
+        self.origin.streams['foo'] = self.publisher
+
+        factory = server.ServerFactory()
+        factory.applications['app'] = self.origin
+
+        self.server = cluster.RelayServerFactory(factory).buildProtocol(None)
+        self.serverTransport = StringTransport()
+        self.server.makeConnection(self.serverTransport)
+
+        self.edge = server.Application()
+        self.edge.name = 'app'
+
+        self.relayed = cluster.RelayedPublisher('/a')
+        self.edge.streams['foo'] = self.relayed
+        self.subscriber = Subscriber()
+        self.relayed.addSubscriber(self.subscriber)
+
+        self.clientFactory = cluster.RelayClientFactory(self.edge, 'foo',
+            self.relayed)
+        self.client = self.clientFactory.buildProtocol(None)
+        self.clientTransport = StringTransport()
+        self.client.makeConnection(self.clientTransport)
+
+    def pump(self):
+        """
+        Delivers everything written by each end to the other.
+        """
+        while self.clientTransport.value() or self.serverTransport.value():
+            data = self.clientTransport.value()
+            self.clientTransport.clear()
+            self.server.dataReceived(data)
+
+            data = self.serverTransport.value()
+            self.serverTransport.clear()
+            self.client.dataReceived(data)
+
+    def test_subscribe(self):
+        self.pump()
+
+        self.assertTrue(self.server in self.publisher.subscribers)
+        self.assertTrue(self.relayed.relay is self.client)
+
+    def test_unknown_stream(self):
+        del self.origin.streams['foo']
+
+        self.pump()
+
+        self.assertEqual(self.subscriber.events, [('unpublish',)])
+        self.assertFalse('foo' in self.edge.streams)
+
+    def test_relay(self):
+        self.pump()
+
+        self.publisher.onMetaData({'width': 320})
+        self.publisher.videoDataReceived(KEYFRAME + 'foo', 0)
+        self.publisher.audioDataReceived('bar', 20)
+        self.pump()
+
+        self.assertEqual(self.subscriber.events, [
+            ('meta', {'width': 320}),
+            ('video', KEYFRAME + 'foo', 0),
+            ('audio', 'bar', 20),
+        ])
+
+    def test_unpublish(self):
+        self.pump()
+
+        self.publisher.unpublish()
+        self.pump()
+
+        self.assertEqual(self.subscriber.events, [('unpublish',)])
+        self.assertFalse('foo' in self.edge.streams)
+        self.assertTrue(self.serverTransport.disconnecting)
+
+    def test_connection_lost(self):
+        self.pump()
+
+        self.server.connectionLost(None)
+        self.client.connectionLost(None)
+
+        self.assertEqual(self.publisher.subscribers, {})
+        self.assertEqual(self.subscriber.events, [('unpublish',)])
+        self.assertFalse('foo' in self.edge.streams)
+
+    def test_last_subscriber(self):
+        self.pump()
+
+        self.relayed.removeSubscriber(self.subscriber)
+
+        self.assertTrue(self.clientTransport.disconnecting)
+
+    def test_stopped_before_connected(self):
+        relayed = cluster.RelayedPublisher('/a')
+        relayed.stop()
+
+        f = cluster.RelayClientFactory(self.edge, 'bar', relayed)
+        client = f.buildProtocol(None)
+        transport = StringTransport()
+        client.makeConnection(transport)
+
+        self.assertTrue(transport.disconnecting)
+        self.assertEqual(transport.value(), '')
+        self.assertEqual(relayed.relay, None)
+
+        client.connectionLost(None)
+
+        self.assertTrue(f.done)
+
+    def test_last_subscriber_before_connected(self):
+        relayed = cluster.RelayedPublisher('/a')
+        subscriber = Subscriber()
+
+        relayed.addSubscriber(subscriber)
+        relayed.removeSubscriber(subscriber)
+
+        f = cluster.RelayClientFactory(self.edge, 'bar', relayed)
+        transport = StringTransport()
+        f.buildProtocol(None).makeConnection(transport)
+
+        self.assertTrue(transport.disconnecting)
+        self.assertEqual(transport.value(), '')
+
+    def test_paused(self):
+        self.pump()
+
+        self.server.pauseProducing()
+        self.publisher.videoDataReceived(KEYFRAME + '1', 0)
+        self.server.resumeProducing()
+        self.publisher.videoDataReceived(INTERFRAME + '2', 40)
+        self.publisher.audioDataReceived('3', 40)
+        self.publisher.videoDataReceived(KEYFRAME + '4', 80)
+        self.pump()
+
+        self.assertEqual(self.subscriber.events, [
+            ('audio', '3', 40),
+            ('video', KEYFRAME + '4', 80),
+        ])
+
+
+
+class Registry(object):
+    """
+    An L{server.IStreamRegistry} that records the calls made to it.
+    """
+
+    def __init__(self):
+        self.registered = []
+        self.watching = []
+        self.result = None
+
+    def register(self, app, name):
+        self.registered.append(name)
+
+        if self.result is not None:
+            return defer.fail(self.result)
+
+        return defer.succeed(None)
+
+    def unregister(self, app, name):
+        self.registered.remove(name)
+
+    def whenPublished(self, app, name, cb):
+        self.watching.append((name, cb))
+
+
+
+class ApplicationTestCase(unittest.TestCase):
+    """
+    Tests for the cluster support in L{server.Application}.
+    """
+
+    def setUp(self):
+        self.registry = Registry()
+        self.factory = server.ServerFactory()
+        self.factory.registry = self.registry
+
+        self.app = server.Application()
+        self.app.factory = self.factory
+        self.app.name = 'app'
+
+        self.client = server.Client(None)
+        self.client.id = 'abc'
+
+    def test_registry(self):
+        self.assertTrue(self.app.getRegistry() is self.registry)
+
+        self.assertEqual(server.Application().getRegistry(), None)
+
+    def test_publish(self):
+        stream = Subscriber()
+        stream.name = 'foo'
+        d = self.app.publishStream(self.client, stream, 'foo')
+
+        publisher = result_of(d)
+
+        self.assertTrue(self.app.streams['foo'] is publisher)
+        self.assertEqual(self.registry.registered, ['foo'])
+
+        self.app.unpublishStream('foo', publisher)
+
+        self.assertEqual(self.registry.registered, [])
+
+    def test_publish_elsewhere(self):
+        self.registry.result = exc.BadNameError('taken')
+
+        d = self.app.publishStream(self.client, None, 'foo')
+
+        f = result_of(d)
+
+        self.assertTrue(isinstance(f, failure.Failure))
+        f.trap(exc.BadNameError)
+        self.assertEqual(self.app.streams, {})
+
+    def test_when_published(self):
+        publishers = []
+
+        self.app.whenPublished('foo', publishers.append)
+        self.app.whenPublished('foo', publishers.append)
+
+        self.assertEqual(len(self.registry.watching), 1)
+
+        relayed = cluster.RelayedPublisher('/a')
+        self.registry.watching[0][1](relayed)
+
+        self.assertEqual(publishers, [relayed, relayed])
+        self.assertTrue(self.app.streams['foo'] is relayed)
+
+    def test_published_locally(self):
+        """
+        A relay is not used if the stream has been published in this process
+        in the meantime.
+        """
+        stopped = []
+
+        self.app.whenPublished('foo', lambda publisher: None)
+        self.app.publishStream(self.client, None, 'foo')
+
+        relayed = cluster.RelayedPublisher('/a')
+        relayed.stop = lambda: stopped.append(True)
+        self.registry.watching[0][1](relayed)
+
+        self.assertEqual(stopped, [True])
+        self.assertFalse(self.app.streams['foo'] is relayed)
+
+
+
+class BindSocketTestCase(unittest.TestCase):
+    """
+    Tests for L{cluster.bind_socket}
+    """
+
+    def test_bind(self):
+        s = cluster.bind_socket('127.0.0.1', 0)
+        self.addCleanup(s.close)
+
+        self.assertNotEqual(s.getsockname()[1], 0)
+        self.assertEqual(s.gettimeout(), 0.0)
+
+    def test_reuse_port(self):
+        try:
+            first = cluster.bind_socket('127.0.0.1', 0, reusePort=True)
+        except (ValueError, socket.error):
+            raise unittest.SkipTest('SO_REUSEPORT is not supported')
+
+        self.addCleanup(first.close)
+
+        second = cluster.bind_socket('127.0.0.1', first.getsockname()[1],
+            reusePort=True)
+        self.addCleanup(second.close)
+
+    def test_supervisor_args(self):
+        s = cluster.Supervisor('foo.bar', 1935, workers=2, socketDir='/tmp/x')
+
+        args = s.getWorkerArgs(1)
+
+        self.assertEqual(args[1:4], ['-m', 'rtmpy.scripts.cluster',
+            '--worker'])
+        self.assertTrue('/tmp/x/relay-1.sock' in args)
+        self.assertEqual(args[-2:], ['--fd', '3'])
+
+        s = cluster.Supervisor('foo.bar', 1935, reusePort=True,
+            socketDir='/tmp/x')
+
+        self.assertTrue('--port' in s.getWorkerArgs(0))
+
+        self.assertRaises(ValueError, cluster.Supervisor, 'foo.bar', 0,
+            reusePort=True)
@@ -0,0 +1,287 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy.flv}
+"""
+
+from twisted.trial import unittest
+
+import pyamf
+
+from rtmpy import flv, exc
+
+
+class FrameTypeTestCase(unittest.TestCase):
+    """
+    Tests for L{flv.get_frame_type} and L{flv.is_keyframe}
+    """
+
+    def test_empty(self):
+        self.assertEqual(flv.get_frame_type(''), None)
+        self.assertFalse(flv.is_keyframe(''))
+
+    def test_keyframe(self):
+        self.assertEqual(flv.get_frame_type('\x17\x01'), flv.KEYFRAME)
+        self.assertTrue(flv.is_keyframe('\x17\x01'))
+        self.assertTrue(flv.is_keyframe('\x42'))
+
+    def test_inter_frame(self):
+        self.assertFalse(flv.is_keyframe('\x27\x01'))
+        self.assertFalse(flv.is_keyframe('\x32'))
+
+
+class SequenceHeaderTestCase(unittest.TestCase):
+    """
+    Tests for L{flv.is_avc_sequence_header} and L{flv.is_aac_sequence_header}
+    """
+
+    def test_avc(self):
+        self.assertTrue(flv.is_avc_sequence_header('\x17\x00\x00\x00\x00'))
+        self.assertFalse(flv.is_avc_sequence_header('\x17\x01\x00\x00\x00'))
+        self.assertFalse(flv.is_avc_sequence_header('\x12\x00'))
+        self.assertFalse(flv.is_avc_sequence_header('\x17'))
+
+    def test_aac(self):
+        self.assertTrue(flv.is_aac_sequence_header('\xaf\x00\x12\x10'))
+        self.assertFalse(flv.is_aac_sequence_header('\xaf\x01\x21'))
+        self.assertFalse(flv.is_aac_sequence_header('\x2f\x00'))
+        self.assertFalse(flv.is_aac_sequence_header(''))
+
+
+def make_flv(path, tags, meta=None):
+    """
+    Writes an FLV file containing C{tags}, a list of C{(tagType, timestamp,
+    data)} tuples, to C{path}.
+    """
+    f = open(path, 'wb')
+
+    try:
+        f.write(flv.encode_header())
+
+        if meta is not None:
+            f.write(flv.encode_tag(flv.TAG_SCRIPT, 0,
+                pyamf.encode('onMetaData', meta,
+                    encoding=pyamf.AMF0).getvalue()))
+
+        for tagType, timestamp, data in tags:
+            f.write(flv.encode_tag(tagType, timestamp, data))
+    finally:
+        f.close()
+
+
+class FLVFileTestCase(unittest.TestCase):
+    """
+    Tests for L{flv.FLVFile}
+    """
+
+    tags = [
+        (flv.TAG_VIDEO, 0, '\x17\x01key1'),
+        (flv.TAG_AUDIO, 10, '\xaf\x01audio'),
+        (flv.TAG_VIDEO, 40, '\x27\x01inter'),
+        (flv.TAG_VIDEO, 80, '\x17\x01key2'),
+        (flv.TAG_VIDEO, 0x1000000, '\x27\x01late'),
+    ]
+
+    def open(self, tags=None, meta=None):
+        path = self.mktemp()
+        make_flv(path, self.tags if tags is None else tags, meta)
+
+        f = flv.FLVFile(path)
+        self.addCleanup(f.close)
+
+        return f
+
+    def test_index(self):
+        f = self.open()
+
+        self.assertEqual(len(f), 5)
+        self.assertEqual(list(f.timestamps), [0, 10, 40, 80, 0x1000000])
+        self.assertEqual(list(f.keyframes), [0, 3])
+        self.assertEqual(list(f.keyframeTimes), [0, 80])
+        self.assertEqual(f.duration, 0x1000000)
+
+        for i, tag in enumerate(self.tags):
+            self.assertEqual(f.getTag(i), tag)
+
+    def test_meta(self):
+        f = self.open(meta={'duration': 2.5})
+
+        self.assertEqual(f.meta, {'duration': 2.5})
+        self.assertEqual(len(f), 5)
+
+    def test_seek(self):
+        f = self.open()
+
+        self.assertEqual(f.seek(0), 0)
+        self.assertEqual(f.seek(79), 0)
+        self.assertEqual(f.seek(80), 3)
+        self.assertEqual(f.seek(1000), 3)
+
+    def test_seek_audio_only(self):
+        f = self.open([(flv.TAG_AUDIO, t, 'a') for t in (0, 20, 40)])
+
+        self.assertEqual(f.seek(0), 0)
+        self.assertEqual(f.seek(30), 2)
+        self.assertEqual(f.seek(50), 3)
+
+    def test_truncated(self):
+        """
+        A partial tag at the end of the file is ignored.
+        """
+        path = self.mktemp()
+        make_flv(path, self.tags)
+
+        data = open(path, 'rb').read()
+        open(path, 'wb').write(data[:-10])
+
+        f = flv.FLVFile(path)
+        self.addCleanup(f.close)
+
+        self.assertEqual(len(f), 4)
+
+    def test_invalid(self):
+        path = self.mktemp()
+
+        open(path, 'wb').write('')
+        self.assertRaises(exc.FileStructureInvalid, flv.FLVFile, path)
+
+        open(path, 'wb').write('not an flv file')
+        self.assertRaises(exc.FileStructureInvalid, flv.FLVFile, path)
+
+
+class FLVWriterTestCase(unittest.TestCase):
+    """
+    Tests for L{flv.FLVWriter}
+    """
+
+    tags = FLVFileTestCase.tags[:4]
+
+    def setUp(self):
+        self.path = self.mktemp()
+
+    def write(self, tags, append=False):
+        writer = flv.FLVWriter(self.path, append)
+        writer.write(tags)
+        writer.close()
+
+        return writer
+
+    def open(self):
+        f = flv.FLVFile(self.path)
+        self.addCleanup(f.close)
+
+        return f
+
+    def test_write(self):
+        writer = flv.FLVWriter(self.path)
+
+        writer.write(self.tags[:2])
+        writer.write(self.tags[2:])
+
+        self.assertEqual(list(writer.timestamps), [0, 10, 40, 80])
+        self.assertEqual(list(writer.keyframes), [0, 3])
+
+        writer.close()
+
+        f = self.open()
+
+        self.assertEqual([f.getTag(i) for i in xrange(len(f))], self.tags)
+        self.assertEqual(list(f.keyframes), [0, 3])
+        self.assertEqual(f.length, len(open(self.path, 'rb').read()))
+
+    def test_index(self):
+        """
+        The index is saved on close and used when the file is opened.
+        """
+        self.write(self.tags)
+
+        index = flv.TagIndex()
+
+        self.assertTrue(index.loadIndex(self.path + flv.INDEX_SUFFIX,
+            len(open(self.path, 'rb').read())))
+        self.assertEqual(list(index.offsets), list(self.open().offsets))
+        self.assertEqual(list(index.keyframeTimes), [0, 80])
+
+    def test_stale_index(self):
+        """
+        An index that does not match the size of the file is ignored.
+        """
+        self.write(self.tags)
+
+        f = open(self.path, 'ab')
+        f.write(flv.encode_tag(flv.TAG_AUDIO, 90, 'more'))
+        f.close()
+
+        f = self.open()
+
+        self.assertEqual(len(f), 5)
+        self.assertEqual(f.getTag(4), (flv.TAG_AUDIO, 90, 'more'))
+
+    def test_meta(self):
+        meta = pyamf.encode('onMetaData', {'duration': 1.5},
+            encoding=pyamf.AMF0).getvalue()
+
+        self.write([(flv.TAG_SCRIPT, 0, meta)] + self.tags)
+
+        f = self.open()
+
+        self.assertEqual(f.meta, {'duration': 1.5})
+        self.assertEqual(len(f), 4)
+
+    def test_record(self):
+        """
+        An existing file is replaced.
+        """
+        self.write(self.tags)
+        self.write(self.tags[3:])
+
+        f = self.open()
+
+        self.assertEqual(f.getTag(0), self.tags[3])
+        self.assertEqual(len(f), 1)
+
+    def test_append(self):
+        self.write(self.tags[:2])
+        writer = self.write(self.tags[2:], True)
+
+        self.assertEqual(writer.timestampOffset, 10)
+
+        f = self.open()
+
+        self.assertEqual(list(f.timestamps), [0, 10, 50, 90])
+        self.assertEqual(list(f.keyframes), [0, 3])
+        self.assertEqual(f.getTag(3), (flv.TAG_VIDEO, 90, '\x17\x01key2'))
+
+    def test_append_truncated(self):
+        """
+        A partial tag at the end of the file is overwritten when appending.
+        """
+        make_flv(self.path, self.tags)
+
+        data = open(self.path, 'rb').read()
+        open(self.path, 'wb').write(data[:-10])
+
+        self.write([(flv.TAG_AUDIO, 0, 'after')], True)
+
+        f = self.open()
+
+        self.assertEqual(len(f), 4)
+        self.assertEqual(f.getTag(3), (flv.TAG_AUDIO, 40, 'after'))
+
+    def test_append_new(self):
+        self.write(self.tags, True)
+
+        self.assertEqual(len(self.open()), 4)
@@ -18,9 +18,12 @@ Tests for L{rtmpy.protocol.rtmp.message}.
 """
 
 import unittest
+
+import pyamf
 from pyamf.util import BufferedByteStream
 
 from rtmpy.protocol.rtmp import message
+from rtmpy import status
 
 
 class MockMessageListener(object):
@@ -345,6 +348,119 @@ class InvokeTestCase(BaseTestCase):
             [('invoke', (None, None, [], 54), {})])
 
 
+class EncodeCacheTestCase(BaseTestCase):
+    """
+    Tests for L{message.EncodeCache}
+    """
+
+    def setUp(self):
+        BaseTestCase.setUp(self)
+
+        self.cache = message.EncodeCache()
+
+    def encode(self, *values):
+        buf = BufferedByteStream()
+        self.cache.encode(pyamf.AMF0, list(values), buf)
+
+        return buf.getvalue()
+
+    def test_hit(self):
+        s = status.status('NetStream.Play.Start', 'Started playing foo',
+            clientid=1)
+
+        data = self.encode('onStatus', 0, None, s)
+
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.encode('onStatus', 0, None,
+            status.status('NetStream.Play.Start', 'Started playing foo',
+                clientid=1)), data)
+        self.assertEqual(self.cache.getStats(), {'entries': 1, 'hits': 1,
+            'misses': 1, 'skipped': 0, 'hitRate': 0.5})
+
+        s = status.status('NetStream.Play.Start', 'Started playing foo',
+            clientid=2)
+
+        self.assertNotEqual(self.encode('onStatus', 0, None, s), data)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_types(self):
+        """
+        Values that are equal but may encode differently have different keys.
+        """
+        for a, b in ((1, True), (0.0, -0.0), ('a', u'a'), ((1,), [1]),
+                ({'a': 1}, pyamf.ASObject(a=1))):
+            self.assertNotEqual(self.cache.getKey(pyamf.AMF0, [a]),
+                self.cache.getKey(pyamf.AMF0, [b]))
+
+        self.assertNotEqual(self.encode(1), self.encode(True))
+        self.assertNotEqual(self.encode(0.0), self.encode(-0.0))
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_encoding(self):
+        self.assertNotEqual(self.cache.getKey(pyamf.AMF0, ['a']),
+            self.cache.getKey(pyamf.AMF3, ['a']))
+
+    def test_uncacheable(self):
+        class Foo(object):
+            pass
+
+        pyamf.register_class(Foo, 'foo')
+        self.addCleanup(pyamf.unregister_class, Foo)
+
+        data = self.encode('_result', 1, Foo())
+
+        self.assertEqual(data, self.encode('_result', 1, Foo()))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.skipped, 2)
+
+    def test_lru(self):
+        self.cache.maxEntries = 2
+
+        self.encode('a')
+        self.encode('b')
+        self.encode('a')
+        self.encode('c')
+
+        self.assertEqual([k[1][1][0][1] for k in self.cache.entries],
+            ['a', 'c'])
+
+    def test_max_body_size(self):
+        self.cache.maxBodySize = 10
+
+        self.encode('x' * 10)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_clear(self):
+        self.encode('a')
+        self.cache.clear()
+
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_messages(self):
+        self.addCleanup(setattr, message.Invoke, 'encodeCache',
+            message.Invoke.encodeCache)
+        self.addCleanup(setattr, message.Notify, 'encodeCache',
+            message.Notify.encodeCache)
+
+        message.Invoke.encodeCache = self.cache
+        message.Notify.encodeCache = self.cache
+
+        message.Invoke('_result', 2, {'foo': 'bar'}).encode(self.buffer)
+        message.Notify('_result', 2, {'foo': 'bar'}).encode(self.buffer)
+
+        self.assertEqual(self.cache.hits, 1)
+
+        message.Invoke.encodeCache = None
+        message.Invoke('_result', 2, {'foo': 'bar'}).encode(self.buffer)
+
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.buffer.getvalue(), '\x02\x00\x07_result\x00@'
+            '\x00\x00\x00\x00\x00\x00\x00\x03\x00\x03foo\x02\x00\x03bar'
+            '\x00\x00\t' * 3)
+
+
 class BytesReadTestCase(BaseTestCase):
     """
     Tests for L{message.BytesRead}
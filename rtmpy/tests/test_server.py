@@ -18,12 +18,15 @@
 """
 """
 
+import os
+
 from twisted.trial import unittest
-from twisted.internet import defer, reactor, protocol
+from twisted.internet import defer, reactor, protocol, task
 from twisted.test.proto_helpers import StringTransportWithDisconnection, StringIOWithoutClosing
 
-from rtmpy import server, exc, rpc, util
-from rtmpy.protocol.rtmp import message
+from rtmpy import server, exc, rpc, util, flv
+from rtmpy.tests import test_flv
+from rtmpy.protocol.rtmp import message, codec
 
 
 
@@ -1162,6 +1165,269 @@ class PlayTestCase(ServerFactoryTestCase):
         return d
 
 
+    def test_replay_cache(self):
+        """
+        Cached a/v data is held by the stream until playing has started.
+        """
+        client = self.connect(self.app, self.protocol)
+
+        publisher = self.createStream(self.protocol.streamManager)
+        s = self.createStream(self.protocol.streamManager)
+
+        self.app.publishStream(client, publisher, 'foo')
+        self.app.streams['foo'].videoDataReceived('\x17\x01keyframe', 0)
+
+        d = s.play('foo')
+
+        def cb(res):
+            self.assertEqual(s._held, [])
+            self.assertNotEqual(s.queue, None)
+            self.assertTrue('\x17\x01keyframe' in self.transport.value())
+
+        d.addCallback(cb)
+
+        return d
+
+
+
+class FilePlayTestCase(ServerFactoryTestCase):
+    """
+    Tests for L{NetStream.play} with recorded streams.
+    """
+
+
+    def setUp(self):
+        ServerFactoryTestCase.setUp(self)
+
+        self.clock = task.Clock()
+        self.app = server.Application()
+        self.app.fileRoot = self.mktemp()
+        self.app.filePlayer = lambda f: server.FilePlayer(f, self.clock)
+
+        os.mkdir(self.app.fileRoot)
+        test_flv.make_flv(os.path.join(self.app.fileRoot, 'vod.flv'),
+            [(flv.TAG_VIDEO, 0, '\x17\x01keyframe')])
+
+        self.client = self.connect(self.app, self.protocol)
+        self.stream = self.createStream(self.protocol.streamManager)
+
+        return self.factory.registerApplication('foo', self.app)
+
+
+    def test_stream_path(self):
+        root = os.path.abspath(self.app.fileRoot)
+        path = os.path.join(root, 'vod.flv')
+
+        self.assertEqual(self.app.getStreamPath('vod'), path)
+        self.assertEqual(self.app.getStreamPath('vod.flv'), path)
+        self.assertEqual(self.app.getStreamPath('flv:vod'), path)
+        self.assertEqual(self.app.getStreamPath('missing'), None)
+        self.assertEqual(self.app.getStreamPath('../vod'), None)
+        self.assertEqual(self.app.getStreamPath(path[:-4]), path)
+
+        self.app.fileRoot = None
+        self.assertEqual(self.app.getStreamPath('vod'), None)
+
+
+    def test_play(self):
+        d = self.stream.play('vod')
+
+        def cb(res):
+            self.assertTrue(isinstance(res, server.FilePlayer))
+            self.assertTrue(self.stream.source is res)
+            self.assertTrue('\x17\x01keyframe' in self.transport.value())
+
+        d.addCallback(cb)
+
+        return d
+
+
+    def test_shorter_than_buffer(self):
+        """
+        A recording shorter than C{bufferTime} ends after the play statuses
+        have been sent.
+        """
+        statuses = []
+
+        def capture_status(code, description='', **kwargs):
+            statuses.append((getattr(code, 'code', code), description))
+
+        self.stream.sendStatus = capture_status
+
+        d = self.stream.play('vod')
+
+        def cb(player):
+            self.assertEqual([code for code, description in statuses], [
+                'NetStream.Play.Reset',
+                'NetStream.Play.Start',
+                'NetStream.Play.Stop'])
+            self.assertEqual(statuses[-1][1], 'Stopped playing vod.')
+            self.assertEqual(player.position, 1)
+
+        d.addCallback(cb)
+
+        return d
+
+
+    def test_offset(self):
+        d = self.stream.play('vod', 2)
+
+        def cb(player):
+            self.assertEqual(player.offset, 2000)
+
+        d.addCallback(cb)
+
+        return d
+
+
+    def test_live(self):
+        """
+        A published stream is played in preference to the recording.
+        """
+        self.app.publishStream(self.client, self.stream, 'vod')
+
+        d = self.stream.play('vod')
+
+        def cb(res):
+            self.assertTrue(isinstance(res, server.StreamPublisher))
+
+        d.addCallback(cb)
+
+        return d
+
+
+    def test_live_only(self):
+        d = self.stream.play('vod', -1)
+
+        self.assertFalse(d.called)
+
+
+    def test_not_found(self):
+        """
+        Asking for a recording that does not exist fails.
+        """
+        d = self.stream.play('missing', 0)
+
+        return self.assertFailure(d, exc.StreamNotFound)
+
+
+    def test_close(self):
+        d = self.stream.play('vod')
+
+        def close(player):
+            self.stream.closeStream()
+
+            self.assertEqual(player.subscriber, None)
+            self.assertEqual(player.file.map, None)
+
+        d.addCallback(close)
+
+        return d
+
+
+
+class RecordingTestCase(ServerFactoryTestCase):
+    """
+    Tests for publishing a stream with the C{record} and C{append} types.
+    """
+
+    def setUp(self):
+        ServerFactoryTestCase.setUp(self)
+
+        self.app = server.Application()
+        self.app.fileRoot = self.mktemp()
+        os.mkdir(self.app.fileRoot)
+
+        self.client = self.connect(self.app, self.protocol)
+        self.stream = self.createStream(self.protocol.streamManager)
+        self.stream_status = []
+
+        def capture_status(code, description='', **kwargs):
+            self.stream_status.append(getattr(code, 'code', code))
+
+        self.stream.sendStatus = capture_status
+
+        return self.factory.registerApplication('foo', self.app)
+
+
+    def test_record(self):
+        d = self.stream.publish('foo', 'record')
+
+        def cb(publisher):
+            recorder, = publisher.subscribers.keys()
+
+            self.assertTrue(isinstance(recorder, server.StreamRecorder))
+            self.assertEqual(recorder.path, os.path.join(
+                os.path.abspath(self.app.fileRoot), 'foo.flv'))
+            self.assertFalse(recorder.append)
+
+            self.assertEqual(self.stream_status,
+                ['NetStream.Publish.Start', 'NetStream.Record.Start'])
+
+            publisher.videoDataReceived('\x17\x01key', 0)
+            self.stream.closeStream()
+
+            self.assertEqual(self.stream_status[2:],
+                ['NetStream.Unpublish.Success', 'NetStream.Record.Stop'])
+
+            return recorder.stop()
+
+        def check(res):
+            f = flv.FLVFile(os.path.join(self.app.fileRoot, 'foo.flv'))
+            self.addCleanup(f.close)
+
+            self.assertEqual(f.getTag(0), (flv.TAG_VIDEO, 0, '\x17\x01key'))
+
+        d.addCallback(cb)
+        d.addCallback(check)
+
+        return d
+
+
+    def test_append(self):
+        d = self.stream.publish('foo', 'append')
+
+        def cb(publisher):
+            recorder, = publisher.subscribers.keys()
+
+            self.assertTrue(recorder.append)
+
+            return recorder.stop()
+
+        d.addCallback(cb)
+
+        return d
+
+
+    def test_live(self):
+        d = self.stream.publish('foo', 'live')
+
+        def cb(publisher):
+            self.assertEqual(publisher.subscribers, {})
+            self.assertEqual(self.stream_status, ['NetStream.Publish.Start'])
+
+        d.addCallback(cb)
+
+        return d
+
+
+    def test_no_access(self):
+        """
+        Recording is refused if there is nowhere to put the file.
+        """
+        self.app.fileRoot = None
+
+        d = self.stream.publish('foo', 'record')
+
+        def cb(res):
+            self.assertEqual(self.app.streams, {})
+
+        d = self.assertFailure(d, exc.RecordNoAccess)
+        d.addCallback(cb)
+
+        return d
+
+
 
 class Publisher(object):
     """
@@ -1269,3 +1535,1011 @@ class SendTestCase(ServerFactoryTestCase):
 
         self.clearMetaData()
         self.assertMetaData({})
+
+
+
+class Subscriber(object):
+    """
+    Records the a/v events relayed by a L{server.StreamPublisher}.
+    """
+
+    def __init__(self):
+        self.events = []
+
+
+    def videoDataReceived(self, data, timestamp):
+        self.events.append(('video', data, timestamp))
+
+
+    def audioDataReceived(self, data, timestamp):
+        self.events.append(('audio', data, timestamp))
+
+
+
+class SharedSubscriber(Subscriber):
+    """
+    A subscriber that accepts the shared C{frames} cache.
+    """
+
+    sharedFrames = True
+
+
+    def videoDataReceived(self, data, timestamp, frames):
+        self.events.append(('video', data, timestamp, frames))
+
+
+    def audioDataReceived(self, data, timestamp, frames):
+        self.events.append(('audio', data, timestamp, frames))
+
+
+
+class FragmentSubscriber(Subscriber):
+    """
+    A subscriber that accepts fragments.
+    """
+
+    def __init__(self):
+        Subscriber.__init__(self)
+
+        self.fragments = []
+
+
+    def fragmentReceived(self, datatype, data, timestamp, marker, bodyLength):
+        self.fragments.append((datatype, data, timestamp, marker))
+
+
+
+class StreamPublisherTestCase(unittest.TestCase):
+    """
+    Tests for L{server.StreamPublisher} relaying a/v data.
+    """
+
+
+    def setUp(self):
+        self.publisher = server.StreamPublisher(None, None)
+
+
+    def test_plain(self):
+        """
+        Subscribers that do not share frames are called as before.
+        """
+        s = Subscriber()
+
+        self.publisher.addSubscriber(s)
+        self.publisher.videoDataReceived('foo', 0)
+        self.publisher.audioDataReceived('bar', 10)
+
+        self.assertEqual(s.events, [('video', 'foo', 0), ('audio', 'bar', 10)])
+
+
+    def test_shared(self):
+        """
+        All sharing subscribers receive the same cache for a message and a new
+        cache is used for each message.
+        """
+        a, b = SharedSubscriber(), SharedSubscriber()
+
+        self.publisher.addSubscriber(a)
+        self.publisher.addSubscriber(b)
+
+        self.publisher.videoDataReceived('foo', 0)
+        self.publisher.videoDataReceived('bar', 10)
+
+        self.assertTrue(a.events[0][3] is b.events[0][3])
+        self.assertTrue(a.events[1][3] is b.events[1][3])
+        self.assertFalse(a.events[0][3] is a.events[1][3])
+
+
+    def test_net_stream(self):
+        """
+        L{server.NetStream} accepts the shared cache.
+        """
+        self.assertTrue(server.NetStream.sharedFrames)
+
+
+    def test_fragments(self):
+        """
+        Subscribers that accept fragments receive them as they arrive, others
+        receive the whole message.
+        """
+        a, b = FragmentSubscriber(), Subscriber()
+
+        self.publisher.maxCacheBytes = 0
+        self.publisher.addSubscriber(a)
+        self.publisher.addSubscriber(b)
+
+        self.publisher.fragmentReceived(message.VIDEO_DATA, 'foo', 10,
+            codec.FRAGMENT_START, 6)
+        self.assertEqual(b.events, [])
+
+        self.publisher.fragmentReceived(message.VIDEO_DATA, 'bar', 10,
+            codec.FRAGMENT_END, 6)
+
+        self.assertEqual(a.fragments, [
+            (message.VIDEO_DATA, 'foo', 10, codec.FRAGMENT_START),
+            (message.VIDEO_DATA, 'bar', 10, codec.FRAGMENT_END),
+        ])
+        self.assertEqual(b.events, [('video', 'foobar', 10)])
+
+
+    def test_fragments_not_assembled(self):
+        """
+        Without the cache or subscribers that need whole messages, fragments
+        are not kept.
+        """
+        self.publisher.maxCacheBytes = 0
+        self.publisher.addSubscriber(FragmentSubscriber())
+
+        self.publisher.fragmentReceived(message.VIDEO_DATA, 'foo', 0,
+            codec.FRAGMENT_START, 6)
+
+        self.assertEqual(self.publisher._fragments[message.VIDEO_DATA][1],
+            None)
+
+
+    def test_fragments_cached(self):
+        """
+        Fragmented messages are cached whole.
+        """
+        self.publisher.fragmentReceived(message.VIDEO_DATA, '\x17k', 0,
+            codec.FRAGMENT_START, 4)
+        self.publisher.fragmentReceived(message.VIDEO_DATA, 'ey', 0,
+            codec.FRAGMENT_END, 4)
+
+        s = Subscriber()
+        self.publisher.addSubscriber(s)
+
+        self.assertEqual(s.events, [('video', '\x17key', 0)])
+
+
+
+class GOPCacheTestCase(unittest.TestCase):
+    """
+    Tests for the group of pictures cache in L{server.StreamPublisher}.
+    """
+
+    avcHeader = '\x17\x00\x00\x00\x00\x01'
+    aacHeader = '\xaf\x00\x12\x10'
+    keyframe = '\x17\x01' + 'k' * 8
+    interframe = '\x27\x01' + 'i' * 8
+    audio = '\xaf\x01' + 'a' * 8
+
+
+    def setUp(self):
+        self.publisher = server.StreamPublisher(None, None)
+
+
+    def publish(self, *messages):
+        for kind, data, timestamp in messages:
+            if kind == 'video':
+                self.publisher.videoDataReceived(data, timestamp)
+            else:
+                self.publisher.audioDataReceived(data, timestamp)
+
+
+    def test_wait_for_keyframe(self):
+        self.publish(('video', self.interframe, 10), ('audio', self.audio, 20))
+
+        self.assertEqual(self.publisher.gop, [])
+        self.assertEqual(self.publisher.cacheBytes, 0)
+
+
+    def test_replay(self):
+        """
+        New subscribers receive the sequence headers and the group of pictures
+        since the last keyframe, rebased to start at 0.
+        """
+        self.publish(
+            ('video', self.avcHeader, 10),
+            ('audio', self.aacHeader, 10),
+            ('video', self.keyframe, 20),
+            ('video', self.interframe, 60),
+            ('video', self.keyframe, 100),
+            ('audio', self.audio, 110),
+            ('video', self.interframe, 140),
+        )
+
+        self.assertEqual(len(self.publisher.gop), 3)
+        self.assertEqual(self.publisher.cacheBytes, 30)
+
+        s = Subscriber()
+        self.publisher.addSubscriber(s)
+
+        self.assertEqual(s.events, [
+            ('video', self.avcHeader, 0),
+            ('audio', self.aacHeader, 0),
+            ('video', self.keyframe, 0),
+            ('audio', self.audio, 10),
+            ('video', self.interframe, 40),
+        ])
+
+        self.publish(('video', self.interframe, 180))
+
+        self.assertEqual(s.events[-1], ('video', self.interframe, 80))
+
+
+    def test_shared_frames(self):
+        """
+        The C{frames} cache is kept with each cached message.
+        """
+        a, b = SharedSubscriber(), SharedSubscriber()
+
+        self.publisher.addSubscriber(a)
+        self.publish(('video', self.keyframe, 0))
+        self.publisher.addSubscriber(b)
+
+        self.assertTrue(a.events[0][3] is b.events[0][3])
+
+
+    def test_split_frames_counted(self):
+        """
+        The bodies split into frames for the subscribers count towards
+        C{cacheBytes} while the message is cached.
+        """
+        a = SharedSubscriber()
+
+        self.publisher.addSubscriber(a)
+        self.publish(('video', self.keyframe, 0))
+
+        frames = a.events[0][3]
+
+        self.assertTrue(isinstance(frames, server.CachedFrames))
+
+        frames[(4, 5)] = 'x' * 15
+        self.assertEqual(self.publisher.cacheBytes, 25)
+
+        # not split, so not copied
+        frames[(128, 5)] = self.keyframe
+        self.assertEqual(self.publisher.cacheBytes, 25)
+
+        self.publish(('video', self.keyframe, 40))
+        self.assertEqual(self.publisher.cacheBytes, 10)
+
+        # no longer cached
+        frames[(8, 5)] = 'x' * 15
+        self.assertEqual(self.publisher.cacheBytes, 10)
+
+
+    def test_split_frames_limit(self):
+        """
+        The group of pictures is discarded once the split frames take it
+        past C{maxCacheBytes}.
+        """
+        self.publisher.maxCacheBytes = 25
+
+        a = SharedSubscriber()
+
+        self.publisher.addSubscriber(a)
+        self.publish(('video', self.keyframe, 0))
+
+        a.events[0][3][(4, 5)] = 'x' * 16
+
+        self.assertEqual(self.publisher.gop, [])
+        self.assertEqual(self.publisher.cacheBytes, 0)
+
+
+    def test_limit(self):
+        """
+        A group of pictures larger than C{maxCacheBytes} is discarded.
+        """
+        self.publisher.maxCacheBytes = 25
+
+        self.publish(('video', self.keyframe, 0), ('video', self.interframe, 40))
+        self.assertEqual(self.publisher.cacheBytes, 20)
+
+        self.publish(('video', self.interframe, 80))
+        self.assertEqual(self.publisher.gop, [])
+        self.assertEqual(self.publisher.cacheBytes, 0)
+
+        self.publish(('video', self.interframe, 120))
+        self.assertEqual(self.publisher.gop, [])
+
+
+    def test_disabled(self):
+        self.publisher.maxCacheBytes = 0
+
+        self.publish(('video', self.avcHeader, 0), ('video', self.keyframe, 0))
+
+        self.assertEqual(self.publisher.videoHeader, None)
+        self.assertEqual(self.publisher.gop, [])
+
+
+
+class FileSubscriber(Subscriber):
+    """
+    Records the events from a L{server.FilePlayer}.
+    """
+
+    def onMetaData(self, data):
+        self.events.append(('meta', data))
+
+
+    def playComplete(self):
+        self.events.append(('complete',))
+
+
+
+class FilePlayerTestCase(unittest.TestCase):
+    """
+    Tests for L{server.FilePlayer}
+    """
+
+    tags = [
+        (flv.TAG_VIDEO, 0, '\x17\x01key1'),
+        (flv.TAG_AUDIO, 500, '\xaf\x01audio'),
+        (flv.TAG_VIDEO, 1500, '\x27\x01inter'),
+        (flv.TAG_VIDEO, 3000, '\x17\x01key2'),
+        (flv.TAG_VIDEO, 3040, '\x27\x01inter2'),
+    ]
+
+
+    def setUp(self):
+        path = self.mktemp()
+        test_flv.make_flv(path, self.tags, {'duration': 3.04})
+
+        self.clock = task.Clock()
+        self.player = server.FilePlayer(flv.FLVFile(path), self.clock)
+        self.subscriber = FileSubscriber()
+
+        self.player.addSubscriber(self.subscriber)
+        self.addCleanup(self.player.removeSubscriber, self.subscriber)
+
+
+    def test_meta(self):
+        self.assertEqual(self.subscriber.events,
+            [('meta', {'duration': 3.04})])
+
+
+    def test_paced(self):
+        """
+        Tags are sent C{bufferTime} ahead of real time.
+        """
+        events = self.subscriber.events
+
+        self.player.start()
+
+        self.assertEqual(events[1:], [
+            ('video', '\x17\x01key1', 0),
+            ('audio', '\xaf\x01audio', 500),
+        ])
+
+        self.clock.advance(0.5)
+        self.assertEqual(len(events), 4)
+
+        self.clock.advance(1.5)
+        self.assertEqual(events[-1], ('video', '\x17\x01key2', 3000))
+
+        self.clock.advance(0.04)
+        self.assertEqual(events[-2:], [
+            ('video', '\x27\x01inter2', 3040),
+            ('complete',),
+        ])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_seek(self):
+        """
+        Seeking starts from the keyframe at or before the offset.
+        """
+        events = self.subscriber.events
+
+        self.player.start(3020)
+
+        self.assertEqual(events[1:], [
+            ('video', '\x17\x01key2', 3000),
+            ('video', '\x27\x01inter2', 3040),
+            ('complete',),
+        ])
+
+
+    def test_stop(self):
+        self.player.start()
+        self.player.removeSubscriber(self.subscriber)
+
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+
+class StreamRecorderTestCase(unittest.TestCase):
+    """
+    Tests for L{server.StreamRecorder}
+    """
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.recorder = server.StreamRecorder(self.path)
+        self.recorder.deferToThread = self.deferToThread
+
+        self.jobs = []
+
+
+    def deferToThread(self, func, *args):
+        d = defer.Deferred()
+        self.jobs.append((func, args, d))
+
+        return d
+
+
+    def runJobs(self):
+        """
+        Runs the jobs handed to the thread pool, including any that are
+        started as a result.
+        """
+        while self.jobs:
+            func, args, d = self.jobs.pop(0)
+
+            try:
+                res = func(*args)
+            except:
+                d.errback()
+            else:
+                d.callback(res)
+
+
+    def open(self):
+        f = flv.FLVFile(self.path)
+        self.addCleanup(f.close)
+
+        return [f.getTag(i) for i in xrange(len(f))], f.meta
+
+
+    def test_record(self):
+        r = self.recorder
+
+        r.onMetaData({'width': 320})
+        r.videoDataReceived('\x17\x01key', 0)
+        r.audioDataReceived('\xaf\x01audio', 10)
+
+        d = r.stop()
+        self.runJobs()
+
+        self.assertTrue(d.called)
+        self.assertEqual(self.open(), ([
+            (flv.TAG_VIDEO, 0, '\x17\x01key'),
+            (flv.TAG_AUDIO, 10, '\xaf\x01audio'),
+        ], {'width': 320}))
+
+
+    def test_batching(self):
+        """
+        Tags that arrive while a write is in progress are written together.
+        """
+        r = self.recorder
+
+        r.videoDataReceived('\x17\x01key', 0)
+        r.audioDataReceived('\xaf\x01a1', 10)
+        r.audioDataReceived('\xaf\x01a2', 20)
+
+        self.assertEqual(len(self.jobs), 1)
+        self.assertEqual(len(self.jobs[0][1][0]), 1)
+        self.assertEqual(r.pendingBytes, 8)
+
+        func, args, d = self.jobs.pop(0)
+        d.callback(func(*args))
+
+        self.assertEqual(len(self.jobs), 1)
+        self.assertEqual(len(self.jobs[0][1][0]), 2)
+        self.assertEqual(r.pending, [])
+        self.assertEqual(r.pendingBytes, 0)
+
+        r.stop()
+        self.runJobs()
+
+        self.assertEqual(len(self.open()[0]), 3)
+
+
+    def test_stop_waits(self):
+        """
+        The file is closed once the pending tags have been written.
+        """
+        r = self.recorder
+
+        r.videoDataReceived('\x17\x01key', 0)
+        d = r.stop()
+
+        r.videoDataReceived('\x27\x01late', 10)
+
+        self.assertFalse(d.called)
+        self.runJobs()
+        self.assertTrue(d.called)
+
+        self.assertEqual(len(self.open()[0]), 1)
+
+
+    def test_bounded(self):
+        """
+        When the buffer is full tags are dropped and video resumes at the next
+        keyframe.
+        """
+        r = self.recorder
+        r.maxBufferBytes = 24
+
+        r.videoDataReceived('\x17\x01key1', 0)
+
+        r.videoDataReceived('\x27\x01' + 'x' * 10, 40)
+        r.audioDataReceived('\xaf\x01' + 'x' * 10, 50)
+        self.assertEqual(r.pendingBytes, 24)
+        self.assertEqual(r.dropped, 0)
+
+        r.videoDataReceived('\x27\x01inter', 80)
+        self.assertEqual(r.dropped, 1)
+
+        self.runJobs()
+
+        r.videoDataReceived('\x27\x01inter', 120)
+        r.audioDataReceived('\xaf\x01audio', 130)
+        r.videoDataReceived('\x17\x01key2', 160)
+        r.stop()
+        self.runJobs()
+
+        self.assertEqual(r.dropped, 2)
+        self.assertEqual([t[1] for t in self.open()[0]],
+            [0, 40, 50, 130, 160])
+
+
+    def test_write_failed(self):
+        r = self.recorder
+
+        def fail(tags):
+            raise IOError('disk full')
+
+        r._write = fail
+
+        r.videoDataReceived('\x17\x01key', 0)
+        self.runJobs()
+
+        r.videoDataReceived('\x27\x01inter', 40)
+        self.assertEqual(self.jobs, [])
+
+        d = r.stop()
+        self.runJobs()
+
+        self.assertTrue(d.called)
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+
+
+    def test_unpublish(self):
+        self.recorder.unpublish()
+        self.runJobs()
+
+        self.assertTrue(self.recorder._stopped.called)
+
+
+    def test_thread_pool(self):
+        """
+        By default the file is written by the reactor's thread pool.
+        """
+        r = server.StreamRecorder(self.path, reactor=reactor)
+
+        r.videoDataReceived('\x17\x01key', 0)
+        r.audioDataReceived('\xaf\x01audio', 10)
+
+        d = r.stop()
+
+        def cb(res):
+            self.assertEqual(len(self.open()[0]), 2)
+
+        d.addCallback(cb)
+
+        return d
+
+
+
+class MockStreamingChannel(object):
+    """
+    Records the data sent through a L{codec.StreamingChannel}.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+
+    def sendData(self, data, timestamp, frames=None):
+        self.sent.append((data, timestamp))
+
+
+    def sendFragment(self, data, timestamp, marker, bodyLength):
+        self.sent.append((data, timestamp, marker))
+
+
+
+class SubscriberQueueTestCase(unittest.TestCase):
+    """
+    Tests for L{server.SubscriberQueue}
+    """
+
+    keyframe = '\x17' + 'k' * 9
+    interframe = '\x27' + 'i' * 9
+    audio = '\xaf' + 'a' * 9
+
+
+    def setUp(self):
+        self.audio_channel = MockStreamingChannel()
+        self.video_channel = MockStreamingChannel()
+
+        self.queue = server.SubscriberQueue(self.audio_channel,
+            self.video_channel)
+
+
+    def video(self, data, timestamp=0):
+        self.queue.push(message.VIDEO_DATA, data, timestamp)
+
+
+    def test_write_through(self):
+        self.video(self.keyframe)
+        self.video(self.interframe, 40)
+        self.queue.push(message.AUDIO_DATA, self.audio, 20)
+
+        self.assertEqual(self.video_channel.sent,
+            [(self.keyframe, 0), (self.interframe, 40)])
+        self.assertEqual(self.audio_channel.sent, [(self.audio, 20)])
+        self.assertEqual(self.queue.droppedFrames, 0)
+
+
+    def test_paused(self):
+        """
+        While paused, audio and keyframes are queued and inter frames are
+        dropped until the next keyframe.
+        """
+        self.queue.pauseProducing()
+
+        self.video(self.interframe, 0)
+        self.video(self.keyframe, 40)
+        self.queue.push(message.AUDIO_DATA, self.audio, 50)
+
+        self.assertEqual(self.video_channel.sent, [])
+        self.assertEqual(self.queue.size, 20)
+        self.assertEqual(self.queue.droppedFrames, 1)
+        self.assertEqual(self.queue.droppedBytes, 10)
+
+        self.queue.resumeProducing()
+
+        self.assertEqual(self.video_channel.sent, [(self.keyframe, 40)])
+        self.assertEqual(self.audio_channel.sent, [(self.audio, 50)])
+        self.assertEqual(self.queue.size, 0)
+
+
+    def test_wait_for_keyframe(self):
+        """
+        Inter frames following a dropped frame are dropped after resuming.
+        """
+        self.queue.pauseProducing()
+        self.video(self.interframe, 0)
+        self.queue.resumeProducing()
+
+        self.video(self.interframe, 40)
+        self.assertEqual(self.video_channel.sent, [])
+
+        self.video(self.keyframe, 80)
+        self.video(self.interframe, 120)
+
+        self.assertEqual(self.video_channel.sent,
+            [(self.keyframe, 80), (self.interframe, 120)])
+        self.assertEqual(self.queue.droppedFrames, 2)
+
+
+    def test_bounded(self):
+        """
+        The oldest messages are dropped once C{maxBytes} is exceeded.
+        """
+        self.queue.maxBytes = 25
+        self.queue.pauseProducing()
+
+        for i in range(5):
+            self.queue.push(message.AUDIO_DATA, self.audio, i * 20)
+
+        self.assertEqual(self.queue.size, 20)
+        self.assertEqual(len(self.queue.pending), 2)
+        self.assertEqual(self.queue.droppedFrames, 3)
+        self.assertEqual(self.queue.droppedBytes, 30)
+
+
+    def test_stop(self):
+        self.queue.pauseProducing()
+        self.video(self.keyframe)
+        self.queue.stopProducing()
+
+        self.assertEqual(self.queue.size, 0)
+        self.assertEqual(len(self.queue.pending), 0)
+
+
+    def fragments(self, data, timestamp=0, size=4):
+        for i in xrange(0, len(data), size):
+            marker = codec.FRAGMENT_CONTINUE
+
+            if i == 0:
+                marker |= codec.FRAGMENT_START
+
+            if i + size >= len(data):
+                marker |= codec.FRAGMENT_END
+
+            self.queue.pushFragment(message.VIDEO_DATA, data[i:i + size],
+                timestamp, marker, len(data))
+
+
+    def test_fragments_write_through(self):
+        """
+        Fragments are written as they arrive and other messages wait for the
+        end of the fragmented message.
+        """
+        self.queue.pushFragment(message.VIDEO_DATA, self.keyframe[:4], 0,
+            codec.FRAGMENT_START, 10)
+        self.queue.push(message.AUDIO_DATA, self.audio, 10)
+        self.queue.pauseProducing()
+
+        self.queue.pushFragment(message.VIDEO_DATA, self.keyframe[4:], 0,
+            codec.FRAGMENT_END, 10)
+
+        self.assertEqual(self.video_channel.sent, [
+            (self.keyframe[:4], 0, codec.FRAGMENT_START),
+            (self.keyframe[4:], 0, codec.FRAGMENT_END),
+        ])
+        self.assertEqual(self.audio_channel.sent, [])
+
+        self.queue.resumeProducing()
+
+        self.assertEqual(self.audio_channel.sent, [(self.audio, 10)])
+
+
+    def test_fragments_queued(self):
+        """
+        Fragments that arrive while paused are put back together and queued.
+        """
+        self.queue.pauseProducing()
+        self.fragments(self.keyframe, 40)
+
+        self.assertEqual(self.queue.size, 10)
+
+        self.queue.resumeProducing()
+
+        self.assertEqual(self.video_channel.sent, [(self.keyframe, 40)])
+
+
+    def test_fragments_dropped(self):
+        """
+        Fragmented inter frames are dropped while waiting for a keyframe.
+        """
+        self.queue.pauseProducing()
+        self.video(self.interframe)
+        self.queue.resumeProducing()
+
+        self.fragments(self.interframe, 40)
+
+        self.assertEqual(self.video_channel.sent, [])
+        self.assertEqual(self.queue.droppedFrames, 2)
+        self.assertEqual(self.queue.droppedBytes, 20)
+
+        self.fragments(self.keyframe, 80, size=10)
+
+        self.assertEqual(self.video_channel.sent, [(self.keyframe, 80,
+            codec.FRAGMENT_START | codec.FRAGMENT_END)])
+
+
+    def test_fragment_without_start(self):
+        self.queue.pushFragment(message.VIDEO_DATA, 'foo', 0,
+            codec.FRAGMENT_END, 10)
+
+        self.assertEqual(self.video_channel.sent, [])
+
+
+
+class QueueRegistrationTestCase(ServerFactoryTestCase):
+    """
+    Tests for L{server.NetConnection.registerQueue}
+    """
+
+
+    def test_register(self):
+        nc = self.protocol.nc
+        a, b = server.SubscriberQueue(None, None), server.SubscriberQueue(None, None)
+
+        nc.registerQueue(a)
+        nc.registerQueue(b)
+
+        self.assertTrue(self.transport.producer is nc)
+        self.assertTrue(self.transport.streaming)
+
+        nc.pauseProducing()
+        self.assertTrue(a.paused and b.paused)
+
+        nc.resumeProducing()
+        self.assertFalse(a.paused or b.paused)
+
+        nc.unregisterQueue(a)
+        self.assertTrue(self.transport.producer is nc)
+
+        nc.unregisterQueue(b)
+        self.assertEqual(self.transport.producer, None)
+
+
+
+class Origin(object):
+    """
+    Pretends to be the L{client.NetConnection} to an origin server.
+    """
+
+    def __init__(self):
+        self.streams = []
+        self.closed = False
+
+
+    def createStream(self):
+        stream = OriginStream()
+
+        self.streams.append(stream)
+
+        return defer.succeed(stream)
+
+
+    def close(self):
+        self.closed = True
+
+
+
+class OriginStream(object):
+    """
+    Pretends to be a L{client.NetStream} on an origin server.
+    """
+
+    listener = None
+
+
+    def play(self, name):
+        self.name = name
+        self.playing = defer.Deferred()
+
+        return self.playing
+
+
+
+class OriginPublisher(server.OriginPublisher):
+    """
+    Connects to a pretend origin server.
+    """
+
+    def connect(self):
+        self.connecting = defer.Deferred()
+
+        return self.connecting
+
+
+
+class OriginPullTestCase(unittest.TestCase):
+    """
+    Tests for L{server.Application} pulling streams from an origin server.
+    """
+
+
+    def setUp(self):
+        self.app = server.Application()
+        self.app.origin = 'rtmp://origin/live'
+        self.app.originPublisher = OriginPublisher
+
+        self.origin = Origin()
+
+
+    def play(self, name='foo'):
+        subscriber = Subscriber()
+        publishers = []
+
+        def cb(publisher):
+            publisher.addSubscriber(subscriber)
+            publishers.append(publisher)
+
+        self.app.whenPublished(name, cb)
+
+        return publishers[0], subscriber
+
+
+    def test_pull(self):
+        publisher, subscriber = self.play()
+
+        self.assertTrue(isinstance(publisher, OriginPublisher))
+        self.assertTrue(self.app.streams['foo'] is publisher)
+        self.assertEqual(publisher.url, 'rtmp://origin/live')
+
+        publisher.connecting.callback(self.origin)
+
+        stream, = self.origin.streams
+
+        self.assertEqual(stream.name, 'foo')
+        self.assertTrue(stream.listener is publisher)
+
+        stream.listener.videoDataReceived('\x17\x01', 10)
+
+        self.assertEqual(subscriber.events, [('video', '\x17\x01', 10)])
+
+
+    def test_shared(self):
+        """
+        All the subscribers share one connection to the origin.
+        """
+        publisher, a = self.play()
+        other, b = self.play()
+
+        self.assertTrue(publisher is other)
+        self.assertEqual(set(publisher.subscribers), set([a, b]))
+
+        publisher.connecting.callback(self.origin)
+
+        self.assertEqual(len(self.origin.streams), 1)
+
+
+    def test_local_first(self):
+        """
+        Streams published locally are not pulled.
+        """
+        client = server.Client(None)
+        client.id = 'abc'
+
+        local = self.app.publishStream(client, None, 'foo')
+        publisher, subscriber = self.play()
+
+        self.assertTrue(publisher is local)
+
+
+    def test_no_origin(self):
+        self.app.origin = None
+
+        self.app.whenPublished('foo', lambda publisher: None)
+
+        self.assertEqual(self.app.streams, {})
+        self.assertTrue('foo' in self.app._pendingPublishedCallbacks)
+
+
+    def test_last_subscriber(self):
+        """
+        The connection to the origin is closed when the last subscriber
+        leaves.
+        """
+        publisher, a = self.play()
+        publisher, b = self.play()
+
+        publisher.connecting.callback(self.origin)
+
+        publisher.removeSubscriber(a)
+
+        self.assertFalse(self.origin.closed)
+
+        publisher.removeSubscriber(b)
+
+        self.assertTrue(self.origin.closed)
+        self.assertFalse('foo' in self.app.streams)
+
+        # the next subscriber pulls the stream again
+        other, c = self.play()
+
+        self.assertFalse(other is publisher)
+
+
+    def test_unpublish(self):
+        publisher, subscriber = self.play()
+        subscriber.unpublish = lambda: subscriber.events.append('unpublish')
+
+        publisher.connecting.callback(self.origin)
+        self.origin.streams[0].listener.unpublish()
+
+        self.assertEqual(subscriber.events, ['unpublish'])
+        self.assertTrue(self.origin.closed)
+        self.assertFalse('foo' in self.app.streams)
+
+
+    def test_connect_failed(self):
+        publisher, subscriber = self.play()
+        subscriber.unpublish = lambda: subscriber.events.append('unpublish')
+
+        publisher.connecting.errback(RuntimeError('refused'))
+
+        self.assertEqual(subscriber.events, ['unpublish'])
+        self.assertFalse('foo' in self.app.streams)
+        self.flushLoggedErrors(RuntimeError)
+
+
+    def test_ended_while_connecting(self):
+        publisher, subscriber = self.play()
+
+        publisher.removeSubscriber(subscriber)
+        publisher.connecting.callback(self.origin)
+
+        self.assertTrue(self.origin.closed)
+        self.assertEqual(self.origin.streams, [])
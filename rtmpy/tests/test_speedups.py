@@ -0,0 +1,104 @@
+# Copyright the RTMPy Project
+#
+# RTMPy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# RTMPy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with RTMPy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for L{rtmpy._speedups}
+"""
+
+import sys
+import types
+
+from twisted.trial import unittest
+
+from rtmpy import _speedups
+from rtmpy.protocol.rtmp import header
+
+
+class InstallTestCase(unittest.TestCase):
+    """
+    Tests for L{_speedups.install}
+    """
+
+    def setUp(self):
+        self.patch(_speedups, 'enabled', True)
+        self.patch(_speedups, 'installed', [])
+
+        class Klass(object):
+            def spam(self):
+                return 'pure'
+
+        mod = types.ModuleType('rtmpy._speedups.fake')
+        mod.foo = 'compiled'
+        mod.Klass = type('Klass', (object,), {'spam': lambda self: 'compiled'})
+
+        sys.modules['rtmpy._speedups.fake'] = mod
+        self.addCleanup(sys.modules.pop, 'rtmpy._speedups.fake')
+
+        self.namespace = {
+            '__name__': 'rtmpy.fake',
+            'foo': 'pure',
+            'Klass': Klass,
+        }
+
+    def test_missing(self):
+        self.assertFalse(_speedups.install(self.namespace, 'missing'))
+        self.assertEqual(_speedups.installed, [])
+
+    def test_disabled(self):
+        _speedups.enabled = False
+
+        self.assertFalse(_speedups.install(self.namespace, 'fake'))
+        self.assertEqual(self.namespace['foo'], 'pure')
+
+    def test_compiled_source(self):
+        """
+        The compiled module does not try to install itself.
+        """
+        self.namespace['__name__'] = 'rtmpy._speedups.fake'
+
+        self.assertFalse(_speedups.install(self.namespace, 'fake'))
+        self.assertEqual(self.namespace['foo'], 'pure')
+
+    def test_all(self):
+        self.assertTrue(_speedups.install(self.namespace, 'fake'))
+
+        self.assertEqual(self.namespace['foo'], 'compiled')
+        self.assertEqual(self.namespace['__name__'], 'rtmpy.fake')
+        self.assertEqual(_speedups.installed, ['fake'])
+
+    def test_method(self):
+        klass = self.namespace['Klass']
+
+        self.assertTrue(_speedups.install(self.namespace, 'fake',
+            ['Klass.spam']))
+
+        self.assertIdentical(self.namespace['Klass'], klass)
+        self.assertEqual(klass().spam(), 'compiled')
+        self.assertEqual(self.namespace['foo'], 'pure')
+
+
+
+class BackendTestCase(unittest.TestCase):
+    """
+    Checks that the backend in use is the one that was asked for.
+    """
+
+    def test_header(self):
+        compiled = header.Header.__module__ == 'rtmpy._speedups.header'
+
+        self.assertEqual(compiled, 'header' in _speedups.installed)
+
+        if not _speedups.enabled:
+            self.assertFalse(compiled)
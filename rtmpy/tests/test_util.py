@@ -166,6 +166,84 @@ class GetCallableTargetTestCase(unittest.TestCase):
         self.assertTrue(c, '__call__')
 
 
+
+class GenerateBytesTestCase(unittest.TestCase):
+    """
+    Tests for L{util.generateBytes}
+    """
+
+    def test_length(self):
+        self.assertEqual(len(util.generateBytes(1528)), 1528)
+        self.assertEqual(util.generateBytes(0), '')
+
+    def test_type(self):
+        self.assertRaises(TypeError, util.generateBytes, '1')
+
+    def test_readable(self):
+        data = util.generateBytes(1000, readable=True)
+
+        self.assertEqual(len(data), 1000)
+
+        for c in data:
+            self.assertTrue(0x41 <= ord(c) <= 0x7a)
+
+    def test_pool(self):
+        pool = util.RandomPool(64, 0)
+        self.patch(util, 'randomPool', pool)
+
+        data = util.generateBytes(10)
+
+        self.assertEqual(data, pool.buffer[:10])
+        self.assertEqual(pool.pos, 10)
+
+
+
+class RandomPoolTestCase(unittest.TestCase):
+    """
+    Tests for L{util.RandomPool}
+    """
+
+    def setUp(self):
+        self.pool = util.RandomPool(100, 20)
+        self.refills = []
+
+        self.patch(self.pool, 'refill', lambda: self.refills.append(True))
+
+    def test_read(self):
+        a = self.pool.read(40)
+        b = self.pool.read(40)
+
+        self.assertEqual(a + b, self.pool.buffer[:80])
+        self.assertEqual(self.refills, [])
+
+    def test_low_water(self):
+        self.pool.read(81)
+
+        self.assertEqual(self.refills, [True])
+
+    def test_refilled(self):
+        buf = self.pool.buffer
+        self.pool.read(90)
+        self.pool.refilling = True
+
+        self.pool._refilled('x' * 100)
+
+        self.assertEqual(self.pool.read(10), buf[90:])
+        self.assertEqual(self.pool.read(5), 'xxxxx')
+        self.assertFalse(self.pool.refilling)
+
+    def test_exhausted(self):
+        """
+        A read larger than the remaining buffer refills synchronously.
+        """
+        self.pool.read(90)
+
+        data = self.pool.read(150)
+
+        self.assertEqual(len(data), 150)
+        self.assertEqual(self.pool.pos, 150)
+
+
 if not sys.platform.startswith('linux'):
     LinuxUptimeTestCase.skip = 'Tested platform is not linux'
 
@@ -24,7 +24,6 @@ RTMPy Utilities.
 import os.path
 import sys
 import time
-import random
 from urlparse import urlparse
 
 try:
@@ -234,34 +233,111 @@ def uptime():
     return now - boottime
 
 
+#: Maps each byte to the readable alphabet (C{A-z}) used by L{generateBytes}.
+_READABLE = ''.join([chr(0x41 + i % 58) for i in xrange(256)])
+
+#: If set, the L{RandomPool} that L{generateBytes} takes its bytes from.
+randomPool = None
+
+
+class RandomPool(object):
+    """
+    A pre-filled buffer of random bytes that L{generateBytes} slices from. Each
+    byte is only ever handed out once.
+
+    When less than C{lowWater} bytes remain, a new buffer is generated in a
+    thread from the reactor pool, so that a burst of handshakes does not wait
+    on C{os.urandom}. If the buffer runs dry before then, it is refilled
+    synchronously.
+
+    @ivar size: The number of bytes to generate per refill.
+    @ivar lowWater: When to start refilling in the background.
+    """
+
+    size = 256 * 1024
+
+    def __init__(self, size=None, lowWater=None):
+        if size is not None:
+            self.size = size
+
+        self.lowWater = lowWater
+
+        if self.lowWater is None:
+            self.lowWater = self.size // 4
+
+        self.buffer = os.urandom(self.size)
+        self.pos = 0
+        self.refilling = False
+
+    def _refilled(self, data):
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        self.refilling = False
+
+    def _refillFailed(self, fail):
+        self.refilling = False
+
+        return fail
+
+    def refill(self):
+        """
+        Generates more bytes in a background thread.
+        """
+        from twisted.internet import threads
+
+        self.refilling = True
+
+        d = threads.deferToThread(os.urandom, self.size)
+        d.addCallbacks(self._refilled, self._refillFailed)
+
+        return d
+
+    def read(self, length):
+        """
+        Returns C{length} random bytes.
+        """
+        end = self.pos + length
+
+        if end > len(self.buffer):
+            self._refilled(os.urandom(max(self.size, length)))
+            end = length
+
+        data = self.buffer[self.pos:end]
+        self.pos = end
+
+        if not self.refilling and len(self.buffer) - end < self.lowWater:
+            self.refill()
+
+        return data
+
+
 def generateBytes(length, readable=False):
     """
-    Generates a string of C{length} bytes of pseudo-random data. Used for
-    filling in the gaps in unknown sections of the handshake.
+    Generates a string of C{length} bytes of random data. Used for filling in
+    the gaps in unknown sections of the handshake.
 
-    This function is going to to called a lot and is ripe for moving into C.
+    The bytes come from L{randomPool} if one has been installed, otherwise
+    from C{os.urandom}.
 
     @param length: The number of bytes to generate.
     @type length: C{int}
+    @param readable: Restrict the bytes to the C{A-z} alphabet.
     @return: A random string of bytes, length C{length}.
     @rtype: C{str}
     @raise TypeError: C{int} expected for C{length}.
     """
-    # FIXME: sloooow
     if not isinstance(length, (int, long)):
         raise TypeError('int expected for length (got:%s)' % (type(length),))
 
-    bytes = ''
-
-    i, j = 0, 0xff
+    if randomPool is not None:
+        data = randomPool.read(length)
+    else:
+        data = os.urandom(length)
 
     if readable:
-        i, j = 0x41, 0x7a
-
-    for x in xrange(0, length):
-        bytes += chr(random.randint(i, j))
+        return data.translate(_READABLE)
 
-    return bytes
+    return data
 
 
 def get_callable_target(obj, name):
@@ -326,4 +402,4 @@ def getFailureMessage(failure):
         except IndexError:
             value = ""
 
-    return value
\ No newline at end of file
+    return value
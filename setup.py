@@ -72,7 +72,7 @@ def setup_package():
         author_email=author_email,
         keywords=keywords.strip(),
         license=license,
-        packages=find_packages(),
+        packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
         ext_modules=setupinfo.get_extensions(),
         install_requires=setupinfo.get_install_requirements(),
         tests_require=setupinfo.get_test_requirements(),
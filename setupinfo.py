@@ -132,9 +132,10 @@ class TrialTest(test.test):
         ('reactor=','r', "which reactor to use"),
         ('reporter=', None, "Customize Trial's output with a Reporter plugin."),
         ('until-failure','u', "Repeat test until it fails."),
+        ('pure', None, "Ignore the compiled extensions."),
     ]
 
-    boolean_options = ['coverage', 'debug-stacktraces', 'rterrors']
+    boolean_options = ['coverage', 'debug-stacktraces', 'rterrors', 'pure']
 
     def initialize_options(self):
         test.test.initialize_options(self)
@@ -144,6 +145,7 @@ class TrialTest(test.test):
         self.reporter = None
         self.rterrors = None
         self.until_failure = None
+        self.pure = None
 
     def finalize_options(self):
         if self.test_suite is None:
@@ -166,6 +168,10 @@ class TrialTest(test.test):
         # from this plugin will fail.
         from twisted.scripts import trial
 
+        if self.pure:
+            # see rtmpy._speedups
+            os.environ['RTMPY_PURE'] = '1'
+
         # Handle parsing the trial options passed through the setuptools
         # trial command.
         cmd_options = []
@@ -297,13 +303,15 @@ def get_extras_require():
 
 
 
-def make_extension(mod_name, **extra_options):
+def make_extension(mod_name, source_name=None, **extra_options):
     """
     Tries is best to return an Extension instance based on the mod_name
+
+    @param source_name: The module to compile C{mod_name} from, if different.
     """
     include_dirs = extra_options.setdefault('include_dirs', [])
 
-    base_name = os.path.join(mod_name.replace('.', os.path.sep))
+    base_name = os.path.join((source_name or mod_name).replace('.', os.path.sep))
 
     if have_cython:
         cpd = get_cpyamf_pxd_dir()
@@ -349,12 +357,16 @@ def get_extensions():
         return []
 
     extensions = []
+
+    # the compiled modules are built from the pure Python sources, see
+    # rtmpy._speedups
     mods = [
-        'rtmpy.protocol.rtmp.header'
+        ('rtmpy._speedups.header', 'rtmpy.protocol.rtmp.header'),
+        ('rtmpy._speedups.codec', 'rtmpy.protocol.rtmp.codec'),
     ]
 
-    for m in mods:
-        e = make_extension(m)
+    for m, source in mods:
+        e = make_extension(m, source)
 
         if e:
             extensions.append(e)